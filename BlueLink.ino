@@ -1,13 +1,17 @@
 /*
   BlueLink Arduino Firmware - Advanced
-  Version: 2.0
+  Version: 2.2
   Author: NerdsCorp
   
   Features:
     - Digital pin control (HIGH/LOW)
     - PWM support for analog outputs
-    - Stepper motor control (4-wire)
+    - Binary multi-pin frames (many pins in one message)
+    - Stepper motor control (4-wire), non-blocking with acceleration
+      ramps and a motion queue per motor
     - Servo support
+    - Input sampling at a fixed rate, streamed as binary telemetry
+      frames that carry only the inputs that changed
     - Real-time command processing
 */
 
@@ -20,17 +24,72 @@ const int MAX_DIGITAL_PINS = 14; // Arduino Uno pins 0-13
 const int MAX_ANALOG_PINS = 6;   // A0-A5
 const int BAUD_RATE = 115200;
 
-// Stepper motor state
+// Binary frame: FRAME_START, count, count x (pin | FRAME_PWM_FLAG, value), XOR checksum
+const byte FRAME_START = 0xB1;
+const byte FRAME_PWM_FLAG = 0x80;
+const int MAX_FRAME_PAIRS = 24;  // whole frame fits in the 64 byte serial buffer
+
+// Telemetry frame (board -> server): TELEMETRY_START, count, tick (ms, 2 bytes),
+// count x (pin, value high, value low), XOR checksum of everything after
+// TELEMETRY_START. Analog channels are sent as TELEMETRY_ANALOG_FLAG | channel.
+const byte TELEMETRY_START = 0xB2;
+const byte TELEMETRY_ANALOG_FLAG = 0x80;
+const int MAX_SAMPLE_HZ = 1000;
+const unsigned long TELEMETRY_KEYFRAME_MS = 1000;  // resend every input this often
+
+// Last value written to each output pin, so repeated writes are skipped
+const byte OUTPUT_NONE = 0;   // not driven by us (input, stepper coil, or unknown)
+const byte OUTPUT_DIGITAL = 1;
+const byte OUTPUT_PWM = 2;
+byte pinOutputs[MAX_DIGITAL_PINS];
+byte pinStates[MAX_DIGITAL_PINS];
+
+struct SampledInput {
+  byte pin;        // digital pin, or TELEMETRY_ANALOG_FLAG | analog channel
+  int lastSent;    // -1 until the first frame
+};
+
+SampledInput inputs[MAX_DIGITAL_PINS + MAX_ANALOG_PINS];
+int inputCount = 0;
+int sampleDeadband = 0;            // analog change needed before a value is resent
+unsigned long sampleInterval = 0;  // microseconds, 0 = sampling off
+unsigned long lastSampleTime = 0;
+unsigned long lastKeyframeTime = 0;
+
+// Stepper motors are stepped from loop() so serial commands keep being
+// processed while they move
+const int MAX_STEPPERS = 2;
+const int MOTION_QUEUE_SIZE = 4;
+const int DEFAULT_STEPS_PER_REV = 200;
+
+struct StepperMove {
+  long steps;     // signed, direction from sign
+  int speed;      // RPM
+  int accel;      // steps/s^2, 0 = start at full speed
+};
+
 struct StepperMotor {
   int pins[4];
   int currentStep;
   int stepsPerRev;
   unsigned long lastStepTime;
-  int stepDelay;
+  unsigned long stepDelay;  // microseconds until the next step
   bool active;
+  
+  long position;            // steps since the motor was initialized
+  long remaining;           // steps left in the current move
+  int direction;
+  float rate;               // current steps/s
+  float maxRate;            // target steps/s of the current move
+  float accel;              // steps/s^2 of the current move
+  bool moving;
+  
+  StepperMove queue[MOTION_QUEUE_SIZE];
+  byte queueHead;
+  byte queueCount;
 };
 
-StepperMotor stepper;
+StepperMotor steppers[MAX_STEPPERS];
 const int STEPPER_SEQUENCE[8][4] = {
   {1, 0, 0, 0},
   {1, 1, 0, 0},
@@ -49,75 +108,328 @@ void sendStatus(const String &message) {
   Serial.println("STATUS:" + message);
 }
 
+// Forget what we wrote to a pin that something else now drives
+void releasePin(int pin) {
+  if (pin >= 0 && pin < MAX_DIGITAL_PINS) {
+    pinOutputs[pin] = OUTPUT_NONE;
+  }
+}
+
 void setPinValue(int pin, int value) {
   if (pin >= 0 && pin < MAX_DIGITAL_PINS) {
-    pinMode(pin, OUTPUT);
-    digitalWrite(pin, value > 0 ? HIGH : LOW);
+    byte state = value > 0 ? HIGH : LOW;
+    if (pinOutputs[pin] == OUTPUT_DIGITAL && pinStates[pin] == state) {
+      return;
+    }
+    if (pinOutputs[pin] == OUTPUT_NONE) {
+      pinMode(pin, OUTPUT);
+    }
+    digitalWrite(pin, state);
+    pinOutputs[pin] = OUTPUT_DIGITAL;
+    pinStates[pin] = state;
   }
 }
 
 void setPWMValue(int pin, int value) {
   // PWM pins on Uno: 3, 5, 6, 9, 10, 11
   if (pin == 3 || pin == 5 || pin == 6 || pin == 9 || pin == 10 || pin == 11) {
-    pinMode(pin, OUTPUT);
-    analogWrite(pin, constrain(value, 0, 255));
+    byte duty = constrain(value, 0, 255);
+    if (pinOutputs[pin] == OUTPUT_PWM && pinStates[pin] == duty) {
+      return;
+    }
+    if (pinOutputs[pin] == OUTPUT_NONE) {
+      pinMode(pin, OUTPUT);
+    }
+    analogWrite(pin, duty);
+    pinOutputs[pin] = OUTPUT_PWM;
+    pinStates[pin] = duty;
   } else {
     sendStatus("ERROR: Pin " + String(pin) + " does not support PWM");
   }
 }
 
-void initStepper(int pin1, int pin2, int pin3, int pin4, int stepsPerRev) {
-  stepper.pins[0] = pin1;
-  stepper.pins[1] = pin2;
-  stepper.pins[2] = pin3;
-  stepper.pins[3] = pin4;
+void initStepper(StepperMotor &stepper, int pins[4], int stepsPerRev) {
+  for (int i = 0; i < 4; i++) {
+    stepper.pins[i] = pins[i];
+  }
   stepper.stepsPerRev = stepsPerRev;
   stepper.currentStep = 0;
+  stepper.position = 0;
+  stepper.moving = false;
+  stepper.queueHead = 0;
+  stepper.queueCount = 0;
   stepper.active = true;
   
   for (int i = 0; i < 4; i++) {
-    pinMode(stepper.pins[i], OUTPUT);
-    digitalWrite(stepper.pins[i], LOW);
+    if (stepper.pins[i] >= 0) {
+      releasePin(stepper.pins[i]);
+      pinMode(stepper.pins[i], OUTPUT);
+      digitalWrite(stepper.pins[i], LOW);
+    }
   }
   
-  sendStatus("Stepper initialized on pins " + String(pin1) + "," + String(pin2) + "," + String(pin3) + "," + String(pin4));
+  sendStatus("Stepper initialized on pins " + String(pins[0]) + "," + String(pins[1]) + "," + String(pins[2]) + "," + String(pins[3]));
 }
 
-void stepMotor(int steps, int speed) {
+// Find the stepper driven by these pins, or set up a free slot for them.
+// When every slot is taken, a stepper that has finished its moves is reused.
+int findStepper(int pins[4]) {
+  int freeSlot = -1;
+  int idleSlot = -1;
+  for (int i = 0; i < MAX_STEPPERS; i++) {
+    if (steppers[i].active && steppers[i].pins[0] == pins[0]) {
+      return i;
+    }
+    if (!steppers[i].active) {
+      if (freeSlot < 0) freeSlot = i;
+    } else if (!steppers[i].moving && steppers[i].queueCount == 0 && idleSlot < 0) {
+      idleSlot = i;
+    }
+  }
+  if (freeSlot < 0) {
+    freeSlot = idleSlot;
+  }
+  if (freeSlot >= 0) {
+    initStepper(steppers[freeSlot], pins, DEFAULT_STEPS_PER_REV);
+  }
+  return freeSlot;
+}
+
+bool queueMove(StepperMotor &stepper, long steps, int speed, int accel) {
+  if (stepper.queueCount >= MOTION_QUEUE_SIZE) {
+    return false;
+  }
+  byte tail = (stepper.queueHead + stepper.queueCount) % MOTION_QUEUE_SIZE;
+  stepper.queue[tail].steps = steps;
+  stepper.queue[tail].speed = speed;
+  stepper.queue[tail].accel = accel;
+  stepper.queueCount++;
+  return true;
+}
+
+void coilsOff(StepperMotor &stepper) {
+  for (int i = 0; i < 4; i++) {
+    if (stepper.pins[i] >= 0) {
+      digitalWrite(stepper.pins[i], LOW);
+    }
+  }
+}
+
+void reportStepper(int index, const char *state) {
+  StepperMotor &stepper = steppers[index];
+  sendStatus("STEPPER " + String(stepper.pins[0]) + " " + state + " POS " + String(stepper.position) +
+             " QUEUE " + String(stepper.queueCount));
+}
+
+void startNextMove(StepperMotor &stepper) {
+  StepperMove &move = stepper.queue[stepper.queueHead];
+  stepper.queueHead = (stepper.queueHead + 1) % MOTION_QUEUE_SIZE;
+  stepper.queueCount--;
+  
+  stepper.direction = (move.steps > 0) ? 1 : -1;
+  stepper.remaining = labs(move.steps);
+  stepper.maxRate = max(1.0f, (float)move.speed * stepper.stepsPerRev / 60.0f);
+  stepper.accel = move.accel;
+  // With a ramp, the first step runs at the speed reached after one step
+  stepper.rate = (move.accel > 0) ? min(stepper.maxRate, (float)sqrt(2.0f * move.accel)) : stepper.maxRate;
+  stepper.stepDelay = 0;
+  stepper.lastStepTime = micros();
+  stepper.moving = stepper.remaining > 0;
+}
+
+// Advance one stepper by at most one step; called on every loop()
+void updateStepper(int index) {
+  StepperMotor &stepper = steppers[index];
   if (!stepper.active) {
-    sendStatus("ERROR: Stepper not initialized");
     return;
   }
+  if (!stepper.moving) {
+    if (stepper.queueCount == 0) {
+      return;
+    }
+    startNextMove(stepper);
+    if (!stepper.moving) {
+      reportStepper(index, "DONE");
+      return;
+    }
+  }
   
-  // Calculate delay between steps (RPM to microseconds)
-  int stepsPerSecond = (speed * stepper.stepsPerRev) / 60;
-  int stepDelay = 1000000 / stepsPerSecond;
-  
-  int direction = (steps > 0) ? 1 : -1;
-  steps = abs(steps);
+  unsigned long now = micros();
+  if (now - stepper.lastStepTime < stepper.stepDelay) {
+    return;
+  }
+  stepper.lastStepTime = now;
   
-  for (int i = 0; i < steps; i++) {
-    // Get current step in sequence
-    int stepIndex = stepper.currentStep % 8;
-    
-    // Set pins according to sequence
-    for (int j = 0; j < 4; j++) {
+  // Set pins according to sequence
+  int stepIndex = stepper.currentStep % 8;
+  for (int j = 0; j < 4; j++) {
+    if (stepper.pins[j] >= 0) {
       digitalWrite(stepper.pins[j], STEPPER_SEQUENCE[stepIndex][j]);
     }
+  }
+  
+  stepper.currentStep += stepper.direction;
+  if (stepper.currentStep < 0) stepper.currentStep = 7;
+  if (stepper.currentStep > 7) stepper.currentStep = 0;
+  stepper.position += stepper.direction;
+  stepper.remaining--;
+  
+  if (stepper.remaining == 0) {
+    stepper.moving = false;
+    // Keep the coils energized if another move follows straight away
+    if (stepper.queueCount == 0) {
+      coilsOff(stepper);
+    }
+    reportStepper(index, "DONE");
+    return;
+  }
+  
+  // Trapezoidal ramp: v^2 = v0^2 +/- 2*a per step, braking when the
+  // remaining distance equals the stopping distance
+  if (stepper.accel > 0) {
+    float brakingSteps = (stepper.rate * stepper.rate) / (2.0f * stepper.accel);
+    if (stepper.remaining <= brakingSteps) {
+      stepper.rate = sqrt(max(2.0f * stepper.accel, stepper.rate * stepper.rate - 2.0f * stepper.accel));
+    } else if (stepper.rate < stepper.maxRate) {
+      stepper.rate = min(stepper.maxRate, (float)sqrt(stepper.rate * stepper.rate + 2.0f * stepper.accel));
+    }
+  }
+  stepper.stepDelay = (unsigned long)(1000000.0f / stepper.rate);
+}
+
+void stopStepper(int index) {
+  StepperMotor &stepper = steppers[index];
+  stepper.queueCount = 0;
+  stepper.moving = false;
+  coilsOff(stepper);
+  reportStepper(index, "STOPPED");
+}
+
+// Read and apply one binary frame (FRAME_START is still in the buffer)
+void readFrame() {
+  byte header[2];
+  if (Serial.readBytes(header, 2) != 2 || header[1] > MAX_FRAME_PAIRS) {
+    sendStatus("ERROR: Bad frame header");
+    return;
+  }
+  
+  byte count = header[1];
+  byte body[MAX_FRAME_PAIRS * 2 + 1];
+  size_t length = count * 2 + 1;
+  if (Serial.readBytes(body, length) != length) {
+    sendStatus("ERROR: Truncated frame");
+    return;
+  }
+  
+  byte checksum = count;
+  for (size_t i = 0; i < length - 1; i++) {
+    checksum ^= body[i];
+  }
+  if (checksum != body[length - 1]) {
+    sendStatus("ERROR: Bad frame checksum");
+    return;
+  }
+  
+  for (byte i = 0; i < count; i++) {
+    byte pin = body[i * 2] & ~FRAME_PWM_FLAG;
+    byte value = body[i * 2 + 1];
+    if (body[i * 2] & FRAME_PWM_FLAG) {
+      setPWMValue(pin, value);
+    } else {
+      setPinValue(pin, value);
+    }
+  }
+  
+  // Avoid String here, frames are the high-rate path
+  Serial.print(F("STATUS:FRAME "));
+  Serial.println(count);
+}
+
+// Configure sampling from "A0,A1,2", or turn it off with an empty list
+bool configureSampling(const String &pins, int hz, int deadband) {
+  inputCount = 0;
+  sampleInterval = 0;
+  int start = 0;
+  while (start < (int)pins.length()) {
+    int comma = pins.indexOf(',', start);
+    if (comma < 0) comma = pins.length();
+    String name = pins.substring(start, comma);
+    name.trim();
+    start = comma + 1;
+    if (name.length() == 0) continue;
     
-    stepper.currentStep += direction;
-    if (stepper.currentStep < 0) stepper.currentStep = 7;
-    if (stepper.currentStep > 7) stepper.currentStep = 0;
-    
-    delayMicroseconds(stepDelay);
+    byte pin;
+    if (name.charAt(0) == 'A') {
+      int channel = name.substring(1).toInt();
+      if (channel < 0 || channel >= MAX_ANALOG_PINS) return false;
+      pin = TELEMETRY_ANALOG_FLAG | channel;
+    } else {
+      int digital = name.toInt();
+      // 0 and 1 are the serial port
+      if (digital < 2 || digital >= MAX_DIGITAL_PINS) return false;
+      pin = digital;
+      releasePin(digital);
+      pinMode(digital, INPUT);
+    }
+    if (inputCount >= MAX_DIGITAL_PINS + MAX_ANALOG_PINS) return false;
+    inputs[inputCount].pin = pin;
+    inputs[inputCount].lastSent = -1;
+    inputCount++;
   }
   
-  // Turn off all coils
-  for (int i = 0; i < 4; i++) {
-    digitalWrite(stepper.pins[i], LOW);
+  if (inputCount > 0) {
+    sampleInterval = 1000000UL / constrain(hz, 1, MAX_SAMPLE_HZ);
+    sampleDeadband = max(0, deadband);
+    lastSampleTime = micros();
+    lastKeyframeTime = millis() - TELEMETRY_KEYFRAME_MS;  // first frame carries every input
+  }
+  return true;
+}
+
+// Read every sampled input and send the ones that changed as one frame
+void sampleInputs() {
+  unsigned long now = millis();
+  bool keyframe = now - lastKeyframeTime >= TELEMETRY_KEYFRAME_MS;
+  if (keyframe) {
+    lastKeyframeTime = now;
+  }
+  
+  byte body[3 + (MAX_DIGITAL_PINS + MAX_ANALOG_PINS) * 3];
+  byte count = 0;
+  for (int i = 0; i < inputCount; i++) {
+    SampledInput &input = inputs[i];
+    int value;
+    int deadband = 0;
+    if (input.pin & TELEMETRY_ANALOG_FLAG) {
+      value = analogRead(A0 + (input.pin & ~TELEMETRY_ANALOG_FLAG));
+      deadband = sampleDeadband;
+    } else {
+      value = digitalRead(input.pin);
+    }
+    if (!keyframe && input.lastSent >= 0 && abs(value - input.lastSent) <= deadband) {
+      continue;
+    }
+    input.lastSent = value;
+    body[3 + count * 3] = input.pin;
+    body[4 + count * 3] = highByte(value);
+    body[5 + count * 3] = lowByte(value);
+    count++;
+  }
+  if (count == 0) {
+    return;
   }
   
-  sendStatus("Moved " + String(steps) + " steps");
+  body[0] = count;
+  body[1] = highByte(now & 0xFFFF);
+  body[2] = lowByte(now & 0xFFFF);
+  size_t length = 3 + count * 3;
+  byte checksum = 0;
+  for (size_t i = 0; i < length; i++) {
+    checksum ^= body[i];
+  }
+  Serial.write(TELEMETRY_START);
+  Serial.write(body, length);
+  Serial.write(checksum);
 }
 
 // Parse comma-separated values
@@ -146,19 +458,42 @@ void setup() {
   sendStatus("PWM pins: 3,5,6,9,10,11");
   
   // Initialize all digital pins as outputs (LOW)
+  for (int i = 0; i < MAX_DIGITAL_PINS; i++) {
+    pinOutputs[i] = OUTPUT_NONE;
+  }
   for (int i = 2; i < MAX_DIGITAL_PINS; i++) {
-    pinMode(i, OUTPUT);
-    digitalWrite(i, LOW);
+    setPinValue(i, 0);
   }
   
-  stepper.active = false;
+  for (int i = 0; i < MAX_STEPPERS; i++) {
+    steppers[i].active = false;
+  }
 }
 
 // -----------------------------
 // MAIN LOOP
 // -----------------------------
 void loop() {
+  for (int i = 0; i < MAX_STEPPERS; i++) {
+    updateStepper(i);
+  }
+  
+  if (sampleInterval > 0 && micros() - lastSampleTime >= sampleInterval) {
+    lastSampleTime += sampleInterval;
+    // Don't try to catch up after a long blocking command (e.g. TEST)
+    if (micros() - lastSampleTime >= sampleInterval) {
+      lastSampleTime = micros();
+    }
+    sampleInputs();
+  }
+  
   if (Serial.available() > 0) {
+    // Frames start with a non-ASCII byte, so they never collide with text commands
+    if (Serial.peek() == FRAME_START) {
+      readFrame();
+      return;
+    }
+    
     String line = Serial.readStringUntil('\n');
     line.trim();
 
@@ -166,8 +501,14 @@ void loop() {
     // SET:<pin>:<value>              -> Digital write (0/1)
     // PWM:<pin>:<value>              -> PWM write (0-255)
     // TEST:<pin>                     -> Blink test
-    // STEPPER:<p1>,<p2>,<p3>,<p4>:<steps>:<speed>  -> Control stepper
+    // STEPPER:<p1>,<p2>,<p3>,<p4>:<steps>:<speed>[:<accel>]  -> Queue a stepper move
+    // STEPPER_STOP:<p1>              -> Stop a stepper and clear its queue
+    // STEPPERS                       -> Report position and queue of every stepper
+    // SAMPLE:<pins>:<hz>[:<deadband>] -> Stream inputs (e.g. A0,A1,2) as telemetry frames
+    // SAMPLE:OFF                     -> Stop streaming inputs
     // INFO                           -> Get info
+    // 0xB1 <count> <pin,value>... <xor>  -> Binary multi-pin frame (see readFrame)
+    // Replies are STATUS: lines, plus 0xB2 telemetry frames while sampling (see sampleInputs)
     
     if (line.startsWith("SET:")) {
       int firstColon = line.indexOf(':');
@@ -197,30 +538,78 @@ void loop() {
       sendStatus("TESTED PIN " + String(pin));
       
     } else if (line.startsWith("STEPPER:")) {
-      // Format: STEPPER:pin1,pin2,pin3,pin4:steps:speed
+      // Format: STEPPER:pin1,pin2,pin3,pin4:steps:speed[:accel]
       int firstColon = line.indexOf(':');
       int secondColon = line.indexOf(':', firstColon + 1);
       int thirdColon = line.indexOf(':', secondColon + 1);
+      int fourthColon = line.indexOf(':', thirdColon + 1);
       
       String pinsStr = line.substring(firstColon + 1, secondColon);
-      int steps = line.substring(secondColon + 1, thirdColon).toInt();
-      int speed = line.substring(thirdColon + 1).toInt();
+      long steps = line.substring(secondColon + 1, thirdColon).toInt();
+      int speed = (fourthColon > 0) ? line.substring(thirdColon + 1, fourthColon).toInt() : line.substring(thirdColon + 1).toInt();
+      int accel = (fourthColon > 0) ? line.substring(fourthColon + 1).toInt() : 0;
       
-      // Parse pins
-      int pins[4];
+      // Parse pins (unused pins stay -1)
+      int pins[4] = {-1, -1, -1, -1};
       parseCSV(pinsStr, pins, 4);
       
-      // Initialize stepper if not already done
-      if (!stepper.active || stepper.pins[0] != pins[0]) {
-        initStepper(pins[0], pins[1], pins[2], pins[3], 200);
+      int index = findStepper(pins);
+      if (index < 0) {
+        sendStatus("ERROR: No free stepper slot");
+      } else if (!queueMove(steppers[index], steps, speed, accel)) {
+        sendStatus("ERROR: Stepper queue full");
+      } else {
+        reportStepper(index, "QUEUED");
+      }
+      
+    } else if (line.startsWith("STEPPER_STOP:")) {
+      int pin = line.substring(line.indexOf(':') + 1).toInt();
+      bool found = false;
+      for (int i = 0; i < MAX_STEPPERS; i++) {
+        if (steppers[i].active && steppers[i].pins[0] == pin) {
+          stopStepper(i);
+          found = true;
+        }
+      }
+      if (!found) {
+        sendStatus("ERROR: No stepper on pin " + String(pin));
       }
       
-      stepMotor(steps, speed);
+    } else if (line.equals("STEPPERS")) {
+      for (int i = 0; i < MAX_STEPPERS; i++) {
+        if (steppers[i].active) {
+          reportStepper(i, steppers[i].moving ? "MOVING" : "IDLE");
+        }
+      }
+      
+    } else if (line.equals("SAMPLE:OFF")) {
+      configureSampling("", 0, 0);
+      sendStatus("SAMPLE OFF");
+      
+    } else if (line.startsWith("SAMPLE:")) {
+      // Format: SAMPLE:A0,A1,2:hz[:deadband]
+      int firstColon = line.indexOf(':');
+      int secondColon = line.indexOf(':', firstColon + 1);
+      int thirdColon = line.indexOf(':', secondColon + 1);
+      
+      String pinsStr = line.substring(firstColon + 1, secondColon);
+      int hz = (thirdColon > 0) ? line.substring(secondColon + 1, thirdColon).toInt() : line.substring(secondColon + 1).toInt();
+      int deadband = (thirdColon > 0) ? line.substring(thirdColon + 1).toInt() : 0;
+      
+      if (secondColon < 0 || hz <= 0 || !configureSampling(pinsStr, hz, deadband)) {
+        configureSampling("", 0, 0);
+        sendStatus("ERROR: Bad sample config " + line.substring(firstColon + 1));
+      } else {
+        sendStatus("SAMPLE " + String(inputCount) + " PINS AT " + String(constrain(hz, 1, MAX_SAMPLE_HZ)) + " HZ");
+      }
       
     } else if (line.equals("INFO")) {
       sendStatus("DIGITAL_PINS:2-13");
       sendStatus("PWM_PINS:3,5,6,9,10,11");
       sendStatus("ANALOG_PINS:A0-A5");
+      sendStatus("FRAME_MAX_PAIRS:" + String(MAX_FRAME_PAIRS));
+      sendStatus("SAMPLE_MAX_HZ:" + String(MAX_SAMPLE_HZ));
+      sendStatus("SAMPLING:" + String(inputCount) + " PINS");
       
     } else {
       sendStatus("UNKNOWN COMMAND: " + line);
@@ -7,23 +7,44 @@ Features:
 - Advanced pin configurations
 """
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, Request, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Float, Boolean
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, func, inspect, select, text, Column, Index, Integer, MetaData, String, ForeignKey, Float, Boolean
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import sessionmaker, Session, relationship, selectinload, object_session
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from typing import Optional
+from collections import Counter, OrderedDict, deque
 import serial
 import serial.tools.list_ports
 import subprocess
 import os
 import tempfile
+import hashlib
+import base64
+import uuid
+import threading
+import itertools
+import time
+import json
+import asyncio
+import bisect
+import logging
+import hmac
+import signal
+import socket
+import struct
+import sys
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 # ============================================================================
 # CONFIGURATION
@@ -31,8 +52,47 @@ import tempfile
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey-change-in-production")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./bluelink.db")
 JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+LOGIN_MAX_ATTEMPTS = int(os.getenv("LOGIN_MAX_ATTEMPTS", "5"))
+LOGIN_WINDOW_SECONDS = float(os.getenv("LOGIN_WINDOW_SECONDS", "300"))
 ARDUINO_BAUD_RATE = int(os.getenv("ARDUINO_BAUD_RATE", "115200"))
 ARDUINO_TIMEOUT = int(os.getenv("ARDUINO_TIMEOUT", "1"))
+ARDUINO_QUEUE_SIZE = int(os.getenv("ARDUINO_QUEUE_SIZE", "256"))
+ARDUINO_BATCH_FRAMES = os.getenv("ARDUINO_BATCH_FRAMES", "1") == "1"
+TELEMETRY_BUFFER_SIZE = int(os.getenv("TELEMETRY_BUFFER_SIZE", "500"))
+INPUT_BUFFER_SIZE = int(os.getenv("INPUT_BUFFER_SIZE", "4096"))  # input frames kept per board
+ACK_TIMEOUT = float(os.getenv("ACK_TIMEOUT", "5"))
+RECONNECT_INTERVAL = float(os.getenv("RECONNECT_INTERVAL", "1"))
+RECONNECT_MAX_BACKOFF = float(os.getenv("RECONNECT_MAX_BACKOFF", "30"))
+FIRMWARE_CACHE_DIR = os.getenv("FIRMWARE_CACHE_DIR", "./firmware_cache")
+FIRMWARE_WORKERS = int(os.getenv("FIRMWARE_WORKERS", "4"))
+FIRMWARE_JOB_HISTORY = 100
+STATE_MIRROR_INTERVAL = float(os.getenv("STATE_MIRROR_INTERVAL", "0.25"))
+STATE_MIRROR_QUEUE = 64  # deltas buffered per dashboard before it is resynced
+PORT_SCAN_INTERVAL = float(os.getenv("PORT_SCAN_INTERVAL", "2"))
+SSE_KEEPALIVE = 15
+RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "./recordings")
+RECORD_FLUSH_INTERVAL = float(os.getenv("RECORD_FLUSH_INTERVAL", "0.5"))
+REPLAY_JOB_HISTORY = 100
+CONTROL_LOOP_HZ = float(os.getenv("CONTROL_LOOP_HZ", "250"))
+SHAPING_FLUSH_HZ = float(os.getenv("SHAPING_FLUSH_HZ", "50"))  # without the loop: catch-up rate for smoothed/rate-limited outputs
+NODE_NAME = os.getenv("NODE_NAME", "local")  # this host's name; boards with no node live here
+NODE_TOKEN = os.getenv("NODE_TOKEN", "")  # shared secret for agent nodes; empty disables /ws/node
+AGENT_MODE = __name__ == "__main__" and any(arg.split("=")[0] == "--agent" for arg in sys.argv[1:])  # agents keep no database
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "0") == "1"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+OWNER_SOCKET = os.getenv("OWNER_SOCKET", "")  # set by --workers: this process is an HTTP worker
+WORKER_METRICS_INTERVAL = float(os.getenv("WORKER_METRICS_INTERVAL", "5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text or json
 
 # Security warning for default SECRET_KEY
 if SECRET_KEY == "supersecretkey-change-in-production":
@@ -43,6 +103,190 @@ if SECRET_KEY == "supersecretkey-change-in-production":
         category=UserWarning
     )
 
+# ============================================================================
+# LOGGING & METRICS
+# ============================================================================
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, including fields passed with ``extra={...}``"""
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+logger = logging.getLogger("bluelink")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        _handler.setFormatter(JsonLogFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def _label_key(names, labels):
+    return tuple(str(labels.get(name, "")) for name in names)
+
+class CounterMetric:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labels, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [("", self.labels, key, value) for key, value in self.values.items()]
+
+class HistogramMetric:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        samples = []
+        names = self.labels + ("le",)
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                samples.append(("_bucket", names, key + (f"{bound:g}",), cumulative))
+            samples.append(("_bucket", names, key + ("+Inf",), count))
+            samples.append(("_sum", self.labels, key, total))
+            samples.append(("_count", self.labels, key, count))
+        return samples
+
+class CollectedMetric:
+    """A gauge or counter read from existing state at scrape time"""
+    def __init__(self, name, help, kind, labels, collect):
+        self.name, self.help, self.kind, self.labels = name, help, kind, tuple(labels)
+        self.collect = collect  # () -> {label tuple: value}
+
+    def samples(self):
+        return [("", self.labels, key, value) for key, value in self.collect().items()]
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry"""
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(CounterMetric(name, help, labels))
+
+    def histogram(self, name, help, labels=(), **kwargs):
+        return self._add(HistogramMetric(name, help, labels, **kwargs))
+
+    def collected(self, name, help, kind, labels, collect):
+        return self._add(CollectedMetric(name, help, kind, labels, collect))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Samples recorded in this process, to be merged into another process's render"""
+        return {metric.name: metric.samples() for metric in self.metrics if not isinstance(metric, CollectedMetric)}
+
+    def render(self, merge=()):
+        """Text exposition; samples from ``merge`` snapshots are added to this process's"""
+        def escape(value):
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            samples = {}
+            for snapshot in (metric.samples(), *(other.get(metric.name, []) for other in merge)):
+                for suffix, names, key, value in snapshot:
+                    series = (suffix, names, key)
+                    samples[series] = samples.get(series, 0) + value
+            for (suffix, names, key), value in samples.items():
+                labels = ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, key))
+                value = value if isinstance(value, int) else repr(float(value))
+                lines.append(f"{metric.name}{suffix}{{{labels}}} {value}" if labels
+                             else f"{metric.name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+metrics = MetricsRegistry()
+metric_http_seconds = metrics.histogram(
+    "bluelink_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+metric_auth_seconds = metrics.histogram(
+    "bluelink_auth_duration_seconds", "Bearer token validation time", ("result",), buckets=FAST_BUCKETS)
+metric_db_seconds = metrics.histogram(
+    "bluelink_db_query_duration_seconds", "Database statement time", ("operation",), buckets=FAST_BUCKETS)
+metric_commands = metrics.counter(
+    "bluelink_commands_sent_total", "Commands written to a board", ("board", "kind"))
+metric_serial_bytes = metrics.counter(
+    "bluelink_serial_bytes_written_total", "Bytes written to a board", ("board",))
+metric_serial_write_seconds = metrics.histogram(
+    "bluelink_serial_write_duration_seconds", "Time spent in one serial write", ("board",), buckets=FAST_BUCKETS)
+metric_send_failures = metrics.counter(
+    "bluelink_send_failures_total", "Commands that could not be queued or written", ("board", "reason"))
+metric_login_rejected = metrics.counter(
+    "bluelink_login_rejected_total", "Logins turned away before checking the password", ("reason",))
+metric_disconnects = metrics.counter(
+    "bluelink_disconnects_total", "Board connections lost", ("board",))
+metric_input_frames = metrics.counter(
+    "bluelink_input_frames_total", "Input telemetry frames received from a board", ("board", "result"))
+metric_firmware_seconds = metrics.histogram(
+    "bluelink_firmware_job_duration_seconds", "Firmware build and upload time", ("status",),
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+
+# Read from live state on each scrape
+metrics.collected(
+    "bluelink_board_connected", "1 while the board's serial link is up", "gauge", ("board",),
+    lambda: {(name,): int(name in arduino_manager.writers) for name in list(arduino_manager.registry)})
+metrics.collected(
+    "bluelink_serial_queue_depth", "Commands waiting in a board's writer", "gauge", ("board",),
+    lambda: {(name,): writer.depth() for name, writer in list(arduino_manager.writers.items())})
+metrics.collected(
+    "bluelink_node_bytes_total", "Bytes relayed to and from agent nodes on the current link", "counter",
+    ("node", "direction"),
+    lambda: {(name, direction): session.stats[f"bytes_{direction}"]
+             for name, session in list(node_hub.sessions.items()) for direction in ("in", "out")})
+metrics.collected(
+    "bluelink_control_loop_ticks_total", "Control loop ticks run", "counter", (),
+    lambda: {(): control_loop.stats["ticks"]})
+metrics.collected(
+    "bluelink_control_loop_overruns_total", "Control loop ticks that ran past the next deadline", "counter", (),
+    lambda: {(): control_loop.stats["overruns"]})
+
 # ============================================================================
 # DATABASE MODELS
 # ============================================================================
@@ -56,17 +300,32 @@ class User(Base):
 
 class Arduino(Base):
     __tablename__ = 'arduinos'
+    __table_args__ = (
+        Index("ix_arduinos_node_port", "node", "serial_port", unique=True),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
-    serial_port = Column(String, unique=True, nullable=False)
+    serial_port = Column(String, nullable=False)
     board_type = Column(String, default="uno")  # uno, mega, nano, etc.
+    hwid = Column(String, nullable=True)  # USB hardware id, used to find the board after a replug
+    node = Column(String, nullable=False, default="", server_default="")  # agent host the board is plugged into; "" = this host
+
+class Profile(Base):
+    __tablename__ = 'profiles'
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    active = Column(Boolean, default=False)  # exactly one profile drives the boards
 
 class Mapping(Base):
     __tablename__ = 'mappings'
+    __table_args__ = (
+        Index("ix_mappings_profile_input", "profile_id", "controller_input", unique=True),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    controller_input = Column(String, nullable=False)  # button, axis, trigger
+    profile_id = Column(Integer, ForeignKey('profiles.id'), nullable=True)
+    controller_input = Column(String, nullable=False, index=True)  # button, axis, trigger
     input_type = Column(String, default="digital")  # digital, analog, pwm
-    arduino_id = Column(Integer, ForeignKey('arduinos.id'))
+    arduino_id = Column(Integer, ForeignKey('arduinos.id'), index=True)
     arduino_pin = Column(String, nullable=False)
     pin_mode = Column(String, default="output")  # output, pwm, stepper
     
@@ -74,6 +333,13 @@ class Mapping(Base):
     min_value = Column(Integer, default=0)
     max_value = Column(Integer, default=255)
     invert = Column(Boolean, default=False)
+
+    # Input shaping (NULL = off)
+    deadzone = Column(Float, nullable=True)          # 0..1 of the input range ignored around rest
+    curve = Column(String, nullable=True)            # linear, expo:0.5, points:0,0 0.5,0.2 1,1
+    smoothing = Column(Float, nullable=True)         # 0 = none .. 0.95 = heavy low-pass
+    change_threshold = Column(Integer, nullable=True)  # min PWM change worth sending
+    max_rate_hz = Column(Float, nullable=True)       # max updates per second for this pin
     
     # Stepper settings
     stepper_steps = Column(Integer, default=200)  # steps per revolution
@@ -84,180 +350,3008 @@ class Mapping(Base):
     
     arduino = relationship("Arduino")
 
-# ============================================================================
-# DATABASE SETUP
-# ============================================================================
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)
+# ============================================================================
+# DATABASE SETUP
+# ============================================================================
+def engine_options(url):
+    """Pool settings for a database URL.
+
+    SQLite connections are shared across the threadpool; server databases
+    get a sized pool whose connections are checked before use.
+    """
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def async_database_url(url):
+    """The async driver URL for DATABASE_URL (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith(("postgresql:", "postgres:")):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets dashboard reads run while a write is committing
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    operation = statement.split(None, 1)[0].upper()
+    # Schema checks and connection setup would skew the per-operation latencies
+    if operation != "PRAGMA":
+        metric_db_seconds.observe(time.perf_counter() - started, operation=operation)
+
+def _query_failed(context):
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+def instrument(sync_engine):
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _sqlite_pragmas)
+    event.listen(sync_engine, "before_cursor_execute", _query_started)
+    event.listen(sync_engine, "after_cursor_execute", _query_finished)
+    event.listen(sync_engine, "handle_error", _query_failed)
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument(engine)
+
+# Optional async engine for the async endpoints (needs aiosqlite or asyncpg)
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_ASYNC:
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        url = async_database_url(DATABASE_URL)
+        async_engine = create_async_engine(url, **engine_options(url))
+        AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+        instrument(async_engine.sync_engine)
+    except ImportError as e:
+        logger.warning(f"⚠️  DATABASE_ASYNC is set but the async driver is missing ({e}), using the threadpool")
+
+def ensure_columns():
+    """Add columns that are missing from tables created by an older version.
+
+    create_all only creates missing tables; new nullable columns are added
+    here so existing databases keep working without a migration tool.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}"))
+
+def upgrade_arduinos():
+    """Move arduinos from UNIQUE(serial_port) to one port per node.
+
+    Local boards used to be stored with node NULL, which the (node,
+    serial_port) index treats as distinct; they are backfilled to "" first.
+    The old single-column constraint is dropped, which on SQLite means
+    rebuilding the table.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        duplicates = conn.execute(text(
+            "SELECT serial_port FROM arduinos WHERE node IS NULL OR node = '' "
+            "GROUP BY serial_port HAVING COUNT(*) > 1")).scalars().all()
+        if duplicates:
+            raise RuntimeError(f"Several local boards share serial port(s) {', '.join(duplicates)}; "
+                               "remove the duplicates from the arduinos table and restart")
+        conn.execute(text("UPDATE arduinos SET node = '' WHERE node IS NULL"))
+
+    constraints = [c for c in inspector.get_unique_constraints("arduinos") if c["column_names"] == ["serial_port"]]
+    indexes = [i for i in inspector.get_indexes("arduinos") if i["unique"] and i["column_names"] == ["serial_port"]]
+    if not constraints and not indexes:
+        return
+    logger.info("🗄️  Dropping the old UNIQUE(serial_port) constraint on arduinos")
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            upgraded = Arduino.__table__.to_metadata(MetaData(), name="arduinos_upgrade")
+            columns = ", ".join(column.name for column in upgraded.columns)
+            conn.execute(CreateTable(upgraded))
+            conn.execute(text(f"INSERT INTO arduinos_upgrade ({columns}) SELECT {columns} FROM arduinos"))
+            conn.execute(text("DROP TABLE arduinos"))
+            conn.execute(text("ALTER TABLE arduinos_upgrade RENAME TO arduinos"))
+        else:
+            for constraint in constraints:
+                if not constraint.get("name"):
+                    raise RuntimeError("Cannot drop the unnamed UNIQUE(serial_port) constraint on arduinos")
+                conn.execute(text(f'ALTER TABLE arduinos DROP CONSTRAINT "{constraint["name"]}"'))
+            for index in indexes:
+                conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+
+def ensure_indexes():
+    """Create indexes that were declared after their table was created"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                logger.warning(f"⚠️  Could not create index {index.name}: {e}")
+
+def setup_database():
+    """Create missing tables and bring older databases up to date"""
+    Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    upgrade_arduinos()
+    ensure_indexes()
+
+if not AGENT_MODE:
+    setup_database()
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def fetch_all(statement):
+    """Run a read-only select from an async endpoint.
+
+    Uses the async engine when DATABASE_ASYNC is on, otherwise a pooled
+    sync session in the threadpool; either way the event loop never blocks.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            return (await session.execute(statement)).scalars().all()
+
+    def run():
+        with SessionLocal() as session:
+            return session.execute(statement).scalars().all()
+    return await run_in_threadpool(run)
+
+# ============================================================================
+# AUTHENTICATION
+# ============================================================================
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_password(plain: str, hashed: str) -> bool:
+    return pwd_context.verify(plain, hashed)
+
+def create_access_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
+
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    """bcrypt on its own small thread pool.
+
+    Hashing never runs on the event loop or the request threadpool, so a
+    burst of logins queues here instead of starving the control endpoints.
+    At most ``max_pending`` operations may wait; beyond that callers get
+    PasswordHasherBusy and should retry later.
+    """
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+        self.pending = 0  # only touched from the event loop
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain, hashed):
+        return await self._run(verify_password, plain, hashed)
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE)
+
+class LoginLimiter:
+    """Sliding-window limit on failed logins per username and client address.
+
+    Once a user has ``max_attempts`` failures from one address inside
+    ``window`` seconds, further attempts from that address are refused
+    without checking the password until the oldest failure expires. A
+    successful login clears that address's history. Keying by address means
+    nobody can lock a user out from elsewhere; the price is that an attacker
+    with many addresses gets ``max_attempts`` guesses from each.
+    """
+    def __init__(self, max_attempts, window, max_users=10000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_users = max_users
+        self.attempts = OrderedDict()  # (username, client) -> deque of attempt times
+        self.lock = threading.Lock()
+
+    def retry_after(self, username, client):
+        """Seconds until the user may try again from this client, 0 if not locked out"""
+        now = time.monotonic()
+        with self.lock:
+            attempts = self.attempts.get((username, client))
+            while attempts and now - attempts[0] > self.window:
+                attempts.popleft()
+            if attempts and len(attempts) >= self.max_attempts:
+                return self.window - (now - attempts[0])
+            return 0
+
+    def failed(self, username, client):
+        key = (username, client)
+        with self.lock:
+            attempts = self.attempts.get(key)
+            if attempts is None:
+                attempts = self.attempts[key] = deque()
+                if len(self.attempts) > self.max_users:
+                    self.attempts.popitem(last=False)
+            self.attempts.move_to_end(key)
+            attempts.append(time.monotonic())
+
+    def succeeded(self, username, client):
+        with self.lock:
+            self.attempts.pop((username, client), None)
+
+login_limiter = LoginLimiter(LOGIN_MAX_ATTEMPTS, LOGIN_WINDOW_SECONDS)
+
+class TokenCache:
+    """Bounded cache of validated tokens and the users they resolve to.
+
+    Each entry expires with its token's ``exp``, so a hit skips both the JWT
+    decode and the User query. The least recently used entries are
+    evicted first.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # token -> (user, expires at)
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            user, expires = entry
+            if time.time() >= expires:
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return user
+
+    def put(self, token, user, expires):
+        with self.lock:
+            self.entries[token] = (user, expires)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate_user(self, username):
+        with self.lock:
+            for token in [t for t, (user, _) in self.entries.items() if user.username == username]:
+                del self.entries[token]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    token_cache.invalidate_user(target.username)
+    # The other workers drop it once the change is committed
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.username)
+
+@event.listens_for(Session, "after_commit")
+def _broadcast_changed_users(session):
+    usernames = session.info.pop("changed_users", None)
+    if usernames:
+        users_changed(usernames)
+
+def _lookup_token(token: str):
+    """Return (user or None, how it was resolved)"""
+    user = token_cache.get(token)
+    if user is not None:
+        return user, "cached"
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except JWTError:
+        return None, "invalid"
+    username = payload.get("sub")
+    if username is None:
+        return None, "invalid"
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+    if user is None:
+        return None, "invalid"
+    token_cache.put(token, user, payload["exp"])
+    return user, "decoded"
+
+def user_from_token(token: str):
+    """Resolve a JWT to its User, or None if the token is invalid"""
+    started = time.perf_counter()
+    user, result = _lookup_token(token)
+    metric_auth_seconds.observe(time.perf_counter() - started, result=result)
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    user = user_from_token(token)
+    if user is None:
+        raise HTTPException(status_code=401)
+    return user
+
+# ============================================================================
+# ARDUINO MANAGER
+# ============================================================================
+# Commands that only set a pin's current state; a newer one makes older ones stale
+COALESCED_COMMANDS = ("SET", "PWM")
+
+# Binary pin frame: FRAME_START, count, count x (pin | FRAME_PWM_FLAG, value), XOR checksum
+FRAME_START = 0xB1
+FRAME_PWM_FLAG = 0x80
+FRAME_MAX_PAIRS = 255  # the count is one byte; boards report their own limit in INFO
+
+# Telemetry frame (board -> server) while sampling inputs: TELEMETRY_START, count,
+# board tick in ms (16 bit), count x (pin, 16 bit value), XOR checksum of
+# everything after TELEMETRY_START. Only inputs that changed are included.
+TELEMETRY_START = 0xB2
+TELEMETRY_ANALOG_FLAG = 0x80
+TELEMETRY_HEADER = struct.Struct(">BH")
+TELEMETRY_ENTRY = struct.Struct(">BH")
+
+BOARD_DIGITAL_PINS = 14
+BOARD_ANALOG_PINS = 6
+INPUT_COLUMNS = [str(pin) for pin in range(BOARD_DIGITAL_PINS)] + [f"A{channel}" for channel in range(BOARD_ANALOG_PINS)]
+SAMPLE_PINS = set(INPUT_COLUMNS) - {"0", "1"}  # 0 and 1 are the serial port
+SAMPLE_MAX_HZ = 1000
+
+def input_column(pin):
+    """Column of a telemetry pin byte in an InputBuffer row, or None"""
+    if pin & TELEMETRY_ANALOG_FLAG:
+        channel = pin & ~TELEMETRY_ANALOG_FLAG
+        return BOARD_DIGITAL_PINS + channel if channel < BOARD_ANALOG_PINS else None
+    return pin if pin < BOARD_DIGITAL_PINS else None
+
+def encode_frames(pairs, max_pairs=FRAME_MAX_PAIRS):
+    """Pack (pin byte, value) pairs into as few BlueLink frames as possible"""
+    out = bytearray()
+    for i in range(0, len(pairs), max_pairs):
+        chunk = pairs[i:i + max_pairs]
+        body = bytearray([len(chunk)])
+        for pin, value in chunk:
+            body += bytes((pin, value))
+        checksum = 0
+        for b in body:
+            checksum ^= b
+        out += bytes([FRAME_START]) + body + bytes([checksum])
+    return bytes(out)
+
+def frame_pair(kind, pin, value):
+    """Return the frame (pin byte, value) for a SET/PWM command, or None if it needs a text line"""
+    if not ARDUINO_BATCH_FRAMES or not pin.isdigit() or int(pin) >= FRAME_PWM_FLAG:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    if kind == "PWM":
+        return (int(pin) | FRAME_PWM_FLAG, max(0, min(255, value)))
+    return (int(pin), 1 if value > 0 else 0)
+
+class BoardWriter:
+    """Background thread that owns all writes to one serial connection.
+
+    Pending commands are kept in an ordered dict. SET/PWM commands are keyed
+    by pin, so a newer value of either kind replaces the queued one and moves
+    to the back (latest value wins, and goes out after everything queued
+    before it); everything else gets a unique key and is sent in order. Each wake-up writes everything pending in a single write, in
+    queue order: runs of pin changes are packed into binary frames once the
+    board has said in its INFO reply how many pairs a frame may hold, and go
+    out as text lines until then (older firmware never says so).
+    """
+    def __init__(self, name, ser, on_error, on_write=None):
+        self.name = name
+        self.ser = ser
+        self.on_error = on_error
+        self.on_write = on_write
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.running = True
+        self.sequence = itertools.count()
+        self.pins = {}  # pin -> last value written
+        self.frame_limit = None  # pairs per binary frame, None = text lines only
+        self.stats = {
+            "queued": 0, "coalesced": 0, "dropped": 0, "written": 0,
+            "writes": 0, "frames": 0, "bytes": 0, "errors": 0, "max_depth": 0,
+            "last_write_ms": 0.0, "max_write_ms": 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name=f"writer-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, command):
+        """Queue a command; returns False if the queue is full"""
+        return self.submit_many([command])
+
+    def submit_many(self, commands):
+        """Queue several commands so they go out in the same write.
+
+        Returns False if any of them was dropped because the queue is full.
+        """
+        entries = []
+        for command in commands:
+            kind, _, rest = command.partition(":")
+            if kind in COALESCED_COMMANDS:
+                pin, _, value = rest.partition(":")
+                key = pin
+                entry = (frame_pair(kind, pin, value), f"{command}\n".encode())
+            else:
+                key = next(self.sequence)
+                entry = (None, f"{command}\n".encode())
+            entries.append((key, entry))
+
+        accepted = True
+        with self.cond:
+            if not self.running:
+                return False
+            for key, entry in entries:
+                if key in self.pending:
+                    self.stats["coalesced"] += 1
+                    self.pending.move_to_end(key)
+                elif len(self.pending) >= ARDUINO_QUEUE_SIZE:
+                    self.stats["dropped"] += 1
+                    accepted = False
+                    continue
+                else:
+                    self.stats["queued"] += 1
+                self.pending[key] = entry
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.pending))
+            self.cond.notify()
+        return accepted
+
+    def depth(self):
+        return len(self.pending)
+
+    def board_info(self, key, value):
+        """Adopt a KEY:VALUE line from the board's INFO reply"""
+        if key == "FRAME_MAX_PAIRS" and value.isdigit() and int(value) > 0:
+            self.frame_limit = min(int(value), FRAME_MAX_PAIRS)
+
+    def board_reset(self):
+        """The board restarted, possibly with other firmware: ask again before using frames"""
+        self.frame_limit = None
+        self.submit("INFO")
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout=ARDUINO_TIMEOUT)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                batch = list(self.pending.values())
+                self.pending.clear()
+
+            # A text line ends the current run of pairs so everything keeps its queue order
+            limit = self.frame_limit
+            data = bytearray()
+            pairs, lines, kinds, run = [], [], [], []
+            frames = 0
+            for pair, line in batch + [(None, None)]:
+                if pair is not None and limit:
+                    run.append(pair)
+                    continue
+                if run:
+                    count = (len(run) + limit - 1) // limit
+                    data += encode_frames(run, limit)
+                    frames += count
+                    kinds += ["FRAME"] * count
+                    pairs += run
+                    run = []
+                if line is not None:
+                    data += line
+                    lines.append(line)
+                    kinds.append(line.partition(b":")[0].strip().decode())
+            started = time.perf_counter()
+            try:
+                self.ser.write(data)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.running = False
+                metric_send_failures.inc(len(batch), board=self.name, reason="serial_error")
+                logger.error(f"❌ Serial error sending to {self.name}: {e}", extra={"board": self.name})
+                # Connection may be broken, hand it back to the manager
+                self.on_error(self.name)
+                return
+            if self.on_write is not None:
+                self.on_write(kinds, started)
+            elapsed = time.perf_counter() - started
+            elapsed_ms = elapsed * 1000
+            metric_serial_write_seconds.observe(elapsed, board=self.name)
+            metric_serial_bytes.inc(len(data), board=self.name)
+            set_count = sum(1 for pin, _ in pairs if not pin & FRAME_PWM_FLAG)
+            if set_count:
+                metric_commands.inc(set_count, board=self.name, kind="SET")
+            if len(pairs) > set_count:
+                metric_commands.inc(len(pairs) - set_count, board=self.name, kind="PWM")
+            for line in lines:
+                kind, _, rest = line.decode(errors="replace").strip().partition(":")
+                metric_commands.inc(board=self.name, kind=kind)
+                if kind in COALESCED_COMMANDS:
+                    pin, _, value = rest.partition(":")
+                    self.pins[pin] = int(value) if value.lstrip("-").isdigit() else value
+            for pin, value in pairs:
+                self.pins[str(pin & ~FRAME_PWM_FLAG)] = value
+            self.stats["written"] += len(batch)
+            self.stats["writes"] += 1
+            self.stats["frames"] += frames
+            self.stats["bytes"] += len(data)
+            self.stats["last_write_ms"] = elapsed_ms
+            self.stats["max_write_ms"] = max(self.stats["max_write_ms"], elapsed_ms)
+
+# STATUS: replies that acknowledge a command, by the command they answer
+ACK_PREFIXES = (
+    ("SET PIN", "SET"),
+    ("PWM PIN", "PWM"),
+    ("TESTED PIN", "TEST"),
+    ("FRAME ", "FRAME"),
+    ("DIGITAL_PINS", "INFO"),
+    ("SAMPLE ", "SAMPLE"),
+)
+ACKED_COMMANDS = {kind for _, kind in ACK_PREFIXES} | {"STEPPER", "STEPPER_STOP"}
+
+def ack_kind(message):
+    """Return the command a STATUS message acknowledges, or None"""
+    for prefix, kind in ACK_PREFIXES:
+        if message.startswith(prefix):
+            return kind
+    parts = message.split()
+    if len(parts) >= 3 and parts[0] == "STEPPER":
+        return {"QUEUED": "STEPPER", "STOPPED": "STEPPER_STOP"}.get(parts[2])
+    return None
+
+class InputBuffer:
+    """NumPy ring buffer of the inputs a board samples.
+
+    Telemetry frames only carry the inputs that changed, so each frame is
+    stored as a full row: the previous row with the changed columns
+    overwritten. Values are raw (0/1 digital, 0-1023 analog), -1 for inputs
+    not seen yet. Rows keep both the host receive time and the board's own
+    clock, which is the one to use for sample spacing.
+    """
+    def __init__(self, size=INPUT_BUFFER_SIZE):
+        self.size = size
+        self.times = np.zeros(size)
+        self.ticks = np.zeros(size, dtype=np.int64)
+        self.values = np.full((size, len(INPUT_COLUMNS)), -1, dtype=np.int16)
+        self.current = np.full(len(INPUT_COLUMNS), -1, dtype=np.int16)
+        self.board_ms = None  # board tick unwrapped past its 16 bit rollover
+        self.count = 0        # rows ever written
+        self.lock = threading.Lock()
+
+    def append(self, tick, entries, received):
+        """Apply one frame's (pin byte, value) entries as a new row"""
+        with self.lock:
+            if self.board_ms is None:
+                self.board_ms = tick
+            else:
+                self.board_ms += (tick - self.board_ms) & 0xFFFF
+            for pin, value in entries:
+                column = input_column(pin)
+                if column is not None:
+                    self.current[column] = min(value, 0x7FFF)
+            row = self.count % self.size
+            self.times[row] = received
+            self.ticks[row] = self.board_ms
+            self.values[row] = self.current
+            self.count += 1
+
+    def query(self, since=None, limit=None, pins=None):
+        """Rows received after ``since`` (newest ``limit``), as plain lists per pin"""
+        with self.lock:
+            rows = np.arange(max(0, self.count - self.size), self.count) % self.size
+            times = self.times[rows]
+            ticks = self.ticks[rows]
+            values = self.values[rows]
+            current = self.current.copy()
+            frames = self.count
+        if since is not None:
+            keep = times > since
+            times, ticks, values = times[keep], ticks[keep], values[keep]
+        if limit is not None:
+            first = max(0, len(times) - limit)
+            times, ticks, values = times[first:], ticks[first:], values[first:]
+        if pins is None:
+            columns = [int(c) for c in np.flatnonzero(current >= 0)]
+        else:
+            columns = [INPUT_COLUMNS.index(pin) for pin in pins]
+
+        result = {"frames": frames, "rows": len(times), "time": times.tolist(),
+                  "board_ms": ticks.tolist(), "values": {}, "latest": {}, "summary": {}}
+        if len(ticks) > 1 and ticks[-1] > ticks[0]:
+            result["frame_rate_hz"] = round((len(ticks) - 1) * 1000 / float(ticks[-1] - ticks[0]), 2)
+        for column in columns:
+            pin = INPUT_COLUMNS[column]
+            series = values[:, column]
+            result["values"][pin] = series.tolist()
+            result["latest"][pin] = int(current[column])
+            seen = series[series >= 0]
+            if len(seen):
+                result["summary"][pin] = {"min": int(seen.min()), "max": int(seen.max()),
+                                          "mean": round(float(seen.mean()), 2)}
+        return result
+
+class BoardReader:
+    """Background thread that reads and parses everything a board sends.
+
+    The firmware answers commands in order, so each acknowledgement is
+    matched against the oldest outstanding command of the same kind to
+    measure the round trip. Parsed lines go into a ring buffer. Binary
+    telemetry frames are interleaved with the lines and go into ``inputs``.
+    KEY:VALUE lines from the INFO reply are kept in ``info``.
+    """
+    def __init__(self, name, ser, on_error, inputs=None, on_reset=None, on_info=None):
+        self.name = name
+        self.ser = ser
+        self.on_error = on_error
+        self.inputs = inputs
+        self.on_reset = on_reset  # called when the board announces it (re)started
+        self.on_info = on_info    # called as on_info(name, key, value) for each INFO line
+        self.info = {}
+        self.running = True
+        self.lock = threading.Lock()
+        self.outstanding = deque(maxlen=ARDUINO_QUEUE_SIZE * 4)  # (kind, sent at)
+        self.early = deque(maxlen=64)  # (kind, received at) acks that beat their expect()
+        self.events = deque(maxlen=TELEMETRY_BUFFER_SIZE)
+        self.rtts = deque(maxlen=256)
+        self.stats = {
+            "lines": 0, "acked": 0, "lost": 0, "errors": 0, "unknown": 0,
+            "input_frames": 0, "bad_frames": 0,
+            "last_rx": None, "last_rtt_ms": None, "max_rtt_ms": 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name=f"reader-{name}", daemon=True)
+        self.thread.start()
+
+    def expect(self, kinds, sent=None):
+        """Record commands written at ``sent`` that should be acknowledged.
+
+        Writers call this once the write has returned, so a fast board may
+        already have answered; those acks are matched here instead.
+        """
+        sent = time.perf_counter() if sent is None else sent
+        with self.lock:
+            # Acks from before this write started answer something else
+            while self.early and self.early[0][1] < sent:
+                self.early.popleft()
+            for kind in kinds:
+                if kind not in ACKED_COMMANDS:
+                    continue
+                match = next((i for i, (early_kind, _) in enumerate(self.early) if early_kind == kind), None)
+                if match is None:
+                    self.outstanding.append((kind, sent))
+                else:
+                    received = self.early[match][1]
+                    del self.early[match]
+                    self._add_rtt((received - sent) * 1000)
+
+    def close(self):
+        self.running = False
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout=ARDUINO_TIMEOUT + 1)
+
+    def health(self):
+        now = time.perf_counter()
+        with self.lock:
+            rtts = sorted(self.rtts)
+            oldest = self.outstanding[0][1] if self.outstanding else None
+            outstanding = len(self.outstanding)
+        last_rx = self.stats["last_rx"]
+        if oldest is not None and now - oldest > ACK_TIMEOUT:
+            status = "stalled"
+        elif last_rx is None:
+            status = "silent"
+        else:
+            status = "ok"
+        return {
+            **self.stats,
+            "status": status,
+            "outstanding": outstanding,
+            "rtt_p50_ms": rtts[len(rtts) // 2] if rtts else None,
+            "rtt_p99_ms": rtts[int(len(rtts) * 0.99)] if rtts else None,
+        }
+
+    def _record(self, kind, message, **extra):
+        self.events.append({"time": time.time(), "type": kind, "message": message, **extra})
+
+    def _add_rtt(self, rtt):
+        # Called with the lock held
+        self.stats["acked"] += 1
+        self.stats["last_rtt_ms"] = rtt
+        self.stats["max_rtt_ms"] = max(self.stats["max_rtt_ms"], rtt)
+        self.rtts.append(rtt)
+
+    def _acknowledge(self, kind, now, early=False):
+        """Pop the oldest outstanding command of this kind; returns its RTT in ms.
+
+        With ``early``, an ack nothing is waiting for is kept for expect().
+        """
+        with self.lock:
+            # Expire commands the board never answered
+            while self.outstanding and now - self.outstanding[0][1] > ACK_TIMEOUT:
+                self.outstanding.popleft()
+                self.stats["lost"] += 1
+            for i, (pending_kind, sent) in enumerate(self.outstanding):
+                if pending_kind == kind:
+                    # Anything older was skipped by the board
+                    for _ in range(i + 1):
+                        self.outstanding.popleft()
+                    self.stats["lost"] += i
+                    return (now - sent) * 1000
+            if early:
+                self.early.append((kind, now))
+        return None
+
+    def _handle(self, line):
+        now = time.perf_counter()
+        self.stats["lines"] += 1
+        self.stats["last_rx"] = time.time()
+        if not line.startswith("STATUS:"):
+            self._record("output", line)
+            return
+        message = line[len("STATUS:"):]
+        if message.startswith("BlueLink"):
+            self.info.clear()
+            if self.on_reset is not None:
+                self.on_reset(self.name)
+
+        if message.startswith("UNKNOWN COMMAND"):
+            # The board echoes the rejected line; stop waiting for its ack
+            self.stats["unknown"] += 1
+            rejected = message.partition(": ")[2].partition(":")[0]
+            if rejected in ACKED_COMMANDS:
+                self._acknowledge(rejected, now)
+            self._record("unknown", message)
+            return
+        if message.startswith("ERROR"):
+            self.stats["errors"] += 1
+            self._record("error", message)
+            return
+
+        kind = ack_kind(message)
+        rtt = self._acknowledge(kind, now, early=True) if kind else None
+        if rtt is not None:
+            with self.lock:
+                self._add_rtt(rtt)
+            self._record("ack", message, command=kind, rtt_ms=round(rtt, 3))
+        else:
+            self._record("status", message)
+
+        key, separator, value = message.partition(":")
+        if separator and key.isupper() and key.replace("_", "").isalpha():
+            self.info[key] = value
+            if self.on_info is not None:
+                self.on_info(self.name, key, value)
+
+        parts = message.split()
+        # STEPPER <pin> DONE|STOPPED|IDLE POS <position> QUEUE <depth>
+        if len(parts) == 7 and parts[0] == "STEPPER" and parts[2] in ("DONE", "STOPPED", "IDLE"):
+            try:
+                stepper_tracker.observe(self.name, parts[1], int(parts[4]), int(parts[6]))
+            except ValueError:
+                pass
+
+    def _handle_frame(self, frame):
+        """Check and store one telemetry frame; False if the checksum is wrong"""
+        checksum = 0
+        for b in frame[1:-1]:
+            checksum ^= b
+        if checksum != frame[-1]:
+            self.stats["bad_frames"] += 1
+            metric_input_frames.inc(board=self.name, result="bad_checksum")
+            return False
+        _, tick = TELEMETRY_HEADER.unpack_from(frame, 1)
+        self.stats["input_frames"] += 1
+        self.stats["last_rx"] = time.time()
+        metric_input_frames.inc(board=self.name, result="ok")
+        if self.inputs is not None:
+            self.inputs.append(tick, TELEMETRY_ENTRY.iter_unpack(frame[4:-1]), self.stats["last_rx"])
+        return True
+
+    def _parse(self, buffer):
+        """Consume complete lines and frames from the front of ``buffer``"""
+        while buffer:
+            if buffer[0] == TELEMETRY_START:
+                if len(buffer) < 2:
+                    return
+                length = 5 + buffer[1] * TELEMETRY_ENTRY.size
+                if buffer[1] > len(INPUT_COLUMNS):
+                    length = 0
+                elif len(buffer) < length:
+                    return
+                if length and self._handle_frame(bytes(buffer[:length])):
+                    del buffer[:length]
+                else:
+                    # Not a real frame: skip the start byte and resync
+                    del buffer[0]
+                continue
+            end = buffer.find(b"\n")
+            frame_at = buffer.find(TELEMETRY_START, 0, end if end >= 0 else len(buffer))
+            if frame_at > 0:
+                # A frame cut an unterminated line short (e.g. the board reset)
+                end = frame_at
+            elif end < 0:
+                if len(buffer) > 4096:
+                    buffer.clear()
+                return
+            else:
+                end += 1
+            line = bytes(buffer[:end]).decode(errors="replace").strip()
+            del buffer[:end]
+            # Bytes of a corrupted frame end up in front of the next line
+            start = line.find("STATUS:")
+            if start > 0:
+                line = line[start:]
+            if line:
+                self._handle(line)
+
+    def _run(self):
+        buffer = bytearray()
+        while self.running:
+            try:
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                if self.running:
+                    self.running = False
+                    logger.error(f"❌ Serial error reading from {self.name}: {e}", extra={"board": self.name})
+                    self.on_error(self.name)
+                return
+            if chunk:
+                buffer += chunk
+                self._parse(buffer)
+
+def hwid_key(hwid):
+    """Identify a USB device independently of the port it is plugged into"""
+    if not hwid:
+        return None
+    return " ".join(part for part in hwid.split() if not part.startswith("LOCATION="))
+
+class ArduinoManager:
+    """Owns the serial connections to every registered Arduino.
+
+    Boards stay registered after a connection drops. A supervisor thread
+    reconnects them with exponential backoff and, when the port name has
+    changed (USB renumbering after a replug), finds the board again by its
+    USB hwid.
+    """
+    def __init__(self):
+        self.connections = {}
+        self.writers = {}
+        self.readers = {}
+        self.inputs = {}    # name -> InputBuffer, kept across reconnects
+        self.registry = {}  # name -> {"port", "hwid", "failures", "next_retry"[, "sampling"]}
+        self.lock = threading.RLock()
+        self.lost = set()
+        self.wake = threading.Event()
+        self.supervisor = None
+        # Called as on_board_moved(name, port, hwid) when a board is found on a new port or hwid
+        self.on_board_moved = None
+
+    def list_ports(self):
+        """List all available serial ports"""
+        try:
+            return [{"device": p.device, "description": p.description, "hwid": p.hwid}
+                    for p in serial.tools.list_ports.comports()]
+        except Exception as e:
+            logger.error(f"Error listing ports: {e}")
+            return []
+
+    def connect(self, name, port, hwid=None, node=None):
+        """Register an Arduino and connect to it on the specified port.
+
+        ``node`` names the agent host the board is plugged into (None for
+        this host). The board stays registered if the connection fails, so
+        the supervisor keeps retrying it.
+        """
+        node = remote_node(node)
+        remote = node is not None
+        if hwid is None:
+            ports = node_hub.ports(node) if remote else self.list_ports()
+            hwid = next((p["hwid"] for p in ports if p["device"] == port), None)
+        with self.lock:
+            entry = self.registry.setdefault(name, {"failures": 0, "next_retry": 0.0})
+            entry["port"] = port
+            entry["hwid"] = hwid or entry.get("hwid")
+            entry["node"] = node
+            # Close existing connection if any
+            if name in self.connections:
+                self.disconnect(name)
+
+        # Open outside the lock so several boards can connect in parallel
+        try:
+            if remote:
+                ser = node_hub.open(node, name, port)
+            else:
+                ser = serial.Serial(port, ARDUINO_BAUD_RATE, timeout=ARDUINO_TIMEOUT)
+        except serial.SerialException as e:
+            logger.error(f"❌ Serial error connecting to {port}: {e}", extra={"board": name, "port": port})
+            ser = None
+        except Exception as e:
+            logger.error(f"❌ Unexpected error connecting to {port}: {e}", extra={"board": name, "port": port})
+            ser = None
+
+        with self.lock:
+            if ser is None:
+                self._schedule_retry(entry)
+                return False
+            if self.registry.get(name) is not entry:
+                # Forgotten while the port was opening
+                ser.close()
+                return False
+            if name in self.connections:
+                self.disconnect(name)
+            self.connections[name] = ser
+            buffer = self.inputs.setdefault(name, InputBuffer())
+            reader = BoardReader(name, ser, self._connection_lost, buffer, self._board_reset, self._board_info)
+            self.readers[name] = reader
+            writer = self.writers[name] = BoardWriter(name, ser, self._connection_lost, on_write=reader.expect)
+            # Frames are used once the board says it understands them; the
+            # steppers' reported positions resync the stepper tracker
+            writer.submit_many(["INFO", "STEPPERS"])
+            entry["failures"] = 0
+            logger.info(f"✅ Connected to {name} on {port}", extra={"board": name, "port": port})
+            return True
+
+    def connect_all(self, boards):
+        """Register and connect many boards in parallel; boards are (name, port, hwid[, node]).
+
+        Those already connected are closed before any is opened, so ports can
+        move between them.
+        """
+        boards = list(boards)
+        if not boards:
+            return {}
+        with self.lock:
+            for board in boards:
+                entry = self.registry.get(board[0])
+                if entry is not None:
+                    entry["port"] = board[1]
+                self.disconnect(board[0])
+        with ThreadPoolExecutor(max_workers=min(8, len(boards))) as pool:
+            results = pool.map(lambda board: self.connect(*board), boards)
+            return {board[0]: ok for board, ok in zip(boards, results)}
+
+    def disconnect(self, name):
+        """Disconnect from an Arduino"""
+        with self.lock:
+            if name in self.connections:
+                try:
+                    writer = self.writers.pop(name, None)
+                    if writer is not None:
+                        writer.close()
+                    reader = self.readers.pop(name, None)
+                    if reader is not None:
+                        reader.running = False
+                    self.connections[name].close()
+                    if reader is not None:
+                        reader.close()
+                    del self.connections[name]
+                    logger.info(f"✅ Disconnected from {name}", extra={"board": name})
+                except Exception as e:
+                    logger.warning(f"⚠️  Error disconnecting from {name}: {e}", extra={"board": name})
+
+    def forget(self, name):
+        """Disconnect from an Arduino and stop reconnecting to it"""
+        with self.lock:
+            self.registry.pop(name, None)
+            self.inputs.pop(name, None)
+            self.disconnect(name)
+
+    def pause_port(self, port):
+        """Release a registered board's port (e.g. for flashing); returns its name or None"""
+        with self.lock:
+            name = next((n for n, entry in self.registry.items() if entry["port"] == port), None)
+            if name is not None:
+                self.registry[name]["next_retry"] = float("inf")
+                self.disconnect(name)
+        return name
+
+    def resume(self, name):
+        """Let the supervisor reconnect a board released with pause_port"""
+        with self.lock:
+            entry = self.registry.get(name)
+            if entry is not None:
+                entry["failures"] = 0
+                entry["next_retry"] = 0.0
+        self.wake.set()
+
+    def hwid(self, name):
+        """The USB hwid a registered board was last seen with"""
+        entry = self.registry.get(name)
+        return entry.get("hwid") if entry else None
+
+    def node_available(self, node):
+        """An agent node (re)connected: retry its boards right away"""
+        with self.lock:
+            for entry in self.registry.values():
+                if entry.get("node") == node and entry["next_retry"] != float("inf"):
+                    entry["failures"] = 0
+                    entry["next_retry"] = 0.0
+        self.wake.set()
+
+    def start_supervisor(self):
+        if self.supervisor is None:
+            self.supervisor = threading.Thread(target=self._supervise, name="arduino-supervisor", daemon=True)
+            self.supervisor.start()
+
+    def _connection_lost(self, name):
+        # Called from reader/writer threads, which must not join themselves
+        self.lost.add(name)
+        self.wake.set()
+
+    def _board_reset(self, name):
+        # Called from the reader thread: a rebooted board may run other firmware
+        # and has forgotten its sampling setup
+        entry = self.registry.get(name)
+        writer = self.writers.get(name)
+        if writer is None:
+            return
+        # Its motors start over at position 0 with empty queues
+        stepper_tracker.forget(name)
+        writer.board_reset()
+        if entry and entry.get("sampling"):
+            writer.submit(entry["sampling"])
+
+    def _board_info(self, name, key, value):
+        writer = self.writers.get(name)
+        if writer is not None:
+            writer.board_info(key, value)
+
+    def _schedule_retry(self, entry):
+        entry["failures"] += 1
+        backoff = min(RECONNECT_MAX_BACKOFF, RECONNECT_INTERVAL * 2 ** (entry["failures"] - 1))
+        entry["next_retry"] = time.monotonic() + backoff
+
+    def _find_port(self, entry):
+        """Pick the port to reconnect on, following the board's hwid if it moved"""
+        wanted = hwid_key(entry.get("hwid"))
+        if not wanted or entry.get("node"):
+            return entry["port"]
+        ports = self.list_ports()
+        current = next((p for p in ports if p["device"] == entry["port"]), None)
+        if current is not None and hwid_key(current["hwid"]) == wanted:
+            return entry["port"]
+        with self.lock:
+            in_use = {getattr(ser, "port", None) for ser in self.connections.values()}
+        matches = [p["device"] for p in ports
+                   if hwid_key(p["hwid"]) == wanted and p["device"] not in in_use]
+        # Boards without a USB serial number share a hwid; only follow an unambiguous match
+        return matches[0] if len(matches) == 1 else entry["port"]
+
+    def _supervise(self):
+        while True:
+            self.wake.wait(RECONNECT_INTERVAL)
+            self.wake.clear()
+            while self.lost:
+                name = self.lost.pop()
+                with self.lock:
+                    if name in self.connections:
+                        metric_disconnects.inc(board=name)
+                        logger.warning(f"⚠️  Lost connection to {name}", extra={"board": name})
+                    self.disconnect(name)
+                    if name in self.registry:
+                        self._schedule_retry(self.registry[name])
+
+            now = time.monotonic()
+            with self.lock:
+                due = [(name, entry) for name, entry in self.registry.items()
+                       if name not in self.connections and entry["next_retry"] <= now]
+            for name, entry in due:
+                # One board failing must not stop the supervisor for all of them
+                try:
+                    self._reconnect(name, entry)
+                except Exception as e:
+                    logger.error(f"❌ Reconnecting {name} failed: {e}", exc_info=True, extra={"board": name})
+                    with self.lock:
+                        self._schedule_retry(entry)
+
+    def _reconnect(self, name, entry):
+        old_port, old_hwid = entry["port"], entry.get("hwid")
+        port = self._find_port(entry)
+        if self.connect(name, port, old_hwid, entry.get("node")):
+            logger.info(f"🔌 Reconnected {name} on {port}", extra={"board": name, "port": port})
+            if (port != old_port or entry["hwid"] != old_hwid) and self.on_board_moved:
+                self.on_board_moved(name, port, entry["hwid"])
+
+    def send(self, name, command):
+        """Queue a command for an Arduino's writer thread"""
+        writer = self.writers.get(name)
+        if writer is None:
+            metric_send_failures.inc(board=name, reason="not_connected")
+            logger.warning(f"⚠️  Arduino '{name}' not connected", extra={"board": name})
+            return False
+        command_recorder.record(name, [command])
+        if not writer.submit(command):
+            metric_send_failures.inc(board=name, reason="queue_full")
+            logger.warning(f"⚠️  Send queue for '{name}' is full, dropped: {command}", extra={"board": name})
+            return False
+        return True
+
+    def send_batch(self, name, commands):
+        """Queue several commands for one Arduino to be flushed together.
+
+        All SET/PWM changes pending for the board go out as one binary frame
+        on the writer's next pass instead of one line per pin.
+        """
+        writer = self.writers.get(name)
+        if writer is None:
+            metric_send_failures.inc(len(commands), board=name, reason="not_connected")
+            logger.warning(f"⚠️  Arduino '{name}' not connected", extra={"board": name})
+            return False
+        command_recorder.record(name, commands)
+        if not writer.submit_many(commands):
+            metric_send_failures.inc(board=name, reason="queue_full")
+            logger.warning(f"⚠️  Send queue for '{name}' is full, dropped part of a batch", extra={"board": name})
+            return False
+        return True
+
+    def stats(self):
+        """Connection, writer and link statistics for every registered Arduino"""
+        now = time.monotonic()
+        stats = {}
+        for name, entry in list(self.registry.items()):
+            writer = self.writers.get(name)
+            reader = self.readers.get(name)
+            stats[name] = {
+                "connected": writer is not None,
+                "port": entry["port"],
+                "hwid": entry.get("hwid"),
+                "node": entry.get("node"),
+                "failures": entry["failures"],
+                "retry_in": max(0.0, entry["next_retry"] - now) if writer is None else None,
+                **(writer.stats if writer else {}),
+                "depth": writer.depth() if writer else 0,
+                "link": reader.health() if reader else None,
+            }
+        return stats
+
+    def sample(self, name, pins, rate, deadband=0):
+        """Have a board stream the given inputs at ``rate`` Hz; no pins turns it off.
+
+        The setup is resent whenever the board restarts.
+        """
+        entry = self.registry.get(name)
+        if entry is None:
+            return False
+        if pins:
+            command = f"SAMPLE:{','.join(pins)}:{rate}"
+            if deadband:
+                command += f":{deadband}"
+        else:
+            command = "SAMPLE:OFF"
+        entry["sampling"] = command if pins else None
+        return self.send(name, command)
+
+    def input_samples(self, name, since=None, limit=None, pins=None):
+        """Buffered input rows of a board (see InputBuffer.query), or None"""
+        buffer = self.inputs.get(name)
+        if buffer is None:
+            return None
+        entry = self.registry.get(name)
+        return {"sampling": entry.get("sampling") if entry else None,
+                **buffer.query(since, limit, pins)}
+
+    def telemetry(self, name, limit=100):
+        """Link health and the most recent parsed lines from an Arduino"""
+        reader = self.readers.get(name)
+        if reader is None:
+            return None
+        events = list(reader.events)
+        return {"health": reader.health(), "info": dict(reader.info),
+                "events": events[-limit:] if limit > 0 else []}
+
+arduino_manager = ArduinoManager()
+
+# ============================================================================
+# REMOTE NODES
+# ============================================================================
+# Agent nodes are BlueLink processes on other hosts that lend their serial
+# ports to this one over a WebSocket. Text messages carry JSON control
+# (hello, open, opened, close, closed); binary messages carry board bytes as
+# a batch of entries: name length, data length (NODE_ENTRY), name, data.
+NODE_ENTRY = struct.Struct(">HI")
+
+def remote_node(node):
+    """Return the node name if it is another host, None for this one"""
+    return node if node and node != NODE_NAME else None
+
+def node_key(node):
+    """The arduinos.node value for a board: its agent node, "" for this host"""
+    return remote_node(node) or ""
+
+def encode_node_batch(entries):
+    """Pack (board name, bytes) entries into one binary message"""
+    out = bytearray()
+    for board, data in entries:
+        name = board.encode()
+        out += NODE_ENTRY.pack(len(name), len(data)) + name + data
+    return bytes(out)
+
+def decode_node_batch(payload):
+    """Unpack a binary message into (board name, bytes) entries"""
+    entries = []
+    offset = 0
+    while offset + NODE_ENTRY.size <= len(payload):
+        name_length, data_length = NODE_ENTRY.unpack_from(payload, offset)
+        offset += NODE_ENTRY.size
+        board = payload[offset:offset + name_length].decode(errors="replace")
+        offset += name_length
+        entries.append((board, payload[offset:offset + data_length]))
+        offset += data_length
+    return entries
+
+class RemoteLink:
+    """Stands in for serial.Serial for a board plugged into an agent node.
+
+    Writes are queued on the node's session and leave in its next batch;
+    bytes from the board are fed in by the session and read back as from a
+    serial port, so BoardWriter and BoardReader work unchanged.
+    """
+    def __init__(self, session, board, port, timeout=ARDUINO_TIMEOUT):
+        self.session = session
+        self.board = board
+        self.port = port
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.ready = threading.Condition()
+        self.is_open = True
+        self.error = None
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException(self.error or f"{self.port} on {self.session.name} is closed")
+        self.session.send_data(self.board, data)
+        return len(data)
+
+    def feed(self, data):
+        with self.ready:
+            self.buffer += data
+            self.ready.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        with self.ready:
+            while True:
+                if self.buffer:
+                    data = bytes(self.buffer[:size])
+                    del self.buffer[:size]
+                    return data
+                if not self.is_open:
+                    raise serial.SerialException(self.error or f"{self.port} on {self.session.name} is closed")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return b""
+                self.ready.wait(remaining)
+
+    def drop(self, error):
+        """Mark the link dead (node gone or port lost); readers and writers then fail"""
+        with self.ready:
+            self.is_open = False
+            self.error = error
+            self.ready.notify_all()
+
+    def close(self):
+        if self.is_open:
+            self.drop(f"{self.port} on {self.session.name} is closed")
+            self.session.close_link(self)
+
+class NodeSession:
+    """The primary's side of one connected agent node.
+
+    Board threads post writes from any thread; pump_out runs on the event
+    loop and sends everything queued since its last pass as one binary
+    message, so a control loop tick that touches ten boards on a node costs
+    one WebSocket frame.
+    """
+    def __init__(self, name, websocket, loop):
+        self.name = name
+        self.websocket = websocket
+        self.loop = loop
+        self.ports = []
+        self.links = {}    # board name -> RemoteLink
+        self.pending = {}  # board name -> [threading.Event, reply]
+        self.outbox = deque()  # ("data", (board, bytes)) or ("control", message)
+        self.ready = asyncio.Event()
+        self.signalled = False
+        self.closed = False
+        self.stats = {"connected_at": time.time(), "batches_out": 0, "bytes_out": 0, "batches_in": 0, "bytes_in": 0}
+
+    def _post(self, item):
+        if self.closed:
+            raise serial.SerialException(f"Node '{self.name}' is disconnected")
+        # Append before checking the flag so pump_out never misses an item
+        self.outbox.append(item)
+        if not self.signalled:
+            self.signalled = True
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    def send_data(self, board, data):
+        self._post(("data", (board, data)))
+
+    def open(self, board, port, timeout):
+        """Ask the node to open a port for a board; blocks, returns a RemoteLink"""
+        waiter = [threading.Event(), None]
+        self.pending[board] = waiter
+        try:
+            self._post(("control", {"type": "open", "board": board, "port": port, "baud": ARDUINO_BAUD_RATE}))
+            if not waiter[0].wait(timeout):
+                raise serial.SerialException(f"Node '{self.name}' did not answer opening {port}")
+        finally:
+            if self.pending.get(board) is waiter:
+                del self.pending[board]
+        reply = waiter[1]
+        if isinstance(reply, RemoteLink):
+            return reply
+        raise serial.SerialException(reply or f"Node '{self.name}' could not open {port}")
+
+    def close_link(self, link):
+        if self.links.get(link.board) is link:
+            del self.links[link.board]
+            try:
+                self._post(("control", {"type": "close", "board": link.board}))
+            except serial.SerialException:
+                pass
+
+    def handle(self, message):
+        """Apply a JSON control message from the node (runs on the event loop)"""
+        kind = message.get("type")
+        board = message.get("board")
+        if kind == "hello":
+            self.ports = message.get("ports", [])
+        elif kind == "opened":
+            waiter = self.pending.get(board)
+            if waiter is None:
+                return
+            if message.get("ok"):
+                # Registered here, before any bytes the board sends right after opening
+                old = self.links.pop(board, None)
+                if old is not None:
+                    old.drop("reopened")
+                link = self.links[board] = RemoteLink(self, board, message.get("port"))
+                waiter[1] = link
+            else:
+                waiter[1] = message.get("error")
+            waiter[0].set()
+        elif kind == "closed":
+            link = self.links.pop(board, None)
+            if link is not None:
+                link.drop(message.get("error") or f"{link.port} on {self.name} was lost")
+
+    def uplink(self, payload):
+        """Route a binary batch of board output to the links"""
+        self.stats["batches_in"] += 1
+        self.stats["bytes_in"] += len(payload)
+        for board, data in decode_node_batch(payload):
+            link = self.links.get(board)
+            if link is not None:
+                link.feed(data)
+
+    async def pump_out(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            self.signalled = False
+            batch = {}
+            while self.outbox:
+                kind, payload = self.outbox.popleft()
+                if kind == "data":
+                    board, data = payload
+                    batch.setdefault(board, bytearray()).extend(data)
+                    continue
+                # Control messages keep their place relative to the data around them
+                if batch:
+                    await self._send_batch(batch)
+                    batch = {}
+                await self.websocket.send_text(json.dumps(payload))
+            if batch:
+                await self._send_batch(batch)
+
+    async def _send_batch(self, batch):
+        payload = encode_node_batch(batch.items())
+        self.stats["batches_out"] += 1
+        self.stats["bytes_out"] += len(payload)
+        await self.websocket.send_bytes(payload)
+
+    def shutdown(self):
+        """The node disconnected: fail its links and any open in progress"""
+        self.closed = True
+        for link in list(self.links.values()):
+            link.drop(f"Node '{self.name}' disconnected")
+        self.links.clear()
+        for waiter in list(self.pending.values()):
+            waiter[1] = f"Node '{self.name}' disconnected"
+            waiter[0].set()
+
+class NodeHub:
+    """Connected agent nodes by name"""
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def attach(self, session):
+        """Register a node's session; returns the session it replaced, if any"""
+        with self.lock:
+            old = self.sessions.get(session.name)
+            self.sessions[session.name] = session
+        if old is not None:
+            old.shutdown()
+        return old
+
+    def detach(self, session):
+        with self.lock:
+            if self.sessions.get(session.name) is session:
+                del self.sessions[session.name]
+        session.shutdown()
+
+    def open(self, node, board, port):
+        session = self.sessions.get(node)
+        if session is None:
+            raise serial.SerialException(f"Node '{node}' is not connected")
+        return session.open(board, port, ACK_TIMEOUT)
+
+    def ports(self, node):
+        session = self.sessions.get(node)
+        return list(session.ports) if session else []
+
+    def status(self):
+        return [{
+            "node": name,
+            **session.stats,
+            "ports": len(session.ports),
+            "boards": sorted(session.links),
+        } for name, session in list(self.sessions.items())]
+
+node_hub = NodeHub()
+
+class NodeAgent:
+    """Agent mode: lend this host's serial ports to a primary BlueLink.
+
+    Connects to the primary's /ws/node, announces the local ports and opens
+    them when asked. Command batches from the primary are written to the
+    ports; board output is gathered by one reader thread per port and sent
+    back in batches. Reconnects with backoff if the primary goes away.
+    """
+    def __init__(self, url, node, token):
+        self.url = url
+        self.node = node
+        self.token = token
+        self.ws = None
+        self.ports = {}   # board name -> serial.Serial
+        self.send_lock = threading.Lock()
+        self.uplink = {}  # board name -> bytes not yet sent
+        self.uplink_ready = threading.Condition()
+
+    def run(self):
+        from websockets.sync.client import connect
+
+        url = f"{self.url}?{urlencode({'node': self.node, 'token': self.token})}"
+        failures = 0
+        while True:
+            try:
+                with connect(url, max_size=None) as ws:
+                    failures = 0
+                    logger.info(f"🔗 Connected to primary {self.url} as node '{self.node}'")
+                    self._serve(ws)
+            except Exception as e:
+                logger.warning(f"⚠️  Primary connection lost: {e}")
+            finally:
+                self._stop()
+            failures += 1
+            time.sleep(min(RECONNECT_MAX_BACKOFF, RECONNECT_INTERVAL * 2 ** (failures - 1)))
+
+    def _serve(self, ws):
+        self.ws = ws
+        self._send({"type": "hello", "ports": arduino_manager.list_ports()})
+        threading.Thread(target=self._pump_uplink, args=(ws,), name="agent-uplink", daemon=True).start()
+        for message in ws:
+            if isinstance(message, bytes):
+                for board, data in decode_node_batch(message):
+                    self._write(board, data)
+                continue
+            message = json.loads(message)
+            if message.get("type") == "open":
+                self._open(message["board"], message["port"], message.get("baud", ARDUINO_BAUD_RATE))
+            elif message.get("type") == "close":
+                ser = self.ports.pop(message["board"], None)
+                if ser is not None:
+                    ser.close()
+
+    def _stop(self):
+        with self.uplink_ready:
+            self.ws = None
+            self.uplink.clear()
+            self.uplink_ready.notify_all()
+        for ser in self.ports.values():
+            ser.close()
+        self.ports.clear()
+
+    def _send(self, message):
+        with self.send_lock:
+            self.ws.send(json.dumps(message) if isinstance(message, dict) else message)
+
+    def _open(self, board, port, baud):
+        old = self.ports.pop(board, None)
+        if old is not None:
+            old.close()
+        try:
+            ser = serial.Serial(port, baud, timeout=ARDUINO_TIMEOUT, write_timeout=ARDUINO_TIMEOUT)
+        except Exception as e:
+            logger.error(f"❌ Could not open {port} for {board}: {e}", extra={"board": board, "port": port})
+            self._send({"type": "opened", "board": board, "port": port, "ok": False, "error": str(e)})
+            return
+        self.ports[board] = ser
+        # Reply before reading so the primary has the link when the board's bytes arrive
+        self._send({"type": "opened", "board": board, "port": port, "ok": True})
+        threading.Thread(target=self._read, args=(board, ser), name=f"agent-{board}", daemon=True).start()
+        logger.info(f"✅ Opened {port} for {board}", extra={"board": board, "port": port})
+
+    def _lost(self, board, ser, error):
+        if self.ports.get(board) is ser:
+            del self.ports[board]
+            ser.close()
+            logger.error(f"❌ Serial error on {board}: {error}", extra={"board": board})
+            try:
+                self._send({"type": "closed", "board": board, "error": str(error)})
+            except Exception:
+                pass
+
+    def _write(self, board, data):
+        ser = self.ports.get(board)
+        if ser is None:
+            return
+        try:
+            ser.write(data)
+        except Exception as e:
+            self._lost(board, ser, e)
+
+    def _read(self, board, ser):
+        while self.ports.get(board) is ser:
+            try:
+                data = ser.read(ser.in_waiting or 1)
+            except Exception as e:
+                self._lost(board, ser, e)
+                return
+            if data:
+                with self.uplink_ready:
+                    self.uplink[board] = self.uplink.get(board, b"") + data
+                    self.uplink_ready.notify()
+
+    def _pump_uplink(self, ws):
+        while True:
+            with self.uplink_ready:
+                while self.ws is ws and not self.uplink:
+                    self.uplink_ready.wait()
+                if self.ws is not ws:
+                    return
+                batch, self.uplink = self.uplink, {}
+            try:
+                self._send(encode_node_batch(batch.items()))
+            except Exception:
+                return
+
+# ============================================================================
+# INPUT SHAPING
+# ============================================================================
+DIGITAL_THRESHOLD = 0.5  # how far an input must be pushed to switch a digital output
+
+def parse_curve(curve):
+    """Parse a mapping's response curve into (expo, points).
+
+    ``None``/``"linear"``, ``"expo:<0..1>"`` (blend of x and x³) or
+    ``"points:0,0 0.5,0.2 1,1"`` (input/output magnitudes, interpolated).
+    Curves act on the magnitude, so axes stay symmetric around center.
+    """
+    if not curve or curve == "linear":
+        return 0.0, None
+    kind, _, spec = curve.partition(":")
+    if kind == "expo":
+        expo = float(spec)
+        if not 0.0 <= expo <= 1.0:
+            raise ValueError("expo must be between 0 and 1")
+        return expo, None
+    if kind == "points":
+        points = [tuple(float(v) for v in pair.split(",")) for pair in spec.split()]
+        if len(points) < 2 or any(len(p) != 2 for p in points):
+            raise ValueError("points needs at least two 'in,out' pairs")
+        xs, ys = np.array(points).T
+        if np.any(np.diff(xs) <= 0) or xs.min() < 0 or xs.max() > 1 or ys.min() < 0 or ys.max() > 1:
+            raise ValueError("points must be increasing inputs in 0..1 with outputs in 0..1")
+        return 0.0, (xs, ys)
+    raise ValueError(f"Unknown curve '{curve}'")
+
+class InputShaper:
+    """Per-route deadzone, curve, smoothing, change threshold and rate limit.
+
+    Parameters and state live in numpy arrays indexed by route slot, so a
+    batch of input updates is shaped in one vectorized pass. ``process``
+    returns only the outputs worth sending; ``sent`` records them once they
+    were queued, so failed sends are retried on the next update. ``goal`` is
+    the output each input would give without smoothing; ``settling`` tells
+    which slots have not sent it yet. The rate limit applies per output pin:
+    routes driving the same (board, pin) share the strictest one.
+    """
+    def __init__(self, routes, previous=None):
+        self.names = list(routes)
+        self.routes = list(routes.values())
+        self.slots = {name: i for i, name in enumerate(self.names)}
+
+        def column(attr, dtype=float):
+            return np.array([getattr(r, attr) for r in self.routes], dtype=dtype)
+
+        self.low = column("low")
+        self.high = column("high")
+        self.press = column("threshold")
+        self.deadzone = column("deadzone")
+        self.expo = column("expo")
+        self.alpha = 1.0 - column("smoothing")
+        self.scale = column("scale")
+        self.offset = column("offset")
+        self.out_low = column("out_low")
+        self.out_high = column("out_high")
+        self.min_change = column("min_change")
+        pins = {}
+        self.pin_group = np.array([pins.setdefault((r.board, r.pin), len(pins)) for r in self.routes],
+                                  dtype=np.int64)
+        self.pin_keys = list(pins)
+        interval = np.array([1.0 / r.max_rate_hz if r.max_rate_hz else 0.0 for r in self.routes])
+        group_interval = np.zeros(len(pins))
+        np.maximum.at(group_interval, self.pin_group, interval)
+        self.min_interval = group_interval[self.pin_group]
+        self.is_pwm = np.array([r.pin_mode == "pwm" for r in self.routes], dtype=bool)
+        # Inverted buttons flip the pin level; inverted axes and steppers reverse direction instead
+        self.invert_level = np.array([r.invert and r.pin_mode != "stepper" and r.low >= 0 for r in self.routes],
+                                     dtype=bool)
+        self.custom = {i: r.points for i, r in enumerate(self.routes) if r.points is not None}
+
+        n = len(self.routes)
+        self.filtered = np.full(n, np.nan)
+        self.last_out = np.full(n, -1, dtype=np.int64)
+        self.pin_time = np.full(len(pins), -np.inf)  # last send per (board, pin)
+        self.goal = np.full(n, -1, dtype=np.int64)
+
+        # Keep state for routes that did not change
+        if previous is not None:
+            for i, name in enumerate(self.names):
+                j = previous.slots.get(name)
+                if j is not None and previous.routes[j] is self.routes[i]:
+                    self.filtered[i] = previous.filtered[j]
+                    self.last_out[i] = previous.last_out[j]
+                    self.goal[i] = previous.goal[j]
+            previous_pins = {key: k for k, key in enumerate(previous.pin_keys)}
+            for k, key in enumerate(self.pin_keys):
+                if key in previous_pins:
+                    self.pin_time[k] = previous.pin_time[previous_pins[key]]
+
+    def process(self, slots, values, now):
+        """Shape raw values for route slots; returns (slots, outputs) to send"""
+        s = np.asarray(slots, dtype=np.int64)
+        x = np.clip(np.asarray(values, dtype=float), self.low[s], self.high[s])
+
+        magnitude = np.abs(x)
+        deadzone = self.deadzone[s]
+        magnitude = np.where(magnitude <= deadzone, 0.0,
+                             (magnitude - deadzone) / np.maximum(1.0 - deadzone, 1e-9))
+        expo = self.expo[s]
+        magnitude = (1.0 - expo) * magnitude + expo * magnitude ** 3
+        for k, slot in enumerate(s):
+            points = self.custom.get(int(slot))
+            if points is not None:
+                magnitude[k] = np.interp(magnitude[k], *points)
+        target = np.copysign(magnitude, x)
+        self.goal[s] = self._output(s, target)
+
+        # Exponential low-pass; the first sample seeds the filter. Snap once it
+        # is close so the output always ends up exactly at the goal
+        previous = self.filtered[s]
+        x = np.where(np.isnan(previous), target, previous + self.alpha[s] * (target - previous))
+        x = np.where(np.abs(x - target) < 1e-6, target, x)
+        self.filtered[s] = x
+
+        out = self._output(s, x)
+
+        last = self.last_out[s]
+        changed = out != last
+        # Small moves are dropped, but the ends of the range always get through
+        at_end = (out == self.out_low[s]) | (out == self.out_high[s])
+        significant = (np.abs(out - last) >= self.min_change[s]) | (last < 0) | at_end
+        due = now - self.pin_time[self.pin_group[s]] >= self.min_interval[s]
+        send = changed & significant & due
+        return s[send], out[send]
+
+    def _output(self, s, x):
+        pwm = np.clip(np.rint(self.offset[s] + self.scale[s] * x), 0, 255)
+        press = self.press[s]
+        level = np.where(press < 0, x <= press, x >= press) != self.invert_level[s]
+        return np.where(self.is_pwm[s], pwm, level).astype(np.int64)
+
+    def sent(self, slots, outputs, now):
+        self.last_out[slots] = outputs
+        self.pin_time[self.pin_group[slots]] = now
+
+    def settling(self, slots):
+        """Which slots still owe their goal: the filter has not caught up with
+        the input, or the rate limit held the last change back"""
+        s = np.asarray(slots, dtype=np.int64)
+        goal, last = self.goal[s], self.last_out[s]
+        at_end = (goal == self.out_low[s]) | (goal == self.out_high[s])
+        significant = (np.abs(goal - last) >= self.min_change[s]) | (last < 0) | at_end
+        return (goal >= 0) & (goal != last) & significant
+
+# ============================================================================
+# ROUTING TABLE
+# ============================================================================
+class Route:
+    """A mapping compiled down to what the input hot path needs.
+
+    Axes (input_type "analog") report -1.0..1.0, buttons and triggers report
+    0.0..1.0. Scaling and invert are folded into ``scale``/``offset`` so a PWM
+    value is a single multiply-add. The shaping settings are read by
+    InputShaper.
+    """
+    __slots__ = ("board", "arduino_id", "pin", "pin_mode", "low", "high",
+                 "scale", "offset", "out_low", "out_high", "threshold", "invert",
+                 "deadzone", "expo", "points", "smoothing", "min_change", "max_rate_hz",
+                 "stepper_command", "stepper_steps", "stepper_speed")
+
+    def __init__(self, mapping, board):
+        self.board = board
+        self.arduino_id = mapping.arduino_id
+        self.pin = mapping.arduino_pin
+        self.pin_mode = mapping.pin_mode
+        self.invert = bool(mapping.invert)
+        self.low, self.high = (-1.0, 1.0) if mapping.input_type == "analog" else (0.0, 1.0)
+        # Digital outputs switch once the input is pushed past halfway. An axis
+        # rests at 0 and reads LOW there; inverting it presses on the other side
+        axis = self.low < 0
+        self.threshold = -DIGITAL_THRESHOLD if axis and self.invert and self.pin_mode != "stepper" \
+            else DIGITAL_THRESHOLD
+
+        out_low = mapping.min_value or 0
+        out_high = mapping.max_value if mapping.max_value is not None else 255
+        if self.invert:
+            out_low, out_high = out_high, out_low
+        self.scale = (out_high - out_low) / (self.high - self.low)
+        self.offset = out_low - self.scale * self.low
+        self.out_low, self.out_high = min(out_low, out_high), max(out_low, out_high)
+
+        self.deadzone = min(max(mapping.deadzone or 0.0, 0.0), 0.99)
+        self.expo, self.points = parse_curve(mapping.curve)
+        self.smoothing = min(max(mapping.smoothing or 0.0, 0.0), 0.99)
+        self.min_change = max(mapping.change_threshold or 0, 0) if self.pin_mode == "pwm" else 0
+        self.max_rate_hz = mapping.max_rate_hz or 0.0
+
+        # Steppers move one revolution per press (reversed when inverted)
+        self.stepper_command = self.stepper_steps = self.stepper_speed = None
+        if self.pin_mode == "stepper":
+            pins = [p for p in (mapping.arduino_pin, mapping.stepper_pin2,
+                                mapping.stepper_pin3, mapping.stepper_pin4) if p]
+            self.stepper_steps = -mapping.stepper_steps if self.invert else mapping.stepper_steps
+            self.stepper_speed = mapping.stepper_speed
+            self.stepper_command = f"STEPPER:{','.join(pins)}:{self.stepper_steps}:{self.stepper_speed}"
+
+    def render(self, output):
+        """Return the Arduino command for a shaped output, or None to send nothing"""
+        if self.pin_mode == "pwm":
+            return f"PWM:{self.pin}:{output}"
+        if self.pin_mode == "stepper":
+            return self.stepper_command if output else None
+        return f"SET:{self.pin}:{output}"
+
+class RoutingTable:
+    """In-memory copy of the Arduino and Mapping tables for the control path.
+
+    Lookups never touch the database. Updates build a new dict and swap it in,
+    so readers always see a consistent table. The shaper is rebuilt along with
+    the routes and keeps the filter state of unchanged ones. Only mappings
+    of the active profile are routed.
+    """
+    def __init__(self):
+        self.routes = {}   # controller_input -> Route
+        self.boards = {}   # arduino id -> arduino name
+        self.profile_id = None
+        self.shaper = InputShaper({})
+
+    def _swap(self, routes):
+        self.shaper = InputShaper(routes, self.shaper)
+        self.routes = routes
+
+    def rebuild(self, db: Session):
+        """Reload boards and the active profile's mappings, then swap them in at once"""
+        active = db.query(Profile).filter(Profile.active == True).first()
+        profile_id = active.id if active else None
+        boards = {ar.id: ar.name for ar in db.query(Arduino).all()}
+        routes = {}
+        for m in db.query(Mapping).filter(Mapping.profile_id == profile_id).all():
+            if m.arduino_id in boards:
+                routes[m.controller_input] = Route(m, boards[m.arduino_id])
+        self.boards = boards
+        self.profile_id = profile_id
+        self._swap(routes)
+
+    def add_board(self, arduino):
+        self.boards = {**self.boards, arduino.id: arduino.name}
+
+    def add_mapping(self, mapping):
+        board = self.boards.get(mapping.arduino_id)
+        if board is not None and mapping.profile_id == self.profile_id:
+            self._swap({**self.routes, mapping.controller_input: Route(mapping, board)})
+
+    def remove_mapping(self, mapping):
+        if mapping.profile_id != self.profile_id:
+            return
+        routes = dict(self.routes)
+        routes.pop(mapping.controller_input, None)
+        self._swap(routes)
+
+    def board_name(self, arduino_id):
+        return self.boards.get(arduino_id)
+
+routing_table = RoutingTable()
+
+# ============================================================================
+# STEPPER TRACKING
+# ============================================================================
+STEPPER_QUEUE_SIZE = 4       # MOTION_QUEUE_SIZE in BlueLink.ino
+STEPPER_STEPS_PER_REV = 200  # DEFAULT_STEPS_PER_REV in BlueLink.ino
+
+class StepperTracker:
+    """Server-side model of the stepper motion queues on each board.
+
+    The firmware runs queued moves back to back without blocking, so the
+    position and queue depth are estimated from the moves sent and their
+    speed (ignoring acceleration ramps), and corrected whenever the board
+    reports a motor's position.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.motors = {}  # (board, first pin) -> {"position": int, "moves": [(steps, start, end)]}
+
+    def _settle(self, motor, now):
+        while motor["moves"] and motor["moves"][0][2] <= now:
+            motor["position"] += motor["moves"].pop(0)[0]
+
+    def _describe(self, motor, now):
+        self._settle(motor, now)
+        moves = motor["moves"]
+        position = motor["position"]
+        moving = bool(moves) and moves[0][1] <= now
+        if moving:
+            steps, start, end = moves[0]
+            position += int(steps * (now - start) / (end - start))
+        return {
+            "position": position,
+            "target": motor["position"] + sum(m[0] for m in moves),
+            "moving": moving,
+            "queue_depth": len(moves) - (1 if moving else 0),
+        }
+
+    def queue_depth(self, board, pin):
+        with self.lock:
+            motor = self.motors.get((board, pin))
+            return self._describe(motor, time.monotonic())["queue_depth"] if motor else 0
+
+    def enqueue(self, board, pin, steps, speed):
+        now = time.monotonic()
+        with self.lock:
+            motor = self.motors.setdefault((board, pin), {"position": 0, "moves": []})
+            self._settle(motor, now)
+            start = motor["moves"][-1][2] if motor["moves"] else now
+            rate = max(1.0, speed * STEPPER_STEPS_PER_REV / 60)
+            motor["moves"].append((steps, start, start + abs(steps) / rate))
+            return self._describe(motor, now)
+
+    def observe(self, board, pin, position, queue_depth):
+        """Resync with a position the board reported while the motor was idle"""
+        now = time.monotonic()
+        with self.lock:
+            motor = self.motors.setdefault((board, pin), {"position": 0, "moves": []})
+            waiting = motor["moves"][-queue_depth:] if queue_depth else []
+            motor["position"] = position
+            motor["moves"] = []
+            for steps, start, end in waiting:
+                motor["moves"].append((steps, now, now + (end - start)))
+                now += end - start
+
+    def stop(self, board, pin):
+        with self.lock:
+            motor = self.motors.get((board, pin))
+            if motor:
+                motor["position"] = self._describe(motor, time.monotonic())["position"]
+                motor["moves"] = []
+
+    def forget(self, board):
+        with self.lock:
+            for key in [key for key in self.motors if key[0] == board]:
+                del self.motors[key]
+
+    def state(self, board):
+        now = time.monotonic()
+        with self.lock:
+            return {pin: self._describe(motor, now)
+                    for (name, pin), motor in self.motors.items() if name == board}
+
+stepper_tracker = StepperTracker()
+
+# ============================================================================
+# CONTROL LOOP
+# ============================================================================
+def route_inputs(values, now, outgoing=None):
+    """Shape raw input values and queue the commands, one batch per board.
+
+    ``outgoing`` may carry extra commands per board to go out in the same
+    batch. Stepper moves go through the stepper tracker like those from the
+    API, and a press is dropped while the motor's queue is full. Returns the
+    names of boards that could not take their batch.
+    """
+    shaper = routing_table.shaper
+    outgoing = outgoing if outgoing is not None else {}
+    slots = [shaper.slots[name] for name in values if name in shaper.slots]
+    if slots:
+        raw = [values[shaper.names[slot]] for slot in slots]
+        slots, outputs = shaper.process(slots, raw, now)
+        for slot, output in zip(slots.tolist(), outputs.tolist()):
+            route = shaper.routes[slot]
+            command = route.render(output)
+            if command is None:
+                shaper.sent([slot], [output], now)
+                continue
+            if route.pin_mode == "stepper" and \
+                    stepper_tracker.queue_depth(route.board, route.pin) >= STEPPER_QUEUE_SIZE:
+                metric_send_failures.inc(board=route.board, reason="stepper_queue_full")
+                shaper.sent([slot], [output], now)
+                continue
+            outgoing.setdefault(route.board, []).append((slot, output, command))
+
+    failed = []
+    for board, pending in outgoing.items():
+        if board not in arduino_manager.writers:
+            metric_send_failures.inc(len(pending), board=board, reason="not_connected")
+            failed.append(board)
+        elif arduino_manager.send_batch(board, [command for _, _, command in pending]):
+            sent = [(slot, output) for slot, output, _ in pending if slot is not None]
+            if sent:
+                shaper.sent([s for s, _ in sent], [o for _, o in sent], now)
+            for slot, _ in sent:
+                route = shaper.routes[slot]
+                if route.pin_mode == "stepper":
+                    stepper_tracker.enqueue(board, route.pin, route.stepper_steps, route.stepper_speed)
+        else:
+            failed.append(board)
+    return failed
+
+class ControlLoop:
+    """Fixed-rate scheduler for mapped outputs.
+
+    Input events only update ``inputs``; every tick samples all of them,
+    shapes them in one pass and queues one batch per board, so every board
+    is written on the same tick boundary. Ticks run against absolute
+    deadlines; a tick that starts late counts as jitter, one that runs past
+    the next deadline as an overrun (missed ticks are skipped, not replayed).
+
+    With the loop off, inputs are routed as they arrive. An input whose
+    output has not reached its goal yet (smoothing, max_rate_hz) is routed
+    again SHAPING_FLUSH_HZ times a second until it has, so the last value a
+    client sends always gets through.
+    """
+    def __init__(self, hz):
+        self.hz = hz
+        self.period = 1.0 / hz if hz > 0 else 0.0
+        self.inputs = {}    # controller_input -> latest raw value
+        self.manual = {}    # board -> [(None, None, command)] from the HTTP API
+        self.settling = {}  # controller_input -> raw value still being caught up (loop off)
+        self.flusher = None
+        self.route_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.jitter = deque(maxlen=1000)     # ms late per tick
+        self.durations = deque(maxlen=1000)  # ms spent per tick
+        self.stats = {"ticks": 0, "overruns": 0, "skipped": 0, "commands": 0, "failed": 0}
+
+    def start(self):
+        if self.hz <= 0 or self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="control-loop", daemon=True)
+        self.thread.start()
+        logger.info(f"⏱️  Control loop running at {self.hz:g} Hz")
+
+    def stop(self):
+        self.running = False
+
+    def update(self, values):
+        """Record the latest raw value per controller input"""
+        self.inputs.update(values)
+
+    def send(self, board, command):
+        """Queue a direct command for the next tick; False if the board is not connected"""
+        if board not in arduino_manager.writers:
+            return False
+        with self.lock:
+            self.manual.setdefault(board, []).append((None, None, command))
+        return True
+
+    def feed(self, values):
+        """Take raw input values: sampled on the next tick, or routed at once
+        when the loop is off. Returns the boards that could not take them."""
+        if self.running:
+            self.update(values)
+            return []
+        with self.route_lock:
+            failed = route_inputs(values, time.monotonic())
+            self._track_settling(values, failed)
+        if self.settling and self.flusher is None and SHAPING_FLUSH_HZ > 0:
+            self.flusher = threading.Thread(target=self._flush, name="shaping-flush", daemon=True)
+            self.flusher.start()
+        return failed
+
+    def _track_settling(self, values, failed):
+        # Called with route_lock held. Inputs whose board failed wait for the next event
+        shaper = routing_table.shaper
+        names = [name for name in values if name in shaper.slots]
+        settling = shaper.settling([shaper.slots[name] for name in names]).tolist() if names else []
+        with self.lock:
+            for name, behind in zip(names, settling):
+                if behind and shaper.routes[shaper.slots[name]].board not in failed:
+                    self.settling[name] = values[name]
+                else:
+                    self.settling.pop(name, None)
+
+    def _flush(self):
+        interval = 1.0 / SHAPING_FLUSH_HZ
+        while True:
+            time.sleep(interval)
+            with self.route_lock:
+                with self.lock:
+                    values = dict(self.settling)
+                    if not values or self.running:
+                        self.settling.clear()
+                        self.flusher = None
+                        return
+                try:
+                    failed = route_inputs(values, time.monotonic())
+                    self._track_settling(values, failed)
+                except Exception as e:
+                    logger.warning(f"⚠️  Shaping flush failed: {e}")
+                    with self.lock:
+                        self.settling.clear()
+
+    def command(self, board, command):
+        """Send a direct command on the next tick, or at once when the loop is off"""
+        if self.running:
+            return self.send(board, command)
+        return arduino_manager.send(board, command)
+
+    def tick(self, now):
+        with self.lock:
+            outgoing, self.manual = self.manual, {}
+        failed = route_inputs(dict(self.inputs), now, outgoing)
+        commands = sum(len(pending) for pending in outgoing.values())
+        self.stats["commands"] += commands
+        self.stats["failed"] += len(failed)
+
+    def _run(self):
+        deadline = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if now < deadline:
+                time.sleep(deadline - now)
+                now = time.perf_counter()
+            self.jitter.append((now - deadline) * 1000)
+            try:
+                self.tick(time.monotonic())
+            except Exception as e:
+                logger.warning(f"⚠️  Control loop tick failed: {e}")
+            finished = time.perf_counter()
+            self.durations.append((finished - now) * 1000)
+            self.stats["ticks"] += 1
+
+            deadline += self.period
+            if finished > deadline:
+                missed = int((finished - deadline) / self.period) + 1
+                self.stats["overruns"] += 1
+                self.stats["skipped"] += missed
+                deadline += missed * self.period
+
+    def report(self):
+        jitter = sorted(self.jitter)
+        durations = sorted(self.durations)
+        def pct(samples, p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else None
+        return {
+            **self.stats,
+            "running": self.running,
+            "hz": self.hz,
+            "inputs": len(self.inputs),
+            "jitter_p50_ms": pct(jitter, 0.50),
+            "jitter_p99_ms": pct(jitter, 0.99),
+            "jitter_max_ms": jitter[-1] if jitter else None,
+            "tick_p50_ms": pct(durations, 0.50),
+            "tick_max_ms": durations[-1] if durations else None,
+        }
+
+control_loop = ControlLoop(CONTROL_LOOP_HZ)
+
+# ============================================================================
+# RECORD & REPLAY
+# ============================================================================
+# One file per board: RECORD_MAGIC, name length (>H), board name, start time
+# (>d, unix), then entries of (microseconds since the previous entry, payload
+# length) as RECORD_ENTRY followed by the commands of one send, joined by \n.
+RECORD_MAGIC = b"BLREC\x01"
+RECORD_ENTRY = struct.Struct(">IH")
+RECORD_MAX_DELTA = 0xFFFFFFFF  # ~71 minutes; longer idle gaps are shortened to this
+
+class CommandRecorder:
+    """Append-only log of every command handed to ArduinoManager.send.
+
+    Sends only append to an in-memory buffer per board; a flusher thread
+    moves the buffers to disk every RECORD_FLUSH_INTERVAL, so recording adds
+    no file I/O to the control loop.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.session = None
+        self.lock = threading.Lock()
+
+    def start(self, name=None):
+        with self.lock:
+            if self.session is not None:
+                return None
+            recording_id = uuid.uuid4().hex[:12]
+            path = os.path.join(self.directory, recording_id)
+            os.makedirs(path, exist_ok=True)
+            session = self.session = {
+                "id": recording_id, "name": name or recording_id, "path": path,
+                "started": time.time(), "start_us": time.perf_counter_ns() // 1000,
+                "boards": {}, "entries": 0, "bytes": 0, "stop": threading.Event(),
+            }
+        session["flusher"] = threading.Thread(target=self._flush_loop, args=(session,), name="recorder", daemon=True)
+        session["flusher"].start()
+        logger.info(f"⏺️  Recording {recording_id} started")
+        return self.status()
+
+    def record(self, board, commands):
+        session = self.session
+        if session is None:
+            return
+        payload = "\n".join(commands).encode()
+        if len(payload) > 0xFFFF and len(commands) > 1:
+            half = len(commands) // 2
+            self.record(board, commands[:half])
+            self.record(board, commands[half:])
+            return
+        now = time.perf_counter_ns() // 1000
+        with self.lock:
+            if self.session is not session:
+                return
+            log = session["boards"].get(board)
+            if log is None:
+                name = board.encode()
+                header = RECORD_MAGIC + struct.pack(">H", len(name)) + name + struct.pack(">d", session["started"])
+                log = session["boards"][board] = {
+                    "file": f"board-{len(session['boards'])}.blrec",
+                    "last": session["start_us"], "buffer": bytearray(header), "entries": 0,
+                }
+            log["buffer"] += RECORD_ENTRY.pack(min(now - log["last"], RECORD_MAX_DELTA), len(payload)) + payload
+            log["last"] = now
+            log["entries"] += 1
+            session["entries"] += 1
+
+    def _flush(self, session):
+        with self.lock:
+            pending = [(log["file"], bytes(log["buffer"])) for log in session["boards"].values() if log["buffer"]]
+            for log in session["boards"].values():
+                log["buffer"].clear()
+        for filename, data in pending:
+            with open(os.path.join(session["path"], filename), "ab") as f:
+                f.write(data)
+            session["bytes"] += len(data)
+
+    def _flush_loop(self, session):
+        while not session["stop"].wait(RECORD_FLUSH_INTERVAL):
+            try:
+                self._flush(session)
+            except OSError as e:
+                logger.error(f"❌ Could not write recording {session['id']}: {e}")
+
+    def stop(self):
+        with self.lock:
+            session, self.session = self.session, None
+        if session is None:
+            return None
+        session["stop"].set()
+        session["flusher"].join()
+        self._flush(session)
+        meta = {
+            "id": session["id"], "name": session["name"], "started": session["started"],
+            "duration": (time.perf_counter_ns() // 1000 - session["start_us"]) / 1e6,
+            "entries": session["entries"], "bytes": session["bytes"],
+            "boards": {board: {"file": log["file"], "entries": log["entries"]} for board, log in session["boards"].items()},
+        }
+        with open(os.path.join(session["path"], "recording.json"), "w") as f:
+            json.dump(meta, f)
+        logger.info(f"⏹️  Recording {session['id']} stopped: {meta['entries']} sends, {meta['bytes']} bytes")
+        return meta
+
+    def status(self):
+        session = self.session
+        if session is None:
+            return None
+        return {
+            "id": session["id"], "name": session["name"], "started": session["started"],
+            "entries": session["entries"], "boards": sorted(session["boards"]),
+        }
+
+    def _path(self, recording_id):
+        if not recording_id.isalnum():
+            raise FileNotFoundError(recording_id)
+        return os.path.join(self.directory, recording_id)
+
+    def recordings(self):
+        """Metadata of every finished recording, newest first"""
+        found = []
+        if os.path.isdir(self.directory):
+            for recording_id in os.listdir(self.directory):
+                try:
+                    with open(os.path.join(self._path(recording_id), "recording.json")) as f:
+                        found.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(found, key=lambda meta: meta["started"], reverse=True)
+
+    def delete(self, recording_id):
+        path = self._path(recording_id)
+        status = self.status()
+        if status and status["id"] == recording_id:
+            raise ValueError("Recording is still running")
+        for filename in os.listdir(path):
+            os.remove(os.path.join(path, filename))
+        os.rmdir(path)
+
+    def load(self, recording_id):
+        """All sends of a finished recording as (seconds from start, board, commands), in time order"""
+        path = self._path(recording_id)
+        with open(os.path.join(path, "recording.json")) as f:
+            meta = json.load(f)
+        events = []
+        for info in meta["boards"].values():
+            with open(os.path.join(path, info["file"]), "rb") as f:
+                data = f.read()
+            if not data.startswith(RECORD_MAGIC):
+                raise ValueError(f"{info['file']} is not a BlueLink recording")
+            offset = len(RECORD_MAGIC)
+            (name_length,) = struct.unpack_from(">H", data, offset)
+            offset += 2
+            board = data[offset:offset + name_length].decode()
+            offset += name_length + 8  # skip the start time
+            elapsed = 0
+            while offset + RECORD_ENTRY.size <= len(data):
+                delta, length = RECORD_ENTRY.unpack_from(data, offset)
+                offset += RECORD_ENTRY.size
+                elapsed += delta
+                events.append((elapsed / 1e6, board, data[offset:offset + length].decode().split("\n")))
+                offset += length
+        events.sort(key=lambda event: event[0])
+        return meta, events
+
+command_recorder = CommandRecorder(RECORDINGS_DIR)
+
+PTY_PREFIXES = ("/dev/pts/", "/dev/ttys")  # Linux and macOS pseudo-terminals, e.g. fakeboard.py
+
+class Replayer:
+    """Streams recordings back with their original timing.
+
+    Commands go to the registered boards (optionally renamed), or all to
+    one serial port such as a fakeboard.py pty, through the same writer and
+    reader a real board gets. ``speed`` scales time (2 = twice as fast) and
+    ``repeat`` plays the recording back to back, which makes a recording of
+    a real session a load generator. A replay port must be a serial port or
+    pty on this host that no board or running replay is using.
+    """
+    def __init__(self):
+        self.jobs = OrderedDict()
+        self.cancels = {}
+        self.lock = threading.Lock()
+
+    def check_port(self, port):
+        """Raise ValueError unless port is a free local serial port or pty; return its device path"""
+        if "://" in port:
+            raise ValueError("port must be a device path, not a URL")
+        device = os.path.realpath(port)
+        with arduino_manager.lock:
+            taken = {os.path.realpath(entry["port"]) for entry in arduino_manager.registry.values() if entry.get("port")}
+        if device in taken:
+            raise ValueError(f"{port} belongs to a registered Arduino")
+        listed = {os.path.realpath(p["device"]) for p in arduino_manager.list_ports()}
+        if device not in listed and not device.startswith(PTY_PREFIXES):
+            raise ValueError(f"{port} is not a serial port on this host")
+        return device
+
+    def start(self, recording_id, speed=1.0, port=None, boards=None, repeat=1):
+        meta, events = command_recorder.load(recording_id)
+        device = self.check_port(port) if port else None
+        job = {
+            "id": uuid.uuid4().hex[:12], "recording": recording_id, "status": "running",
+            "speed": speed, "repeat": repeat, "target": port or "boards", "events": len(events) * repeat,
+            "sent": 0, "failed": 0, "late_p50_ms": None, "late_p99_ms": None, "late_max_ms": None,
+            "link": None, "error": None, "started": time.time(), "finished": None,
+        }
+        cancel = threading.Event()
+        with self.lock:
+            if device and any(old["status"] == "running" and old.get("device") == device for old in self.jobs.values()):
+                raise ValueError(f"{port} is already being replayed to")
+            job["device"] = device
+            self.jobs[job["id"]] = job
+            self.cancels[job["id"]] = cancel
+            # Running jobs are never evicted: their cancel event is the only way to stop them
+            finished = [job_id for job_id, old in self.jobs.items() if old["status"] != "running"]
+            for old_id in finished[:max(0, len(self.jobs) - REPLAY_JOB_HISTORY)]:
+                del self.jobs[old_id]
+                self.cancels.pop(old_id, None)
+        threading.Thread(target=self._run, args=(job, events, cancel, device, boards or {}),
+                         name=f"replay-{job['id']}", daemon=True).start()
+        return job
+
+    def stop(self, job_id):
+        cancel = self.cancels.get(job_id)
+        if cancel is not None:
+            cancel.set()
+        return self.jobs.get(job_id)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def recent(self):
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+
+    def _run(self, job, events, cancel, port, boards):
+        writer = reader = ser = None
+        name = f"replay-{job['id']}"
+        late = []
+        try:
+            if port:
+                ser = serial.Serial(port, ARDUINO_BAUD_RATE, timeout=ARDUINO_TIMEOUT)
+                lost = lambda _: cancel.set()
+                info = lambda _, key, value: writer and writer.board_info(key, value)
+                reader = BoardReader(name, ser, lost, on_info=info)
+                writer = BoardWriter(name, ser, lost, on_write=reader.expect)
+                writer.submit("INFO")
+                send = lambda board, commands: writer.submit_many(commands)
+            else:
+                send = lambda board, commands: arduino_manager.send_batch(boards.get(board, board), commands)
+
+            # Absolute deadlines, as in the control loop, so sleep error does not accumulate
+            duration = events[-1][0] if events else 0.0
+            started = time.perf_counter()
+            for lap in range(job["repeat"]):
+                offset = lap * duration
+                for at, board, commands in events:
+                    if cancel.is_set():
+                        break
+                    deadline = started + (offset + at) / job["speed"]
+                    now = time.perf_counter()
+                    if now < deadline:
+                        if cancel.wait(deadline - now):
+                            break
+                        now = time.perf_counter()
+                    late.append((now - deadline) * 1000)
+                    if send(board, commands):
+                        job["sent"] += 1
+                    else:
+                        job["failed"] += 1
+            job["status"] = "stopped" if cancel.is_set() else "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            logger.error(f"❌ Replay {job['id']} failed: {e}")
+        finally:
+            if writer is not None:
+                time.sleep(0.1)  # let the last batch and its acks through
+                job["link"] = reader.health()
+                writer.close()
+                reader.running = False
+                ser.close()
+                reader.close()
+                stepper_tracker.forget(name)
+            late.sort()
+            if late:
+                job["late_p50_ms"] = late[len(late) // 2]
+                job["late_p99_ms"] = late[int(len(late) * 0.99)]
+                job["late_max_ms"] = late[-1]
+            job["finished"] = time.time()
+
+replayer = Replayer()
+
+# ============================================================================
+# STATE MIRROR
+# ============================================================================
+class StateMirror:
+    """Live copy of board health, last-written pin values and serial ports.
+
+    Two watcher threads refresh it (boards and pins every
+    STATE_MIRROR_INTERVAL, the port inventory every PORT_SCAN_INTERVAL) and
+    publish only what changed. Each delta is encoded once as a server-sent
+    event and handed to every open dashboard, so extra dashboards cost a
+    queue put each instead of a round of REST calls. In worker mode the
+    owner runs the watchers and workers follow its deltas.
+    """
+    SECTIONS = ("boards", "pins", "ports")
+    END = object()  # queued to end a dashboard's stream
+
+    def __init__(self):
+        self.state = {section: {} for section in self.SECTIONS}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.subscribers = {}  # asyncio.Queue -> its event loop
+        self.listeners = []    # called with every delta (the owner forwards them to workers)
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._scan_ports()
+        threading.Thread(target=self._watch, args=(self._collect_boards, STATE_MIRROR_INTERVAL),
+                         name="mirror-boards", daemon=True).start()
+        threading.Thread(target=self._watch, args=(self._scan_ports, PORT_SCAN_INTERVAL),
+                         name="mirror-ports", daemon=True).start()
+
+    def _watch(self, refresh, interval):
+        while self.running:
+            time.sleep(interval)
+            try:
+                refresh()
+            except Exception as e:
+                logger.warning(f"⚠️  State mirror refresh failed: {e}")
+
+    def _collect_boards(self):
+        boards, pins = {}, {}
+        for name, stats in arduino_manager.stats().items():
+            boards[name] = {
+                "connected": stats["connected"], "port": stats["port"], "node": stats["node"],
+                "failures": stats["failures"], "link": stats["link"]["status"] if stats["link"] else None,
+            }
+            writer = arduino_manager.writers.get(name)
+            # A disconnected board keeps showing what it was last set to
+            pins[name] = dict(writer.pins) if writer else self.state["pins"].get(name, {})
+        self._update({"boards": boards, "pins": pins})
+
+    def _scan_ports(self):
+        self._update({"ports": {port["device"]: port for port in arduino_manager.list_ports()}})
+
+    def _update(self, sections):
+        with self.lock:
+            changes = {}
+            for section, entries in sections.items():
+                current = self.state[section]
+                changed = {key: value for key, value in entries.items() if current.get(key) != value}
+                changed.update({key: None for key in current if key not in entries})
+                if changed:
+                    changes[section] = changed
+            if not changes:
+                return
+            self._merge(changes)
+            self.version += 1
+            delta = {"version": self.version, "changes": changes}
+        self._broadcast(delta)
+
+    def _merge(self, changes):
+        for section, entries in changes.items():
+            current = self.state[section]
+            for key, value in entries.items():
+                if value is None:
+                    current.pop(key, None)
+                else:
+                    current[key] = value
+
+    def apply(self, delta):
+        """Merge a delta from the owner process (None removes an entry)"""
+        with self.lock:
+            self._merge(delta["changes"])
+            self.version = delta["version"]
+        self._broadcast(delta)
+
+    def _broadcast(self, delta):
+        self._publish(self._event("delta", delta))
+        for listener in list(self.listeners):
+            listener(delta)
+
+    def load(self, snapshot):
+        """Replace the whole state, e.g. a worker catching up with the owner"""
+        with self.lock:
+            self.state = {section: dict(snapshot["state"].get(section, {})) for section in self.SECTIONS}
+            self.version = snapshot["version"]
+        self._publish(self._event("snapshot", snapshot))
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    def snapshot(self):
+        with self.lock:
+            return {"version": self.version, "state": {section: dict(entries) for section, entries in self.state.items()}}
+
+    def ports(self):
+        return list(self.state["ports"].values())
+
+    @staticmethod
+    def _event(kind, data):
+        return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    def snapshot_event(self):
+        return self._event("snapshot", self.snapshot())
+
+    def subscribe(self, loop):
+        queue = asyncio.Queue(maxsize=STATE_MIRROR_QUEUE)
+        self.subscribers[queue] = loop
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    def _publish(self, message):
+        for queue, loop in list(self.subscribers.items()):
+            loop.call_soon_threadsafe(self._offer, queue, message)
+
+    def close_streams(self):
+        """End every dashboard stream (the server is stopping; browsers reconnect)"""
+        self._publish(self.END)
+
+    @staticmethod
+    def _offer(queue, message):
+        if queue.full() or message is StateMirror.END:
+            # A dashboard that fell behind skips to a fresh snapshot
+            while not queue.empty():
+                queue.get_nowait()
+            message = None
+        queue.put_nowait(message)
+
+state_mirror = StateMirror()
 
 # ============================================================================
-# AUTHENTICATION
+# FIRMWARE JOBS
 # ============================================================================
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+class FirmwareError(Exception):
+    def __init__(self, message, error=None):
+        super().__init__(message)
+        self.message = message
+        self.error = error
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+class FirmwareJobs:
+    """Background firmware builds and uploads.
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+    Compiled sketches are cached on disk by (sketch hash, FQBN), so flashing
+    several identical boards compiles once. Uploads to different ports run in
+    parallel; each port is flashed by one job at a time.
+    """
+    def __init__(self, cache_dir, workers):
+        self.cache_dir = cache_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firmware")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.build_locks = {}
+        self.port_locks = {}
+        self.cli_found = False
 
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
+    def _cli_available(self):
+        # Only a success is remembered, so installing arduino-cli later works without a restart
+        if not self.cli_found:
+            try:
+                result = subprocess.run(["arduino-cli", "version"], capture_output=True, timeout=30)
+                self.cli_found = result.returncode == 0
+            except (OSError, subprocess.TimeoutExpired):
+                self.cli_found = False
+        return self.cli_found
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401)
-    except JWTError:
-        raise HTTPException(status_code=401)
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise HTTPException(status_code=401)
-    return user
+    def _lock_for(self, locks, key):
+        with self.lock:
+            return locks.setdefault(key, threading.Lock())
+
+    def submit(self, filename, content, ports, fqbn):
+        """Queue one upload job per port; returns the new jobs"""
+        kind = os.path.splitext(filename)[1].lower()
+        artifact = hashlib.sha256(fqbn.encode() + b"\0" + kind.encode() + b"\0" + content).hexdigest()[:16]
+        jobs = []
+        for port in ports:
+            job = {
+                "id": uuid.uuid4().hex[:12], "status": "queued", "port": port, "fqbn": fqbn,
+                "file": filename, "artifact": artifact, "cached": None,
+                "message": "Queued", "error": None, "created": time.time(), "finished": None,
+            }
+            with self.lock:
+                self.jobs[job["id"]] = job
+                while len(self.jobs) > FIRMWARE_JOB_HISTORY:
+                    self.jobs.popitem(last=False)
+            self.executor.submit(self._run, job, content, kind)
+            jobs.append(job)
+        return jobs
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def recent(self):
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+
+    def _artifact(self, job, content, kind):
+        """Return the .hex to flash, compiling the sketch unless it is cached"""
+        directory = os.path.join(self.cache_dir, job["artifact"])
+        hex_path = os.path.join(directory, "sketch.ino.hex")
+        with self._lock_for(self.build_locks, job["artifact"]):
+            if os.path.exists(hex_path):
+                job["cached"] = True
+                return hex_path
+            job["cached"] = False
+            os.makedirs(directory, exist_ok=True)
+
+            if kind == ".hex":
+                with open(hex_path, "wb") as f:
+                    f.write(content)
+                return hex_path
+
+            job["status"] = "compiling"
+            job["message"] = "Compiling sketch"
+            # arduino-cli wants the sketch inside a folder of the same name
+            with tempfile.TemporaryDirectory() as tmp:
+                sketch_dir = os.path.join(tmp, "sketch")
+                os.makedirs(sketch_dir)
+                with open(os.path.join(sketch_dir, "sketch.ino"), "wb") as f:
+                    f.write(content)
+                result = subprocess.run(
+                    ["arduino-cli", "compile", "--fqbn", job["fqbn"], "--output-dir", directory, sketch_dir],
+                    capture_output=True,
+                    text=True,
+                    timeout=120
+                )
+            if result.returncode != 0 or not os.path.exists(hex_path):
+                raise FirmwareError("Compilation failed", result.stderr)
+            return hex_path
+
+    def _run(self, job, content, kind):
+        started = time.perf_counter()
+        try:
+            if not self._cli_available():
+                raise FirmwareError("arduino-cli not found. Please install it first.")
+            hex_path = self._artifact(job, content, kind)
+
+            job["status"] = "waiting"
+            job["message"] = f"Waiting for {job['port']}"
+            with self._lock_for(self.port_locks, job["port"]):
+                job["status"] = "uploading"
+                job["message"] = "Uploading firmware"
+                # Free the port if a connected board is using it; it reconnects afterwards
+                board = arduino_manager.pause_port(job["port"])
+                try:
+                    result = subprocess.run(
+                        ["arduino-cli", "upload", "-p", job["port"], "--fqbn", job["fqbn"], "-i", hex_path],
+                        capture_output=True,
+                        text=True,
+                        timeout=60
+                    )
+                finally:
+                    if board:
+                        arduino_manager.resume(board)
+
+            if result.returncode != 0:
+                raise FirmwareError("Upload failed", result.stderr)
+            job.update(status="done", message="Firmware uploaded successfully!", output=result.stdout)
+        except subprocess.TimeoutExpired:
+            job.update(status="failed", message="Timeout - Arduino may not be responding")
+        except FirmwareError as e:
+            job.update(status="failed", message=e.message, error=e.error)
+        except Exception as e:
+            job.update(status="failed", message=f"Error: {str(e)}")
+        finally:
+            job["finished"] = time.time()
+            job["duration_ms"] = (time.perf_counter() - started) * 1000
+            metric_firmware_seconds.observe(job["duration_ms"] / 1000, status=job["status"])
+
+firmware_jobs = FirmwareJobs(FIRMWARE_CACHE_DIR, FIRMWARE_WORKERS)
 
 # ============================================================================
-# ARDUINO MANAGER
+# WORKER MODE
 # ============================================================================
-class ArduinoManager:
-    def __init__(self):
-        self.connections = {}
+# With ``--workers N`` the main process owns the serial ports, the control
+# loop and the job queues, and serves them on a private Unix socket. Each
+# uvicorn worker swaps those objects for proxies that forward method calls,
+# so every board still has exactly one writer. Messages are JSON arrays
+# length-prefixed with IPC_HEADER (bytes travel as {"$bytes": base64}), so
+# only plain data crosses; the socket is only reachable by this user.
+#   worker -> owner: ["call", service, method, args, kwargs], ["routes"],
+#                    ["users", usernames], ["state"], ["metrics", pid, snapshot, render]
+#   owner -> worker: ["ok", value] or ["error", exception class name, message]
+#   owner -> subscriber: ["routes"], ["users", usernames], ["state", delta]
+IPC_HEADER = struct.Struct(">I")
 
-    def list_ports(self):
-        """List all available serial ports"""
+# Exceptions that keep their type when a call fails in the owner; others arrive as RuntimeError
+IPC_ERRORS = {cls.__name__: cls for cls in (ValueError, TypeError, KeyError, LookupError, AttributeError,
+                                            FileNotFoundError, PermissionError, TimeoutError)}
+
+# Objects the owner serves, and the methods workers may call on them
+OWNER_SERVICES = {
+    "arduino_manager": {"send", "send_batch", "connect", "connect_all", "forget", "hwid",
+                        "list_ports", "stats", "telemetry", "pause_port", "resume",
+                        "sample", "input_samples"},
+    "control_loop": {"feed", "command", "report"},
+    "stepper_tracker": {"enqueue", "queue_depth", "state", "stop", "forget"},
+    "login_limiter": {"retry_after", "failed", "succeeded"},
+    "firmware_jobs": {"submit", "get", "recent"},
+    "command_recorder": {"start", "stop", "status", "recordings", "delete"},
+    "replayer": {"start", "stop", "get", "recent"},
+}
+
+def _ipc_default(value):
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode()}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} cannot be sent to another process")
+
+def _ipc_object(obj):
+    return base64.b64decode(obj["$bytes"]) if obj.keys() == {"$bytes"} else obj
+
+def ipc_send(sock, message):
+    data = json.dumps(message, default=_ipc_default, separators=(",", ":")).encode()
+    sock.sendall(IPC_HEADER.pack(len(data)) + data)
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while size:
+        received = sock.recv_into(view[len(buffer) - size:], size)
+        if not received:
+            raise ConnectionError("owner socket closed")
+        size -= received
+    return buffer
+
+def ipc_recv(sock):
+    (length,) = IPC_HEADER.unpack(_recv_exact(sock, IPC_HEADER.size))
+    return json.loads(_recv_exact(sock, length), object_hook=_ipc_object)
+
+class OwnerServer:
+    """The owner process's side: runs calls from workers on the real objects.
+
+    Each worker thread keeps its own connection, served by its own thread
+    here. Workers also hold one subscription connection each, used to tell
+    them to reload the routing table or drop cached tokens after another
+    worker changed routes or users. A worker's metrics are dropped when the
+    connection that pushed them closes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = set()
+        self.worker_metrics = {}  # worker pid -> metrics snapshot
+        self.lock = threading.Lock()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(128)
+        threading.Thread(target=self._accept, name="owner-ipc", daemon=True).start()
+        state_mirror.listeners.append(lambda delta: self.broadcast(["state", delta]))
+        logger.info(f"🧵 Serving boards to workers on {self.path}")
+
+    def _accept(self):
+        while True:
+            conn, _ = self.sock.accept()
+            threading.Thread(target=self._serve, args=(conn,), name="owner-ipc-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        pid = None
         try:
-            return [{"device": p.device, "description": p.description, "hwid": p.hwid}
-                    for p in serial.tools.list_ports.comports()]
-        except Exception as e:
-            print(f"Error listing ports: {e}")
-            return []
+            while True:
+                request = ipc_recv(conn)
+                if request[0] == "subscribe":
+                    with self.lock:
+                        self.subscribers.add(conn)
+                    return
+                if request[0] == "metrics":
+                    pid = request[1]
+                try:
+                    reply = ["ok", self._call(*request)]
+                except Exception as e:
+                    reply = ["error", type(e).__name__, str(e)]
+                try:
+                    ipc_send(conn, reply)
+                except (TypeError, ValueError) as e:
+                    ipc_send(conn, ["error", "RuntimeError", str(e)])
+        except (OSError, ValueError):
+            conn.close()
+            if pid is not None:
+                self.worker_metrics.pop(pid, None)
+
+    def _call(self, op, *args):
+        if op == "call":
+            service, method, args, kwargs = args
+            if method not in OWNER_SERVICES.get(service, ()):
+                raise AttributeError(f"{service}.{method} is not available to workers")
+            return getattr(globals()[service], method)(*args, **kwargs)
+        if op == "routes":
+            with SessionLocal() as db:
+                routing_table.rebuild(db)
+            self.broadcast(["routes"])
+            return None
+        if op == "users":
+            for username in args[0]:
+                token_cache.invalidate_user(username)
+            self.broadcast(["users", args[0]])
+            return None
+        if op == "state":
+            return state_mirror.snapshot()
+        if op == "metrics":
+            pid, snapshot, render = args
+            self.worker_metrics[pid] = {name: [(suffix, tuple(names), tuple(key), value)
+                                               for suffix, names, key, value in samples]
+                                        for name, samples in snapshot.items()}
+            return metrics.render(list(self.worker_metrics.values())) if render else None
+        raise ValueError(f"Unknown request {op!r}")
+
+    def broadcast(self, message):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for conn in subscribers:
+            try:
+                ipc_send(conn, message)
+            except OSError:
+                with self.lock:
+                    self.subscribers.discard(conn)
+                conn.close()
+
+class OwnerClient:
+    """A worker's connection to the owner process, one socket per thread"""
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
 
-    def connect(self, name, port):
-        """Connect to an Arduino on the specified port"""
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def request(self, *message):
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = self.local.sock = self._connect()
         try:
-            # Close existing connection if any
-            if name in self.connections:
-                self.disconnect(name)
+            ipc_send(sock, list(message))
+            reply = ipc_recv(sock)
+        except (OSError, ValueError):
+            self.local.sock = None
+            sock.close()
+            raise
+        if reply[0] == "error":
+            raise IPC_ERRORS.get(reply[1], RuntimeError)(reply[2])
+        return reply[1]
 
-            ser = serial.Serial(port, ARDUINO_BAUD_RATE, timeout=ARDUINO_TIMEOUT)
-            self.connections[name] = ser
-            print(f"✅ Connected to {name} on {port}")
-            return True
-        except serial.SerialException as e:
-            print(f"❌ Serial error connecting to {port}: {e}")
-            return False
-        except Exception as e:
-            print(f"❌ Unexpected error connecting to {port}: {e}")
-            return False
+    def start_worker(self):
+        """Follow routing changes and report this worker's metrics"""
+        threading.Thread(target=self._subscribe, name="owner-subscription", daemon=True).start()
+        threading.Thread(target=self._push_metrics, name="owner-metrics", daemon=True).start()
 
-    def disconnect(self, name):
-        """Disconnect from an Arduino"""
-        if name in self.connections:
+    def _subscribe(self):
+        while True:
             try:
-                self.connections[name].close()
-                del self.connections[name]
-                print(f"✅ Disconnected from {name}")
+                sock = self._connect()
+                ipc_send(sock, ["subscribe"])
+                # Changes made while this was disconnected are picked up here;
+                # deltas that arrive twice are harmless, they only set values
+                with SessionLocal() as db:
+                    routing_table.rebuild(db)
+                token_cache.clear()
+                state_mirror.load(self.request("state"))
+                while True:
+                    message = ipc_recv(sock)
+                    if message[0] == "routes":
+                        with SessionLocal() as db:
+                            routing_table.rebuild(db)
+                    elif message[0] == "users":
+                        for username in message[1]:
+                            token_cache.invalidate_user(username)
+                    elif message[0] == "state":
+                        state_mirror.apply(message[1])
             except Exception as e:
-                print(f"⚠️  Error disconnecting from {name}: {e}")
+                logger.warning(f"⚠️  Lost the owner process subscription: {e}")
+                time.sleep(RECONNECT_INTERVAL)
 
-    def send(self, name, command):
-        """Send a command to an Arduino"""
-        if name not in self.connections:
-            print(f"⚠️  Arduino '{name}' not connected")
-            return False
+    def _push_metrics(self):
+        while True:
+            time.sleep(WORKER_METRICS_INTERVAL)
+            try:
+                self.request("metrics", os.getpid(), metrics.snapshot(), False)
+            except Exception:
+                pass
 
-        try:
-            self.connections[name].write(f"{command}\n".encode())
-            return True
-        except serial.SerialException as e:
-            print(f"❌ Serial error sending to {name}: {e}")
-            # Connection may be broken, remove it
-            self.disconnect(name)
-            return False
-        except Exception as e:
-            print(f"❌ Error sending to {name}: {e}")
-            return False
-    
-    def upload_firmware(self, port, hex_file_path, board_type="arduino:avr:uno"):
-        """Upload firmware to Arduino using avrdude"""
-        try:
-            # Check if arduino-cli is available
-            result = subprocess.run(
-                ["arduino-cli", "version"],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                return {"success": False, "message": "arduino-cli not found. Please install it first."}
-            
-            # Upload the firmware
-            upload_result = subprocess.run(
-                ["arduino-cli", "upload", "-p", port, "-b", board_type, "-i", hex_file_path],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-            
-            if upload_result.returncode == 0:
-                return {"success": True, "message": "Firmware uploaded successfully!", "output": upload_result.stdout}
-            else:
-                return {"success": False, "message": "Upload failed", "error": upload_result.stderr}
-                
-        except subprocess.TimeoutExpired:
-            return {"success": False, "message": "Upload timeout - Arduino may not be responding"}
-        except Exception as e:
-            return {"success": False, "message": f"Upload error: {str(e)}"}
-    
-    def compile_and_upload(self, port, ino_file_path, board_type="arduino:avr:uno"):
-        """Compile and upload .ino file"""
-        try:
-            # Check arduino-cli
-            result = subprocess.run(["arduino-cli", "version"], capture_output=True)
-            if result.returncode != 0:
-                return {"success": False, "message": "arduino-cli not found"}
-            
-            # Compile the sketch
-            compile_result = subprocess.run(
-                ["arduino-cli", "compile", "--fqbn", board_type, ino_file_path],
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
-            
-            if compile_result.returncode != 0:
-                return {"success": False, "message": "Compilation failed", "error": compile_result.stderr}
-            
-            # Upload
-            upload_result = subprocess.run(
-                ["arduino-cli", "upload", "-p", port, "--fqbn", board_type, ino_file_path],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-            
-            if upload_result.returncode == 0:
-                return {"success": True, "message": "Compiled and uploaded successfully!"}
-            else:
-                return {"success": False, "message": "Upload failed", "error": upload_result.stderr}
-                
-        except Exception as e:
-            return {"success": False, "message": f"Error: {str(e)}"}
+class OwnerProxy:
+    """Stands in for an object that lives in the owner process"""
+    def __init__(self, client, service):
+        self._client = client
+        self._service = service
 
-arduino_manager = ArduinoManager()
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            return self._client.request("call", self._service, method, args, kwargs)
+        return call
+
+def routes_changed():
+    """Boards or mappings changed: have the owner and the other workers reload them"""
+    if owner_client is not None:
+        owner_client.request("routes")
+
+def users_changed(usernames):
+    """Users were updated or deleted: drop their cached tokens in every process"""
+    if owner_client is not None:
+        owner_client.request("users", list(usernames))
+    elif owner_server is not None:
+        owner_server.broadcast(["users", list(usernames)])
+
+def serve_owner():
+    """Bring the boards up in this process and serve them to the workers it is about to start"""
+    if admin_missing():
+        create_admin(get_password_hash("admin123"))
+    start_control()
+    global owner_server
+    path = os.path.join(tempfile.mkdtemp(prefix="bluelink-"), "owner.sock")
+    owner_server = OwnerServer(path)
+    owner_server.start()
+    # Inherited by the uvicorn workers, which then proxy to this process
+    os.environ["OWNER_SOCKET"] = path
+
+owner_server = None
+owner_client = None
+if OWNER_SOCKET:
+    owner_client = OwnerClient(OWNER_SOCKET)
+    for _service in OWNER_SERVICES:
+        globals()[_service] = OwnerProxy(owner_client, _service)
 
 # ============================================================================
 # PYDANTIC SCHEMAS
@@ -274,11 +3368,11 @@ class ArduinoCreate(BaseModel):
     name: str
     serial_port: str
     board_type: Optional[str] = "uno"
+    node: Optional[str] = None  # agent node the port belongs to; default: this host
 
-class MappingCreate(BaseModel):
+class MappingFields(BaseModel):
     controller_input: str
     input_type: str = "digital"  # digital, analog, pwm
-    arduino_id: int
     arduino_pin: str
     pin_mode: str = "output"  # output, pwm, stepper
     
@@ -286,6 +3380,13 @@ class MappingCreate(BaseModel):
     min_value: Optional[int] = 0
     max_value: Optional[int] = 255
     invert: Optional[bool] = False
+
+    # Input shaping
+    deadzone: Optional[float] = None
+    curve: Optional[str] = None
+    smoothing: Optional[float] = None
+    change_threshold: Optional[int] = None
+    max_rate_hz: Optional[float] = None
     
     # Stepper settings
     stepper_steps: Optional[int] = 200
@@ -294,6 +3395,30 @@ class MappingCreate(BaseModel):
     stepper_pin3: Optional[str] = None
     stepper_pin4: Optional[str] = None
 
+class MappingCreate(MappingFields):
+    arduino_id: int
+    profile_id: Optional[int] = None  # default: the active profile
+
+class ConfigArduino(BaseModel):
+    name: str
+    serial_port: str
+    board_type: Optional[str] = "uno"
+    hwid: Optional[str] = None
+    node: Optional[str] = None
+
+class ConfigMapping(MappingFields):
+    arduino: str  # board name, ids are not portable between installs
+
+class ConfigImport(BaseModel):
+    profile: Optional[str] = None  # profile name, created if missing; default: the active profile
+    arduinos: list[ConfigArduino] = []
+    mappings: list[ConfigMapping] = []
+    replace: bool = False  # delete the profile's existing mappings first
+
+class ProfileCreate(BaseModel):
+    name: str
+    copy_from: Optional[int] = None  # profile id whose mappings are copied
+
 class PWMCommand(BaseModel):
     arduino_id: int
     pin: str
@@ -304,6 +3429,25 @@ class StepperCommand(BaseModel):
     pins: list[str]  # [pin1, pin2, pin3, pin4]
     steps: int
     speed: int
+    accel: Optional[int] = None  # steps/s^2, None = no ramp
+
+class RecordingStart(BaseModel):
+    name: Optional[str] = None
+
+class ReplayRequest(BaseModel):
+    speed: float = 1.0  # 2 = twice as fast
+    repeat: int = 1
+    port: Optional[str] = None  # replay everything to this serial port instead of the boards
+    boards: dict[str, str] = {}  # recorded board name -> board to send to
+
+class SampleConfig(BaseModel):
+    pins: list[str] = []  # e.g. ["A0", "A1", "2"]; empty stops sampling
+    rate: int = 100  # samples per second, up to 1000
+    deadband: int = 0  # analog change (0-1023) needed before a value is resent
+
+class StepperStop(BaseModel):
+    arduino_id: int
+    pin: str  # first pin of the stepper
 
 # ============================================================================
 # FASTAPI APP
@@ -328,46 +3472,254 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so /api/mappings/1 and /api/mappings/2 share a series
+        route = request.scope.get("route")
+        metric_http_seconds.observe(time.perf_counter() - started, method=request.method,
+                                    route=route.path if route else "unmatched", status=status)
+
 # ============================================================================
 # STARTUP
 # ============================================================================
-@app.on_event("startup")
-async def startup_event():
+def remember_board_port(name, port, hwid):
+    """Persist the port/hwid a board was rediscovered on"""
     db = SessionLocal()
     try:
-        existing = db.query(User).filter(User.username == "admin").first()
-        if not existing:
-            admin = User(username="admin", password_hash=get_password_hash("admin123"))
-            db.add(admin)
+        ar = db.query(Arduino).filter(Arduino.name == name).first()
+        if ar:
+            ar.serial_port = port
+            ar.hwid = hwid
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️  Could not save new port for {name}: {e}")
+    finally:
+        db.close()
+
+def ensure_active_profile(db):
+    """Make sure a profile is active; mappings from before profiles existed join it"""
+    profile = db.query(Profile).filter(Profile.active == True).first()
+    if profile is None:
+        profile = db.query(Profile).first() or Profile(name="Default")
+        profile.active = True
+        db.add(profile)
+        db.flush()
+    db.query(Mapping).filter(Mapping.profile_id == None).update({Mapping.profile_id: profile.id})
+    db.commit()
+
+def admin_missing():
+    with SessionLocal() as db:
+        return db.query(User).filter(User.username == "admin").first() is None
+
+def create_admin(password_hash):
+    with SessionLocal() as db:
+        if db.query(User).filter(User.username == "admin").first() is None:
+            db.add(User(username="admin", password_hash=password_hash))
             db.commit()
-            print("✅ Created default admin user (username: admin, password: admin123)")
-        print("🚀 BlueLink Advanced server started!")
+            logger.info("✅ Created default admin user (username: admin, password: admin123)")
+
+def start_control():
+    """Load the routing table and bring the boards up"""
+    if owner_client is not None:
+        # A worker: the owner process has the boards, only follow its routing
+        owner_client.start_worker()
+        return
+    db = SessionLocal()
+    try:
+        ensure_active_profile(db)
+        routing_table.rebuild(db)
+        boards = [(ar.name, ar.serial_port, ar.hwid, ar.node) for ar in db.query(Arduino).all()]
     finally:
         db.close()
 
+    # Reconnect every stored board in the background, then keep them connected
+    arduino_manager.on_board_moved = remember_board_port
+    threading.Thread(target=arduino_manager.connect_all, args=(boards,), daemon=True).start()
+    arduino_manager.start_supervisor()
+    control_loop.start()
+    state_mirror.start()
+
+def close_streams_on_exit():
+    """Event streams never finish, so the server would wait for them forever
+    on shutdown. Chain a handler that ends them onto SIGINT/SIGTERM; asyncio
+    still delivers the signal to uvicorn through its wakeup fd."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+
+        def handler(signum, frame, previous=previous):
+            state_mirror.close_streams()
+            if callable(previous):
+                previous(signum, frame)
+        signal.signal(sig, handler)
+
+@app.on_event("startup")
+async def startup_event():
+    # Database work runs in the threadpool and bcrypt on its own pool, keeping the loop free
+    if await run_in_threadpool(admin_missing):
+        await run_in_threadpool(create_admin, await password_hasher.hash("admin123"))
+    await run_in_threadpool(start_control)
+    close_streams_on_exit()
+    logger.info("🚀 BlueLink Advanced server started!")
+
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 @app.post("/login", response_model=Token)
-def login(form: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form.username).first()
-    if not user or not verify_password(form.password, user.password_hash):
+async def login(form: UserLogin, request: Request):
+    # In worker mode the limiter lives in the owner process; each call is a socket round-trip
+    client = request.client.host if request.client else None
+    retry_after = await run_in_threadpool(login_limiter.retry_after, form.username, client)
+    if retry_after:
+        metric_login_rejected.inc(reason="locked")
+        raise HTTPException(status_code=429, detail="Too many login attempts, try again later",
+                            headers={"Retry-After": str(int(retry_after) + 1)})
+
+    users = await fetch_all(select(User).where(User.username == form.username))
+    user = users[0] if users else None
+    try:
+        valid = user is not None and await password_hasher.verify(form.password, user.password_hash)
+    except PasswordHasherBusy:
+        metric_login_rejected.inc(reason="busy")
+        raise HTTPException(status_code=503, detail="Too many logins in progress, try again shortly",
+                            headers={"Retry-After": "1"})
+    if not valid:
+        await run_in_threadpool(login_limiter.failed, form.username, client)
         raise HTTPException(status_code=400, detail="Invalid credentials")
+
+    await run_in_threadpool(login_limiter.succeeded, form.username, client)
     token = create_access_token({"sub": user.username})
     return {"access_token": token, "token_type": "bearer"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    if owner_client is not None:
+        # The owner adds up every worker's samples with its own
+        text = owner_client.request("metrics", os.getpid(), metrics.snapshot(), True)
+    else:
+        text = metrics.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 @app.get("/api/ports")
-def list_serial_ports(user = Depends(get_current_user)):
-    return arduino_manager.list_ports()
+def list_serial_ports(node: Optional[str] = None, refresh: bool = False, user = Depends(get_current_user)):
+    """Serial ports on this host (from the last background scan unless
+    ``refresh`` is set), or on a connected agent node"""
+    if remote_node(node):
+        return node_hub.ports(node)
+    if refresh or not state_mirror.state["ports"]:
+        return arduino_manager.list_ports()
+    return state_mirror.ports()
+
+@app.get("/api/events")
+async def state_events(token: str = ""):
+    """Server-sent events for dashboards: a ``snapshot`` of boards, pins and
+    ports, then a ``delta`` whenever any of them changes (``null`` removes an
+    entry). EventSource cannot send headers, so pass ``?token=<jwt>``."""
+    if await run_in_threadpool(user_from_token, token) is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    queue = state_mirror.subscribe(asyncio.get_running_loop())
+
+    async def stream():
+        try:
+            yield state_mirror.snapshot_event()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is StateMirror.END:
+                    return
+                yield message if message is not None else state_mirror.snapshot_event()
+        finally:
+            state_mirror.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/nodes")
+def list_nodes(user = Depends(get_current_user)):
+    """Connected agent nodes with their boards and link traffic"""
+    return {"node": NODE_NAME, "agents": node_hub.status()}
+
+@app.get("/api/arduinos/stats")
+def arduino_stats(user = Depends(get_current_user)):
+    """Serial writer queue and throughput statistics per Arduino"""
+    return arduino_manager.stats()
+
+@app.get("/api/control-loop")
+def control_loop_stats(user = Depends(get_current_user)):
+    """Tick rate, overruns and jitter of the control loop"""
+    return control_loop.report()
+
+@app.get("/api/arduinos/{arduino_id}/telemetry")
+def arduino_telemetry(arduino_id: int, limit: int = 100, user = Depends(get_current_user)):
+    """Link health, round-trip latency and recent messages from an Arduino"""
+    name = routing_table.board_name(arduino_id)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Arduino not found")
+    telemetry = arduino_manager.telemetry(name, limit)
+    if telemetry is None:
+        raise HTTPException(status_code=409, detail=f"Arduino '{name}' is not connected")
+    return telemetry
+
+@app.post("/api/arduinos/{arduino_id}/sample")
+def sample_inputs(arduino_id: int, config: SampleConfig, user = Depends(get_current_user)):
+    """Start (or with no pins, stop) streaming an Arduino's inputs"""
+    name = routing_table.board_name(arduino_id)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Arduino not found")
+    pins = [pin.strip().upper() for pin in config.pins]
+    invalid = [pin for pin in pins if pin not in SAMPLE_PINS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Cannot sample pins: {', '.join(invalid)}")
+    if len(set(pins)) != len(pins):
+        raise HTTPException(status_code=400, detail="Pins must not repeat")
+    rate = max(1, min(SAMPLE_MAX_HZ, config.rate))
+    deadband = max(0, config.deadband)
+    if not arduino_manager.sample(name, pins, rate, deadband):
+        raise HTTPException(status_code=500, detail=f"Failed to send sample command to Arduino '{name}'")
+    return {"status": "sampling" if pins else "stopped", "arduino": name, "pins": pins, "rate": rate}
+
+@app.get("/api/arduinos/{arduino_id}/inputs")
+def input_samples(arduino_id: int, since: Optional[float] = None, limit: int = 500,
+                  pins: Optional[str] = None, user = Depends(get_current_user)):
+    """Sampled input values of an Arduino; ``since`` is a receive time from a previous answer"""
+    name = routing_table.board_name(arduino_id)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Arduino not found")
+    wanted = None
+    if pins:
+        wanted = [pin.strip().upper() for pin in pins.split(",") if pin.strip()]
+        invalid = [pin for pin in wanted if pin not in INPUT_COLUMNS]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Unknown pins: {', '.join(invalid)}")
+    samples = arduino_manager.input_samples(name, since, max(0, limit), wanted)
+    if samples is None:
+        raise HTTPException(status_code=409, detail=f"Arduino '{name}' has not connected yet")
+    return samples
 
 @app.get("/api/arduinos")
-def list_arduinos(db: Session = Depends(get_db), user = Depends(get_current_user)):
-    return db.query(Arduino).all()
+async def list_arduinos(user = Depends(get_current_user)):
+    return await fetch_all(select(Arduino))
 
 @app.post("/api/arduinos")
 def add_arduino(arduino: ArduinoCreate, db: Session = Depends(get_db), user = Depends(get_current_user)):
-    # Check if serial port is already in use
-    existing = db.query(Arduino).filter(Arduino.serial_port == arduino.serial_port).first()
+    arduino.node = node_key(arduino.node)
+
+    # Check if serial port is already in use on that node
+    existing = db.query(Arduino).filter(
+        Arduino.serial_port == arduino.serial_port, Arduino.node == arduino.node).first()
     if existing:
         raise HTTPException(status_code=400, detail=f"Serial port {arduino.serial_port} is already in use by '{existing.name}'")
 
@@ -381,10 +3733,15 @@ def add_arduino(arduino: ArduinoCreate, db: Session = Depends(get_db), user = De
         db.add(ar)
         db.commit()
         db.refresh(ar)
+        routing_table.add_board(ar)
+        routes_changed()
 
         # Try to connect to the Arduino
-        if not arduino_manager.connect(ar.name, ar.serial_port):
+        if not arduino_manager.connect(ar.name, ar.serial_port, node=ar.node):
             raise HTTPException(status_code=500, detail=f"Failed to connect to Arduino on {ar.serial_port}")
+        ar.hwid = arduino_manager.hwid(ar.name)
+        db.commit()
+        db.refresh(ar)
 
         return ar
     except HTTPException:
@@ -399,15 +3756,23 @@ def delete_arduino(arduino_id: int, db: Session = Depends(get_db), user = Depend
     ar = db.query(Arduino).filter(Arduino.id == arduino_id).first()
     if not ar:
         raise HTTPException(status_code=404, detail="Arduino not found")
-    arduino_manager.disconnect(ar.name)
+    arduino_manager.forget(ar.name)
+    stepper_tracker.forget(ar.name)
     db.query(Mapping).filter(Mapping.arduino_id == arduino_id).delete()
     db.delete(ar)
     db.commit()
+    routing_table.rebuild(db)
+    routes_changed()
     return {"message": "Arduino deleted"}
 
 @app.get("/api/mappings")
-def get_mappings(db: Session = Depends(get_db), user = Depends(get_current_user)):
-    return db.query(Mapping).all()
+async def get_mappings(profile_id: Optional[int] = None, user = Depends(get_current_user)):
+    """Mappings of a profile (default: the active one)"""
+    if profile_id is None:
+        profile_id = routing_table.profile_id
+    return await fetch_all(
+        select(Mapping).options(selectinload(Mapping.arduino)).where(Mapping.profile_id == profile_id)
+    )
 
 @app.post("/api/mappings")
 def add_mapping(mapping: MappingCreate, db: Session = Depends(get_db), user = Depends(get_current_user)):
@@ -416,8 +3781,13 @@ def add_mapping(mapping: MappingCreate, db: Session = Depends(get_db), user = De
     if not ar:
         raise HTTPException(status_code=404, detail=f"Arduino with ID {mapping.arduino_id} not found")
 
-    # Check if this controller input is already mapped
+    profile_id = mapping.profile_id or routing_table.profile_id
+    if not db.query(Profile).filter(Profile.id == profile_id).first():
+        raise HTTPException(status_code=404, detail=f"Profile with ID {profile_id} not found")
+
+    # Check if this controller input is already mapped in the profile
     existing = db.query(Mapping).filter(
+        Mapping.profile_id == profile_id,
         Mapping.controller_input == mapping.controller_input
     ).first()
     if existing:
@@ -427,10 +3797,17 @@ def add_mapping(mapping: MappingCreate, db: Session = Depends(get_db), user = De
         )
 
     try:
-        m = Mapping(**mapping.dict())
+        parse_curve(mapping.curve)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid curve: {e}")
+
+    try:
+        m = Mapping(**mapping.dict(exclude={"profile_id"}), profile_id=profile_id)
         db.add(m)
         db.commit()
         db.refresh(m)
+        routing_table.add_mapping(m)
+        routes_changed()
         return m
     except Exception as e:
         db.rollback()
@@ -443,89 +3820,471 @@ def delete_mapping(mapping_id: int, db: Session = Depends(get_db), user = Depend
         raise HTTPException(status_code=404, detail="Mapping not found")
     db.delete(m)
     db.commit()
+    routing_table.remove_mapping(m)
+    routes_changed()
     return {"message": "Mapping deleted"}
 
+@app.get("/api/config/export")
+def export_config(profile_id: Optional[int] = None, db: Session = Depends(get_db), user = Depends(get_current_user)):
+    """All boards and a profile's mappings (default: the active one) as JSON,
+    in the format /api/config/import takes"""
+    profile = db.query(Profile).filter(Profile.id == (profile_id or routing_table.profile_id)).first()
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    arduinos = db.query(Arduino).all()
+    mappings = db.query(Mapping).options(selectinload(Mapping.arduino)).filter(Mapping.profile_id == profile.id).all()
+    return {
+        "profile": profile.name,
+        "arduinos": [ConfigArduino(name=ar.name, serial_port=ar.serial_port, board_type=ar.board_type,
+                                   hwid=ar.hwid, node=ar.node or None) for ar in arduinos],
+        "mappings": [
+            {**{field: getattr(m, field) for field in MappingFields.model_fields}, "arduino": m.arduino.name}
+            for m in mappings if m.arduino is not None
+        ],
+    }
+
+@app.post("/api/config/import")
+def import_config(config: ConfigImport, db: Session = Depends(get_db), user = Depends(get_current_user)):
+    """Create or update boards (by name) and add mappings in one transaction.
+
+    Everything is validated up front with a few set-based queries; if any
+    entry is invalid nothing is written.
+    """
+    errors = []
+    boards = {ar.name: ar for ar in db.query(Arduino).all()}
+    port_owner = {(ar.node, ar.serial_port): ar.name for ar in boards.values()}
+
+    seen_names, seen_ports = set(), set()
+    for board in config.arduinos:
+        board.node = node_key(board.node)
+        if board.name in seen_names:
+            errors.append(f"Arduino '{board.name}' is listed twice")
+        if (board.node, board.serial_port) in seen_ports:
+            errors.append(f"Serial port {board.serial_port} is listed twice")
+        seen_names.add(board.name)
+        seen_ports.add((board.node, board.serial_port))
+    # A port may move between boards within the import, but not onto a board that is kept
+    for board in config.arduinos:
+        owner = port_owner.get((board.node, board.serial_port))
+        if owner is not None and owner != board.name and owner not in seen_names:
+            errors.append(f"Serial port {board.serial_port} is already in use by '{owner}'")
+
+    if config.profile:
+        profile = db.query(Profile).filter(Profile.name == config.profile).first()
+    else:
+        profile = db.query(Profile).filter(Profile.id == routing_table.profile_id).first()
+
+    inputs = Counter(m.controller_input for m in config.mappings)
+    errors += [f"Controller input '{name}' is listed twice" for name, n in inputs.items() if n > 1]
+    if profile is not None and not config.replace and inputs:
+        taken = db.query(Mapping.controller_input).filter(
+            Mapping.profile_id == profile.id,
+            Mapping.controller_input.in_(list(inputs))
+        ).all()
+        errors += [f"Controller input '{name}' is already mapped" for (name,) in taken]
+    known = set(boards) | seen_names
+    for m in config.mappings:
+        if m.arduino not in known:
+            errors.append(f"Mapping '{m.controller_input}' refers to unknown Arduino '{m.arduino}'")
+        try:
+            parse_curve(m.curve)
+        except ValueError as e:
+            errors.append(f"Mapping '{m.controller_input}' has an invalid curve: {e}")
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
+
+    try:
+        # Ports are changed in two steps so boards can swap ports within one
+        # import: moving boards first release theirs under a placeholder
+        moving = set()
+        for board in config.arduinos:
+            ar = boards.get(board.name)
+            if ar is not None and (ar.serial_port, ar.node) != (board.serial_port, board.node):
+                ar.serial_port = f"<moving {ar.id}>"
+                moving.add(ar.name)
+        if moving:
+            db.flush()
+
+        reconnect = []
+        for board in config.arduinos:
+            ar = boards.get(board.name)
+            if ar is None:
+                ar = boards[board.name] = Arduino(**board.dict())
+                db.add(ar)
+            elif ar.name in moving or ar.board_type != board.board_type:
+                ar.serial_port, ar.board_type, ar.node = board.serial_port, board.board_type, board.node
+                ar.hwid = board.hwid or ar.hwid
+            else:
+                continue
+            reconnect.append(ar)
+
+        if profile is None:
+            profile = Profile(name=config.profile or "Default", active=routing_table.profile_id is None)
+            db.add(profile)
+        replaced = 0
+        if config.replace and profile.id is not None:
+            replaced = db.query(Mapping).filter(Mapping.profile_id == profile.id).delete()
+        db.flush()  # assigns ids to new boards and profiles
+        db.add_all([
+            Mapping(**m.dict(exclude={"arduino"}), arduino_id=boards[m.arduino].id, profile_id=profile.id)
+            for m in config.mappings
+        ])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error importing configuration: {str(e)}")
+
+    routing_table.rebuild(db)
+    routes_changed()
+    if reconnect:
+        targets = [(ar.name, ar.serial_port, ar.hwid, ar.node) for ar in reconnect]
+        threading.Thread(target=arduino_manager.connect_all, args=(targets,), daemon=True).start()
+
+    return {
+        "profile": profile.name,
+        "arduinos": len(reconnect),
+        "mappings": len(config.mappings),
+        "replaced": replaced,
+    }
+
+@app.get("/api/profiles")
+def list_profiles(db: Session = Depends(get_db), user = Depends(get_current_user)):
+    counts = dict(db.query(Mapping.profile_id, func.count(Mapping.id)).group_by(Mapping.profile_id).all())
+    return [
+        {"id": p.id, "name": p.name, "active": bool(p.active), "mappings": counts.get(p.id, 0)}
+        for p in db.query(Profile).order_by(Profile.name).all()
+    ]
+
+@app.post("/api/profiles")
+def create_profile(profile: ProfileCreate, db: Session = Depends(get_db), user = Depends(get_current_user)):
+    if db.query(Profile).filter(Profile.name == profile.name).first():
+        raise HTTPException(status_code=400, detail=f"Profile name '{profile.name}' is already in use")
+    source = []
+    if profile.copy_from is not None:
+        if not db.query(Profile).filter(Profile.id == profile.copy_from).first():
+            raise HTTPException(status_code=404, detail=f"Profile with ID {profile.copy_from} not found")
+        source = db.query(Mapping).filter(Mapping.profile_id == profile.copy_from).all()
+
+    try:
+        p = Profile(name=profile.name, active=False)
+        db.add(p)
+        db.flush()
+        columns = [c.name for c in Mapping.__table__.columns if c.name not in ("id", "profile_id")]
+        db.add_all([Mapping(**{c: getattr(m, c) for c in columns}, profile_id=p.id) for m in source])
+        db.commit()
+        db.refresh(p)
+        return {"id": p.id, "name": p.name, "active": False, "mappings": len(source)}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error creating profile: {str(e)}")
+
+@app.post("/api/profiles/{profile_id}/activate")
+def activate_profile(profile_id: int, db: Session = Depends(get_db), user = Depends(get_current_user)):
+    """Make a profile drive the boards.
+
+    The new routing set is built off to the side and swapped in with one
+    assignment, so the control loop sees either the old or the new profile,
+    never a mix.
+    """
+    p = db.query(Profile).filter(Profile.id == profile_id).first()
+    if not p:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    db.query(Profile).filter(Profile.id != profile_id).update({Profile.active: False})
+    p.active = True
+    db.commit()
+
+    started = time.perf_counter()
+    routing_table.rebuild(db)
+    routes_changed()
+    return {
+        "message": f"Profile '{p.name}' is active",
+        "mappings": len(routing_table.routes),
+        "swap_ms": (time.perf_counter() - started) * 1000,
+    }
+
+@app.delete("/api/profiles/{profile_id}")
+def delete_profile(profile_id: int, db: Session = Depends(get_db), user = Depends(get_current_user)):
+    p = db.query(Profile).filter(Profile.id == profile_id).first()
+    if not p:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if p.active:
+        raise HTTPException(status_code=400, detail="Activate another profile before deleting this one")
+    db.query(Mapping).filter(Mapping.profile_id == profile_id).delete()
+    db.delete(p)
+    db.commit()
+    return {"message": "Profile deleted"}
+
 @app.post("/api/test-pin")
-def test_pin(data: dict, db: Session = Depends(get_db), user = Depends(get_current_user)):
+def test_pin(data: dict, user = Depends(get_current_user)):
     arduino_id = data.get("arduino_id")
     pin = data.get("pin")
 
     if not arduino_id or not pin:
         raise HTTPException(status_code=400, detail="Missing arduino_id or pin")
 
-    ar = db.query(Arduino).filter(Arduino.id == arduino_id).first()
-    if not ar:
+    name = routing_table.board_name(arduino_id)
+    if name is None:
         raise HTTPException(status_code=404, detail="Arduino not found")
 
-    success = arduino_manager.send(ar.name, f"TEST:{pin}")
+    success = arduino_manager.send(name, f"TEST:{pin}")
     if not success:
-        raise HTTPException(status_code=500, detail=f"Failed to send command to Arduino '{ar.name}'")
+        raise HTTPException(status_code=500, detail=f"Failed to send command to Arduino '{name}'")
 
-    return {"status": "sent", "arduino": ar.name, "pin": pin}
+    return {"status": "sent", "arduino": name, "pin": pin}
 
 @app.post("/api/pwm")
-def send_pwm(cmd: PWMCommand, db: Session = Depends(get_db), user = Depends(get_current_user)):
+def send_pwm(cmd: PWMCommand, user = Depends(get_current_user)):
     """Send PWM value (0-255) to a pin"""
-    ar = db.query(Arduino).filter(Arduino.id == cmd.arduino_id).first()
-    if not ar:
+    name = routing_table.board_name(cmd.arduino_id)
+    if name is None:
         raise HTTPException(status_code=404, detail="Arduino not found")
 
     # Clamp value
     value = max(0, min(255, cmd.value))
-    success = arduino_manager.send(ar.name, f"PWM:{cmd.pin}:{value}")
-
-    if not success:
-        raise HTTPException(status_code=500, detail=f"Failed to send PWM command to Arduino '{ar.name}'")
+    command = f"PWM:{cmd.pin}:{value}"
+    if not control_loop.command(name, command):
+        raise HTTPException(status_code=500, detail=f"Failed to send PWM command to Arduino '{name}'")
 
-    return {"status": "sent", "arduino": ar.name, "pin": cmd.pin, "value": value}
+    return {"status": "sent", "arduino": name, "pin": cmd.pin, "value": value}
 
 @app.post("/api/stepper")
-def control_stepper(cmd: StepperCommand, db: Session = Depends(get_db), user = Depends(get_current_user)):
+def control_stepper(cmd: StepperCommand, user = Depends(get_current_user)):
     """Control stepper motor"""
-    ar = db.query(Arduino).filter(Arduino.id == cmd.arduino_id).first()
-    if not ar:
+    name = routing_table.board_name(cmd.arduino_id)
+    if name is None:
         raise HTTPException(status_code=404, detail="Arduino not found")
 
     # Validate pins list
     if not cmd.pins or len(cmd.pins) < 2:
         raise HTTPException(status_code=400, detail="At least 2 pins required for stepper motor")
 
+    if stepper_tracker.queue_depth(name, cmd.pins[0]) >= STEPPER_QUEUE_SIZE:
+        raise HTTPException(status_code=409, detail="Stepper motion queue is full")
+
     pins_str = ",".join(cmd.pins)
-    success = arduino_manager.send(ar.name, f"STEPPER:{pins_str}:{cmd.steps}:{cmd.speed}")
+    command = f"STEPPER:{pins_str}:{cmd.steps}:{cmd.speed}"
+    if cmd.accel:
+        command += f":{cmd.accel}"
+    success = arduino_manager.send(name, command)
 
     if not success:
-        raise HTTPException(status_code=500, detail=f"Failed to send stepper command to Arduino '{ar.name}'")
+        raise HTTPException(status_code=500, detail=f"Failed to send stepper command to Arduino '{name}'")
+
+    state = stepper_tracker.enqueue(name, cmd.pins[0], cmd.steps, cmd.speed)
+    return {"status": "queued", "arduino": name, "pins": cmd.pins, "steps": cmd.steps, "speed": cmd.speed, **state}
+
+@app.get("/api/stepper/{arduino_id}")
+def stepper_status(arduino_id: int, user = Depends(get_current_user)):
+    """Estimated position and queue depth of each stepper on an Arduino"""
+    name = routing_table.board_name(arduino_id)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Arduino not found")
+    return stepper_tracker.state(name)
+
+@app.post("/api/stepper/stop")
+def stop_stepper(cmd: StepperStop, user = Depends(get_current_user)):
+    """Stop a stepper and clear its motion queue"""
+    name = routing_table.board_name(cmd.arduino_id)
+    if name is None:
+        raise HTTPException(status_code=404, detail="Arduino not found")
+    if not arduino_manager.send(name, f"STEPPER_STOP:{cmd.pin}"):
+        raise HTTPException(status_code=500, detail=f"Failed to send stop command to Arduino '{name}'")
+    stepper_tracker.stop(name, cmd.pin)
+    return {"status": "stopped", "arduino": name, "pin": cmd.pin}
+
+@app.get("/api/recordings")
+def list_recordings(user = Depends(get_current_user)):
+    """Finished recordings, and the one in progress if any"""
+    return {"active": command_recorder.status(), "recordings": command_recorder.recordings()}
+
+@app.post("/api/recordings")
+def start_recording(body: RecordingStart, user = Depends(get_current_user)):
+    """Start logging every command sent to the boards"""
+    status = command_recorder.start(body.name)
+    if status is None:
+        raise HTTPException(status_code=409, detail="A recording is already running")
+    return status
 
-    return {"status": "sent", "arduino": ar.name, "pins": cmd.pins, "steps": cmd.steps, "speed": cmd.speed}
+@app.post("/api/recordings/stop")
+def stop_recording(user = Depends(get_current_user)):
+    meta = command_recorder.stop()
+    if meta is None:
+        raise HTTPException(status_code=409, detail="No recording is running")
+    return meta
+
+@app.delete("/api/recordings/{recording_id}")
+def delete_recording(recording_id: str, user = Depends(get_current_user)):
+    try:
+        command_recorder.delete(recording_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": "Recording deleted"}
+
+@app.post("/api/recordings/{recording_id}/replay")
+def replay_recording(recording_id: str, body: ReplayRequest, user = Depends(get_current_user)):
+    """Play a recording back to the boards, or to one serial port"""
+    if body.speed <= 0 or body.repeat < 1:
+        raise HTTPException(status_code=400, detail="speed must be > 0 and repeat >= 1")
+    try:
+        return replayer.start(recording_id, body.speed, body.port, body.boards, body.repeat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/replays")
+def list_replays(user = Depends(get_current_user)):
+    return replayer.recent()
+
+@app.get("/api/replays/{job_id}")
+def get_replay(job_id: str, user = Depends(get_current_user)):
+    job = replayer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Replay not found")
+    return job
+
+@app.post("/api/replays/{job_id}/stop")
+def stop_replay(job_id: str, user = Depends(get_current_user)):
+    job = replayer.stop(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Replay not found")
+    return job
+
+@app.websocket("/ws/input")
+async def stream_input(websocket: WebSocket, token: str = ""):
+    """Stream raw controller events and route them through the mappings.
+
+    Authenticate with ``/ws/input?token=<jwt>``, then send either a single
+    event ``{"input": "LX", "value": -0.4}`` or a batch
+    ``{"events": [{"input": "A", "value": 1}, ...]}``. Values go through each
+    mapping's input shaping; unchanged outputs are not sent again.
+    """
+    if await run_in_threadpool(user_from_token, token) is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                await websocket.send_json({"error": "Message is not valid JSON"})
+                continue
+            events = message.get("events", [message]) if isinstance(message, dict) else message
+            if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+                await websocket.send_json({"error": "Expected an event object or {\"events\": [...]}"})
+                continue
+
+            # Latest value per input; the whole batch is shaped in one pass
+            routes = routing_table.routes
+            latest = {}
+            for event in events:
+                controller_input = event.get("input")
+                if not isinstance(controller_input, str):
+                    await websocket.send_json({"error": "Event 'input' must be a string"})
+                    continue
+                if controller_input not in routes:
+                    continue
+                try:
+                    value = float(event.get("value", 0))
+                    if not np.isfinite(value):
+                        raise ValueError(value)
+                    latest[controller_input] = value
+                except (TypeError, ValueError):
+                    await websocket.send_json({"error": f"Invalid value for '{controller_input}'"})
+            if not latest:
+                continue
+
+            # The control loop picks values up on its next tick. Without it, they are routed
+            # now, which may wait for the shaping flusher; in a worker the loop is in the owner
+            # process. Keep either off the event loop
+            if owner_client is not None or not control_loop.running:
+                failed = await run_in_threadpool(control_loop.feed, latest)
+            else:
+                failed = control_loop.feed(latest)
+            for board in failed:
+                await websocket.send_json({"error": f"Failed to send to Arduino '{board}'"})
+    except WebSocketDisconnect:
+        pass
+
+@app.websocket("/ws/node")
+async def node_link(websocket: WebSocket, node: str = "", token: str = ""):
+    """Persistent link from an agent node (``python app.py --agent ...``).
+
+    The node authenticates with ``NODE_TOKEN`` and announces its ports;
+    boards registered with its name are then opened through it and their
+    commands are sent as batched binary messages.
+    """
+    if (not NODE_TOKEN or not remote_node(node)
+            or not hmac.compare_digest(token.encode(), NODE_TOKEN.encode())):
+        await websocket.close(code=1008)
+        return
+    if owner_client is not None:
+        # Remote boards are opened by the process that owns the connections
+        logger.warning(f"⚠️  Node '{node}' refused: agent nodes need a single-worker server")
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+
+    session = NodeSession(node, websocket, asyncio.get_running_loop())
+    replaced = node_hub.attach(session)
+    if replaced is not None:
+        try:
+            await replaced.websocket.close(code=1012)
+        except Exception:
+            pass
+    sender = asyncio.create_task(session.pump_out())
+    logger.info(f"🔗 Node '{node}' connected", extra={"node": node})
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                session.uplink(message["bytes"])
+            elif message.get("text") is not None:
+                message = json.loads(message["text"])
+                session.handle(message)
+                if message.get("type") == "hello":
+                    arduino_manager.node_available(node)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        node_hub.detach(session)
+        logger.warning(f"⚠️  Node '{node}' disconnected", extra={"node": node})
 
 @app.post("/api/upload-firmware")
 async def upload_firmware(
     file: UploadFile = File(...),
-    port: str = None,
-    board_type: str = "arduino:avr:uno",
+    port: str = Form(None),
+    board_type: str = Form("arduino:avr:uno"),
     user = Depends(get_current_user)
 ):
-    """Upload .ino or .hex file to Arduino"""
-    if not port:
+    """Queue an .ino or .hex upload to one or more ports (comma-separated)"""
+    ports = [p.strip() for p in (port or "").split(",") if p.strip()]
+    if not ports:
         raise HTTPException(status_code=400, detail="Port required")
-    
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-        content = await file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
-    
-    try:
-        if file.filename.endswith('.ino'):
-            result = arduino_manager.compile_and_upload(port, tmp_path, board_type)
-        elif file.filename.endswith('.hex'):
-            result = arduino_manager.upload_firmware(port, tmp_path, board_type)
-        else:
-            result = {"success": False, "message": "Only .ino or .hex files supported"}
-        
-        return result
-    finally:
-        os.unlink(tmp_path)
+    if not file.filename.endswith(('.ino', '.hex')):
+        return {"success": False, "message": "Only .ino or .hex files supported"}
+
+    content = await file.read()
+    jobs = await run_in_threadpool(firmware_jobs.submit, file.filename, content, ports, board_type)
+    return {"success": True, "message": f"Queued {len(jobs)} firmware job(s)", "jobs": jobs}
+
+@app.get("/api/firmware/jobs")
+def list_firmware_jobs(user = Depends(get_current_user)):
+    return firmware_jobs.recent()
+
+@app.get("/api/firmware/jobs/{job_id}")
+def get_firmware_job(job_id: str, user = Depends(get_current_user)):
+    job = firmware_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Firmware job not found")
+    return job
 
 @app.get("/api/firmware/bluelink.ino")
 def download_firmware():
@@ -558,8 +4317,26 @@ def serve_frontend():
 # RUN SERVER
 # ============================================================================
 if __name__ == "__main__":
-    import uvicorn
-    print("🚀 Starting BlueLink Server...")
-    print("📍 Dashboard: http://localhost:8000")
-    print("📚 API Docs: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="BlueLink server")
+    parser.add_argument("--agent", metavar="URL",
+                        help="run as an agent node of the primary at URL, e.g. ws://primary:8000/ws/node")
+    parser.add_argument("--node", default=socket.gethostname(), help="this agent's node name (default: hostname)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="HTTP worker processes; the serial ports stay in this one (default: 1)")
+    args = parser.parse_args()
+
+    if args.agent:
+        print(f"🔗 Starting BlueLink agent '{args.node}' for {args.agent}...")
+        NodeAgent(args.agent, args.node, NODE_TOKEN).run()
+    else:
+        import uvicorn
+        print("🚀 Starting BlueLink Server...")
+        print("📍 Dashboard: http://localhost:8000")
+        print("📚 API Docs: http://localhost:8000/docs")
+        if args.workers > 1:
+            serve_owner()
+            uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=args.workers,
+                        app_dir=os.path.dirname(os.path.abspath(__file__)))
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
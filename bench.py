@@ -0,0 +1,332 @@
+"""
+BlueLink - Benchmark
+Runs the server against simulated Arduinos (see fakeboard.py) and reports
+throughput and latency for the hot paths. No hardware needed.
+
+Usage:
+    python bench.py                          # all scenarios, 5 s each
+    python bench.py -s pwm -s ws -d 10 -c 8  # selected scenarios
+    python bench.py --json results.json      # also save raw numbers
+
+Scenarios:
+    login      POST /login (bcrypt bound)
+    pwm        POST /api/pwm
+    stepper    POST /api/stepper
+    mappings   POST + DELETE /api/mappings
+    actuation  POST /api/pwm, timed until the value reaches the board
+    ws         /ws/input events, timed until the value reaches the board
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Configure the app before importing it
+_workdir = tempfile.mkdtemp(prefix="bluelink-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+os.environ.setdefault("SECRET_KEY", "bluelink-benchmark-secret-key")
+
+import warnings
+warnings.simplefilter("ignore", UserWarning)
+
+import uvicorn
+import app as bluelink
+from fakeboard import FakeBoard
+
+HISTOGRAM_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+# ============================================================================
+# RESULTS
+# ============================================================================
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        samples = sorted(self.latencies)
+        def pct(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else None
+        return {
+            "scenario": self.name,
+            "count": len(samples),
+            "errors": self.errors,
+            "throughput": len(samples) / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": pct(0.50),
+            "p90_ms": pct(0.90),
+            "p99_ms": pct(0.99),
+            "max_ms": samples[-1] if samples else None,
+            "histogram": histogram(samples),
+        }
+
+def histogram(samples):
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for sample in samples:
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if sample <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
+
+def print_summary(summary):
+    def fmt(value):
+        return f"{value:8.3f}" if value is not None else "       -"
+    print(f"\n▶ {summary['scenario']}")
+    print(f"  {summary['count']} ok, {summary['errors']} errors, {summary['throughput']:.1f}/s")
+    print(f"  latency ms  p50 {fmt(summary['p50_ms'])}  p90 {fmt(summary['p90_ms'])}"
+          f"  p99 {fmt(summary['p99_ms'])}  max {fmt(summary['max_ms'])}")
+    total = max(1, sum(summary["histogram"]))
+    labels = [f"≤{b}" for b in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}"]
+    for label, count in zip(labels, summary["histogram"]):
+        if count:
+            print(f"  {label:>7} ms {count:8d} {'█' * max(1, int(40 * count / total))}")
+
+# ============================================================================
+# HTTP CLIENT
+# ============================================================================
+class Client:
+    """Keep-alive JSON client for one worker thread"""
+    def __init__(self, port, token=None):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port)
+        self.token = token
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        self.conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+
+def run_load(name, port, token, duration, concurrency, make_request):
+    """Call make_request(client, worker, i) from several threads for a fixed time"""
+    result = Result(name)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        client = Client(port, token)
+        latencies, errors, i = [], 0, 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = make_request(client, index, i)
+            except (OSError, http.client.HTTPException):
+                client = Client(port, token)
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+            i += 1
+        with lock:
+            result.latencies.extend(latencies)
+            result.errors += errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+# ============================================================================
+# SCENARIOS
+# ============================================================================
+def wait_for(board, command):
+    """Watch for command on a board; returns (arrived event, {"at": time}, stop watching)"""
+    arrived = threading.Event()
+    seen = {}
+
+    def listener(now, received):
+        if received == command and not arrived.is_set():
+            seen["at"] = now
+            arrived.set()
+
+    board.listeners.append(listener)
+    return arrived, seen, lambda: board.listeners.remove(listener)
+
+def scenario_login(ctx):
+    body = {"username": "admin", "password": "admin123"}
+    return run_load("login", ctx.port, None, ctx.duration, ctx.concurrency,
+                    lambda client, w, i: client.request("POST", "/login", body)[0] == 200)
+
+def scenario_pwm(ctx):
+    def request(client, worker, i):
+        body = {"arduino_id": ctx.arduino_ids[worker % len(ctx.arduino_ids)], "pin": "9", "value": i % 256}
+        return client.request("POST", "/api/pwm", body)[0] == 200
+    return run_load("pwm", ctx.port, ctx.token, ctx.duration, ctx.concurrency, request)
+
+def scenario_stepper(ctx):
+    def request(client, worker, i):
+        body = {"arduino_id": ctx.arduino_ids[worker % len(ctx.arduino_ids)],
+                "pins": ["4", "7", "8", "12"], "steps": 1, "speed": 600}
+        # 409 (queue full) is backpressure, not a failure of the endpoint
+        return client.request("POST", "/api/stepper", body)[0] in (200, 409)
+    return run_load("stepper", ctx.port, ctx.token, ctx.duration, ctx.concurrency, request)
+
+def scenario_mappings(ctx):
+    def request(client, worker, i):
+        body = {"controller_input": f"bench-{worker}-{i}", "arduino_id": ctx.arduino_ids[0], "arduino_pin": "13"}
+        status, created = client.request("POST", "/api/mappings", body)
+        if status != 200:
+            return False
+        return client.request("DELETE", f"/api/mappings/{created['id']}")[0] == 200
+    return run_load("mappings", ctx.port, ctx.token, ctx.duration, ctx.concurrency, request)
+
+def scenario_actuation(ctx):
+    """Sequential PWM requests, each timed until the board receives the value"""
+    result = Result("actuation")
+    client = Client(ctx.port, ctx.token)
+    board = ctx.boards[0]
+    deadline = time.perf_counter() + ctx.duration
+    started_all = time.perf_counter()
+    i = 0
+    while time.perf_counter() < deadline:
+        value = i % 256
+        i += 1
+        arrived, seen, done = wait_for(board, f"PWM:9:{value}")
+        started = time.perf_counter()
+        status, _ = client.request("POST", "/api/pwm", {"arduino_id": ctx.arduino_ids[0], "pin": "9", "value": value})
+        if status == 200 and arrived.wait(2.0):
+            result.latencies.append((seen["at"] - started) * 1000)
+        else:
+            result.errors += 1
+        done()
+    result.elapsed = time.perf_counter() - started_all
+    return result
+
+def scenario_ws(ctx):
+    """Stream /ws/input events, each timed until the board receives the value"""
+    result = Result("ws")
+    try:
+        from websockets.sync.client import connect
+    except ImportError:
+        print("⚠️  websockets is not installed, skipping ws scenario")
+        result.errors = 1
+        return result
+
+    board = ctx.boards[0]
+    with connect(f"ws://127.0.0.1:{ctx.port}/ws/input?token={ctx.token}") as ws:
+        deadline = time.perf_counter() + ctx.duration
+        started_all = time.perf_counter()
+        i = 0
+        while time.perf_counter() < deadline:
+            # A full 0..1 trigger sweep in 255 distinct PWM steps
+            value = (i % 255 + 1) / 255
+            expected = f"PWM:9:{round(255 * value)}"
+            i += 1
+            arrived, seen, done = wait_for(board, expected)
+            started = time.perf_counter()
+            ws.send(json.dumps({"input": "bench-trigger", "value": value}))
+            if arrived.wait(2.0):
+                result.latencies.append((seen["at"] - started) * 1000)
+            else:
+                result.errors += 1
+            done()
+        result.elapsed = time.perf_counter() - started_all
+    return result
+
+SCENARIOS = {
+    "login": scenario_login,
+    "pwm": scenario_pwm,
+    "stepper": scenario_stepper,
+    "mappings": scenario_mappings,
+    "actuation": scenario_actuation,
+    "ws": scenario_ws,
+}
+
+# ============================================================================
+# SETUP
+# ============================================================================
+class Context:
+    pass
+
+def start_server(port):
+    config = uvicorn.Config(bluelink.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BlueLink against simulated Arduinos")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="client threads")
+    parser.add_argument("-b", "--boards", type=int, default=2, help="simulated Arduinos")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="HTTP port for the test server")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    ctx = Context()
+    ctx.port, ctx.duration, ctx.concurrency = args.port, args.duration, args.concurrency
+    ctx.boards = [FakeBoard() for _ in range(args.boards)]
+    server, thread = start_server(args.port)
+
+    client = Client(args.port)
+    status, body = client.request("POST", "/login", {"username": "admin", "password": "admin123"})
+    if status != 200:
+        sys.exit(f"❌ Login failed: {body}")
+    ctx.token = client.token = body["access_token"]
+
+    ctx.arduino_ids = []
+    for i, board in enumerate(ctx.boards):
+        status, body = client.request("POST", "/api/arduinos", {"name": f"bench-{i}", "serial_port": board.port})
+        if status != 200:
+            sys.exit(f"❌ Could not add simulated board: {body}")
+        ctx.arduino_ids.append(body["id"])
+    client.request("POST", "/api/mappings", {
+        "controller_input": "bench-trigger", "input_type": "pwm", "arduino_id": ctx.arduino_ids[0],
+        "arduino_pin": "9", "pin_mode": "pwm",
+    })
+
+    print(f"🏁 BlueLink benchmark: {args.boards} simulated boards, {args.concurrency} clients, {args.duration:.0f}s per scenario")
+    summaries = []
+    for name in args.scenario or list(SCENARIOS):
+        summary = SCENARIOS[name](ctx).summary()
+        print_summary(summary)
+        summaries.append(summary)
+
+    # The setup connection has idled past keep-alive by now
+    client = Client(args.port, ctx.token)
+    status, stats = client.request("GET", "/api/arduinos/stats")
+    if status == 200:
+        print("\n▶ serial writers")
+        for name, board_stats in stats.items():
+            print(f"  {name}: {board_stats.get('queued', 0)} queued, {board_stats.get('coalesced', 0)} coalesced, "
+                  f"{board_stats.get('dropped', 0)} dropped, {board_stats.get('writes', 0)} writes")
+
+    status, loop = client.request("GET", "/api/control-loop")
+    if status == 200 and loop["running"]:
+        print(f"\n▶ control loop @ {loop['hz']:g} Hz")
+        print(f"  {loop['ticks']} ticks, {loop['overruns']} overruns ({loop['skipped']} skipped), "
+              f"jitter p50 {loop['jitter_p50_ms']:.3f} ms p99 {loop['jitter_p99_ms']:.3f} ms max {loop['jitter_max_ms']:.3f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenarios": summaries, "serial": stats, "control_loop": loop}, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+    server.should_exit = True
+    thread.join(timeout=5)
+    for board in ctx.boards:
+        board.close()
+
+if __name__ == "__main__":
+    main()
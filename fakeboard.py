@@ -0,0 +1,234 @@
+"""
+BlueLink - Simulated Arduino
+Speaks the BlueLink.ino serial protocol on a pseudo-terminal so the server
+can be run and benchmarked without hardware.
+
+Usage:
+    python fakeboard.py [count]
+
+Prints the port of each simulated board; add it in the dashboard like a
+real one. Linux/macOS only (needs a pty).
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+import tty
+
+FRAME_START = 0xB1
+FRAME_PWM_FLAG = 0x80
+FRAME_MAX_PAIRS = 24
+SAMPLE_MAX_HZ = 1000
+PWM_PINS = {3, 5, 6, 9, 10, 11}
+TELEMETRY_START = 0xB2
+TELEMETRY_ANALOG_FLAG = 0x80
+TELEMETRY_KEYFRAME = 1.0  # seconds between frames that carry every input
+
+class FakeBoard:
+    """A pty-backed board that applies commands and answers like the firmware.
+
+    Every command that arrives is recorded with its arrival time
+    (``time.perf_counter()``) so callers can measure end-to-end latency.
+    Sampled inputs read from ``inputs`` (e.g. ``board.inputs["A0"] = 512``);
+    inputs not set there follow a slow sine wave (analog) or toggle once a
+    second (digital).
+    """
+    def __init__(self, record_limit=100000):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.pins = {}
+        self.positions = {}
+        self.received = []  # (arrival time, command)
+        self.record_limit = record_limit
+        self.listeners = []
+        self.inputs = {}
+        self.sampling = None  # (pins, interval, deadband) while streaming
+        self.write_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"fakeboard-{self.port}", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _write(self, data):
+        with self.write_lock:
+            os.write(self.master, data)
+
+    def _reply(self, message):
+        self._write(f"STATUS:{message}\r\n".encode())
+
+    def _read_input(self, pin, now):
+        if pin in self.inputs:
+            return self.inputs[pin]
+        if pin.startswith("A"):
+            return int(512 + 400 * math.sin(now + int(pin[1:])))
+        return int(now) % 2
+
+    def _start_sampling(self, pins, hz, deadband):
+        for pin in pins:
+            if pin.startswith("A"):
+                if not pin[1:].isdigit() or int(pin[1:]) > 5:
+                    return False
+            elif not pin.isdigit() or not 2 <= int(pin) <= 13:
+                return False
+        self.sampling = (pins, 1.0 / max(1, min(SAMPLE_MAX_HZ, hz)), deadband)
+        threading.Thread(target=self._sample, args=(self.sampling,), daemon=True).start()
+        return True
+
+    def _sample(self, config):
+        pins, interval, deadband = config
+        sent = {}
+        last_keyframe = 0.0
+        next_sample = time.perf_counter()
+        while self.running and self.sampling is config:
+            now = time.perf_counter()
+            keyframe = now - last_keyframe >= TELEMETRY_KEYFRAME
+            if keyframe:
+                last_keyframe = now
+            body = bytearray()
+            for pin in pins:
+                value = self._read_input(pin, now)
+                band = deadband if pin.startswith("A") else 0
+                if not keyframe and pin in sent and abs(value - sent[pin]) <= band:
+                    continue
+                sent[pin] = value
+                code = TELEMETRY_ANALOG_FLAG | int(pin[1:]) if pin.startswith("A") else int(pin)
+                body += bytes((code, value >> 8, value & 0xFF))
+            if body:
+                tick = int(now * 1000) & 0xFFFF
+                body = bytes((len(body) // 3, tick >> 8, tick & 0xFF)) + body
+                checksum = 0
+                for b in body:
+                    checksum ^= b
+                try:
+                    self._write(bytes([TELEMETRY_START]) + body + bytes([checksum]))
+                except OSError:
+                    return
+            next_sample += interval
+            time.sleep(max(0.0, next_sample - time.perf_counter()))
+
+    def _record(self, command):
+        now = time.perf_counter()
+        if len(self.received) < self.record_limit:
+            self.received.append((now, command))
+        for listener in list(self.listeners):
+            listener(now, command)
+
+    def _apply_line(self, line):
+        kind, _, rest = line.partition(":")
+        args = rest.split(":")
+        if kind in ("SET", "PWM") and len(args) == 2:
+            self.pins[args[0]] = int(args[1])
+            self._reply(f"{kind} PIN {args[0]} TO {args[1]}")
+        elif kind == "TEST":
+            self._reply(f"TESTED PIN {rest}")
+        elif kind == "STEPPER" and len(args) >= 3:
+            pin = args[0].split(",")[0]
+            self.positions[pin] = self.positions.get(pin, 0) + int(args[1])
+            self._reply(f"STEPPER {pin} QUEUED POS {self.positions[pin]} QUEUE 1")
+            # Moves complete instantly on a simulated board
+            self._reply(f"STEPPER {pin} DONE POS {self.positions[pin]} QUEUE 0")
+        elif kind == "STEPPER_STOP":
+            self._reply(f"STEPPER {rest} STOPPED POS {self.positions.get(rest, 0)} QUEUE 0")
+        elif line == "STEPPERS":
+            for pin, position in self.positions.items():
+                self._reply(f"STEPPER {pin} IDLE POS {position} QUEUE 0")
+        elif line == "SAMPLE:OFF":
+            self.sampling = None
+            self._reply("SAMPLE OFF")
+        elif kind == "SAMPLE" and len(args) >= 2:
+            pins = [pin.strip() for pin in args[0].split(",") if pin.strip()]
+            hz = int(args[1]) if args[1].isdigit() else 0
+            deadband = int(args[2]) if len(args) > 2 and args[2].isdigit() else 0
+            self.sampling = None
+            if hz <= 0 or not self._start_sampling(pins, hz, deadband):
+                self._reply(f"ERROR: Bad sample config {rest}")
+                return
+            self._reply(f"SAMPLE {len(pins)} PINS AT {min(SAMPLE_MAX_HZ, hz)} HZ")
+        elif line == "INFO":
+            self._reply("DIGITAL_PINS:2-13")
+            self._reply("PWM_PINS:3,5,6,9,10,11")
+            self._reply("ANALOG_PINS:A0-A5")
+            self._reply(f"FRAME_MAX_PAIRS:{FRAME_MAX_PAIRS}")
+            self._reply(f"SAMPLE_MAX_HZ:{SAMPLE_MAX_HZ}")
+            sampling = self.sampling
+            self._reply(f"SAMPLING:{len(sampling[0]) if sampling else 0} PINS")
+        else:
+            self._reply(f"UNKNOWN COMMAND: {line}")
+            return
+        self._record(line)
+
+    def _apply_frame(self, body):
+        count = body[0]
+        checksum = 0
+        for b in body[:-1]:
+            checksum ^= b
+        if checksum != body[-1]:
+            self._reply("ERROR: Bad frame checksum")
+            return
+        for i in range(count):
+            pin, value = body[1 + i * 2], body[2 + i * 2]
+            if pin & FRAME_PWM_FLAG:
+                pin &= ~FRAME_PWM_FLAG
+                command = f"PWM:{pin}:{value}"
+                if pin not in PWM_PINS:
+                    self._reply(f"ERROR: Pin {pin} does not support PWM")
+            else:
+                command = f"SET:{pin}:{value}"
+            self.pins[str(pin)] = value
+            self._record(command)
+        self._reply(f"FRAME {count}")
+
+    def _run(self):
+        buffer = bytearray()
+        while self.running:
+            try:
+                chunk = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+            while buffer:
+                if buffer[0] == FRAME_START:
+                    if len(buffer) < 2:
+                        break
+                    if buffer[1] > FRAME_MAX_PAIRS:
+                        self._reply("ERROR: Bad frame header")
+                        del buffer[:2]
+                        continue
+                    if len(buffer) < 3 + buffer[1] * 2:
+                        break
+                    length = 3 + buffer[1] * 2
+                    self._apply_frame(bytes(buffer[1:length]))
+                    del buffer[:length]
+                    continue
+                end = buffer.find(b"\n")
+                if end < 0:
+                    break
+                line = buffer[:end].decode(errors="replace").strip()
+                del buffer[:end + 1]
+                if line:
+                    self._apply_line(line)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    boards = [FakeBoard() for _ in range(count)]
+    for board in boards:
+        print(f"🤖 Simulated Arduino on {board.port}")
+    print("Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for board in boards:
+            board.close()
@@ -0,0 +1,99 @@
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# app.py reads its configuration at import time
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bluelink-test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-" + "x" * 32)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+_board_ids = itertools.count(1)
+
+
+class FakeSerial:
+    """Stands in for a serial port: records writes, reads return nothing"""
+    in_waiting = 0
+
+    def __init__(self, port=None):
+        self.port = port
+        self.writes = []
+        self.written = threading.Event()
+        self.closed = False
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+        self.written.set()
+        return len(data)
+
+    def read(self, size):
+        time.sleep(0.01)
+        return b""
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_serial():
+    return FakeSerial()
+
+
+@pytest.fixture
+def make_mapping():
+    """Build a stand-in for a Mapping row, for compiling Routes"""
+    def make(**fields):
+        defaults = dict(arduino_id=1, arduino_pin="9", pin_mode="pwm", invert=False,
+                        input_type="analog", min_value=0, max_value=255, deadzone=0.0,
+                        curve=None, smoothing=0.0, change_threshold=0, max_rate_hz=0.0,
+                        stepper_pin2=None, stepper_pin3=None, stepper_pin4=None,
+                        stepper_steps=200, stepper_speed=10)
+        defaults.update(fields)
+        return SimpleNamespace(**defaults)
+    return make
+
+
+@pytest.fixture
+def wait_for():
+    """Poll a condition that a background thread makes true"""
+    def wait(condition, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return condition()
+    return wait
+
+
+@pytest.fixture(scope="session")
+def client():
+    """API client logged in as the default admin, with the server started"""
+    with TestClient(app.app) as client:
+        response = client.post("/login", json={"username": "admin", "password": "admin123"})
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        yield client
+
+
+@pytest.fixture
+def fake_ports(monkeypatch):
+    """Open every local serial port as a FakeSerial"""
+    monkeypatch.setattr(app.serial, "Serial", lambda port, baudrate, timeout: FakeSerial(port))
+
+
+@pytest.fixture
+def board(client, fake_ports):
+    """A board registered through the API, connected to a FakeSerial"""
+    name = f"board-{next(_board_ids)}"
+    response = client.post("/api/arduinos", json={"name": name, "serial_port": f"/dev/fake-{name}"})
+    assert response.status_code == 200, response.text
+    ar = response.json()
+    ar["serial"] = app.arduino_manager.connections[name]
+    yield ar
+    client.delete(f"/api/arduinos/{ar['id']}")
@@ -0,0 +1,107 @@
+"""Tests for the token cache and the login rate limit"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def user():
+    db = app.SessionLocal()
+    try:
+        db.add(app.User(username="alice", password_hash="unused"))
+        db.commit()
+    finally:
+        db.close()
+    yield "alice"
+    db = app.SessionLocal()
+    try:
+        db.query(app.User).filter(app.User.username == "alice").delete()
+        db.commit()
+    finally:
+        db.close()
+    app.token_cache.clear()
+
+
+def update_user(username, **fields):
+    db = app.SessionLocal()
+    try:
+        user = db.query(app.User).filter(app.User.username == username).one()
+        for key, value in fields.items():
+            setattr(user, key, value)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = app.TokenCache(2)
+    far = 2 ** 40
+    users = {name: app.User(username=name) for name in "abc"}
+    cache.put("a", users["a"], far)
+    cache.put("b", users["b"], far)
+    assert cache.get("a") is users["a"]
+    cache.put("c", users["c"], far)
+    assert cache.get("b") is None
+    assert cache.get("a") is users["a"] and cache.get("c") is users["c"]
+
+
+def test_token_cache_drops_expired_tokens():
+    cache = app.TokenCache(2)
+    cache.put("a", app.User(username="a"), 1)
+    assert cache.get("a") is None
+
+
+def test_updated_user_is_dropped_from_the_cache(user):
+    token = app.create_access_token({"sub": user})
+    assert app.user_from_token(token).password_hash == "unused"
+    assert app.token_cache.get(token) is not None
+    update_user(user, password_hash="changed")
+    assert app.token_cache.get(token) is None
+    assert app.user_from_token(token).password_hash == "changed"
+
+
+def test_deleted_user_loses_access(user):
+    token = app.create_access_token({"sub": user})
+    assert app.user_from_token(token) is not None
+    db = app.SessionLocal()
+    try:
+        db.delete(db.query(app.User).filter(app.User.username == user).one())
+        db.commit()
+    finally:
+        db.close()
+    assert app.user_from_token(token) is None
+
+
+def test_owner_tells_workers_about_changed_users(user, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app, "owner_server", type("Server", (), {"broadcast": lambda self, m: sent.append(m)})())
+    update_user(user, password_hash="changed")
+    assert sent == [["users", [user]]]
+
+
+def test_login_limiter_locks_one_client_out():
+    limiter = app.LoginLimiter(max_attempts=3, window=60)
+    for _ in range(3):
+        assert limiter.retry_after("admin", "10.0.0.9") == 0
+        limiter.failed("admin", "10.0.0.9")
+    assert 0 < limiter.retry_after("admin", "10.0.0.9") <= 60
+    assert limiter.retry_after("admin", "10.0.0.1") == 0
+    limiter.succeeded("admin", "10.0.0.9")
+    assert limiter.retry_after("admin", "10.0.0.9") == 0
+
+
+def test_failures_from_elsewhere_do_not_lock_the_user_out(client):
+    for _ in range(app.LOGIN_MAX_ATTEMPTS + 1):
+        app.login_limiter.failed("admin", "203.0.113.7")
+    response = client.post("/login", json={"username": "admin", "password": "admin123"})
+    assert response.status_code == 200
+
+
+def test_repeated_failures_get_429_with_retry_after(client):
+    for _ in range(app.LOGIN_MAX_ATTEMPTS):
+        response = client.post("/login", json={"username": "nobody", "password": "guess"})
+        assert response.status_code == 400
+    response = client.post("/login", json={"username": "nobody", "password": "guess"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
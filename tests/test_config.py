@@ -0,0 +1,89 @@
+"""Tests for bulk configuration import and export"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def imported_boards(client, fake_ports):
+    """Remove the cfg-* boards a test imported"""
+    yield
+    for ar in client.get("/api/arduinos").json():
+        if ar["name"].startswith("cfg-"):
+            client.delete(f"/api/arduinos/{ar['id']}")
+
+
+def boards(client):
+    return {ar["name"]: ar["serial_port"] for ar in client.get("/api/arduinos").json()
+            if ar["name"].startswith("cfg-")}
+
+
+def import_config(client, **config):
+    return client.post("/api/config/import", json=config)
+
+
+def test_import_then_export_round_trips(client, imported_boards):
+    response = import_config(client, profile="cfg-profile", arduinos=[
+        {"name": "cfg-a", "serial_port": "/dev/fake-cfg-a"},
+    ], mappings=[
+        {"controller_input": "A", "arduino": "cfg-a", "arduino_pin": "13"},
+        {"controller_input": "LX", "input_type": "analog", "arduino": "cfg-a", "arduino_pin": "9",
+         "pin_mode": "pwm", "curve": "expo:0.3"},
+    ])
+    assert response.status_code == 200, response.text
+    assert response.json()["mappings"] == 2
+
+    profile = next(p for p in client.get("/api/profiles").json() if p["name"] == "cfg-profile")
+    exported = client.get(f"/api/config/export?profile_id={profile['id']}").json()
+    assert exported["profile"] == "cfg-profile"
+    assert {(m["controller_input"], m["arduino"], m["curve"]) for m in exported["mappings"]} == \
+        {("A", "cfg-a", None), ("LX", "cfg-a", "expo:0.3")}
+    client.delete(f"/api/profiles/{profile['id']}")
+
+
+def test_invalid_import_writes_nothing(client, imported_boards):
+    response = import_config(client, arduinos=[
+        {"name": "cfg-a", "serial_port": "/dev/fake-cfg-a"},
+        {"name": "cfg-a", "serial_port": "/dev/fake-cfg-b"},
+    ], mappings=[
+        {"controller_input": "A", "arduino": "cfg-missing", "arduino_pin": "13"},
+        {"controller_input": "B", "arduino": "cfg-a", "arduino_pin": "12", "curve": "wobbly"},
+    ])
+    assert response.status_code == 400
+    detail = response.json()["detail"]
+    assert "Arduino 'cfg-a' is listed twice" in detail
+    assert "Mapping 'A' refers to unknown Arduino 'cfg-missing'" in detail
+    assert any("invalid curve" in error for error in detail)
+    assert boards(client) == {}
+
+
+def test_failed_write_rolls_everything_back(client, imported_boards, monkeypatch):
+    def fail(self, instances):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(app.Session, "add_all", fail)
+    response = import_config(client, arduinos=[{"name": "cfg-a", "serial_port": "/dev/fake-cfg-a"}],
+                             mappings=[{"controller_input": "A", "arduino": "cfg-a", "arduino_pin": "13"}])
+    assert response.status_code == 500
+    assert boards(client) == {}
+
+
+def test_boards_can_swap_ports(client, imported_boards, wait_for):
+    arduinos = [{"name": "cfg-a", "serial_port": "/dev/fake-cfg-a"},
+                {"name": "cfg-b", "serial_port": "/dev/fake-cfg-b"}]
+    assert import_config(client, arduinos=arduinos).status_code == 200
+    arduinos[0]["serial_port"], arduinos[1]["serial_port"] = "/dev/fake-cfg-b", "/dev/fake-cfg-a"
+    response = import_config(client, arduinos=arduinos)
+    assert response.status_code == 200, response.text
+    assert boards(client) == {"cfg-a": "/dev/fake-cfg-b", "cfg-b": "/dev/fake-cfg-a"}
+    connections = app.arduino_manager.connections
+    assert wait_for(lambda: getattr(connections.get("cfg-a"), "port", None) == "/dev/fake-cfg-b"
+                    and getattr(connections.get("cfg-b"), "port", None) == "/dev/fake-cfg-a")
+
+
+def test_port_of_a_board_outside_the_import_is_rejected(client, imported_boards):
+    assert import_config(client, arduinos=[{"name": "cfg-a", "serial_port": "/dev/fake-cfg-a"}]).status_code == 200
+    response = import_config(client, arduinos=[{"name": "cfg-b", "serial_port": "/dev/fake-cfg-a"}])
+    assert response.status_code == 400
+    assert boards(client) == {"cfg-a": "/dev/fake-cfg-a"}
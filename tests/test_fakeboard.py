@@ -0,0 +1,57 @@
+"""Tests for the simulated board the benchmark runs against"""
+
+import os
+import select
+import sys
+
+import pytest
+
+import app
+
+if sys.platform == "win32":
+    pytest.skip("fakeboard.py needs a pty", allow_module_level=True)
+
+from fakeboard import FakeBoard  # noqa: E402
+
+
+@pytest.fixture
+def fakeboard():
+    board = FakeBoard()
+    yield board
+    board.close()
+
+
+def replies(board, count, timeout=1.0):
+    """The next ``count`` lines the board sends, without the STATUS: prefix"""
+    data = b""
+    while data.count(b"\n") < count and select.select([board.slave], [], [], timeout)[0]:
+        data += os.read(board.slave, 4096)
+    return [line.removeprefix("STATUS:") for line in data.decode().splitlines()][:count]
+
+
+def test_info_reports_the_frame_and_sampling_limits(fakeboard):
+    os.write(fakeboard.slave, b"INFO\n")
+    info = dict(line.split(":", 1) for line in replies(fakeboard, 6))
+    assert info["FRAME_MAX_PAIRS"] == "24"
+    assert info["SAMPLE_MAX_HZ"] == "1000"
+    assert info["SAMPLING"] == "0 PINS"
+
+
+def test_frames_are_applied_and_oversized_ones_rejected(fakeboard):
+    os.write(fakeboard.slave, bytes([app.FRAME_START, 25]) + app.encode_frames([(13, 1), (9 | app.FRAME_PWM_FLAG, 7)]))
+    assert replies(fakeboard, 2) == ["ERROR: Bad frame header", "FRAME 2"]
+    assert fakeboard.pins == {"13": 1, "9": 7}
+    assert [command for _, command in fakeboard.received] == ["SET:13:1", "PWM:9:7"]
+
+
+def test_server_negotiates_frames_with_the_fakeboard(fakeboard, wait_for):
+    name = "fakeboard-test"
+    assert app.arduino_manager.connect(name, fakeboard.port)
+    try:
+        writer = app.arduino_manager.writers[name]
+        assert wait_for(lambda: writer.frame_limit, timeout=2)
+        assert app.arduino_manager.send_batch(name, ["SET:13:1", "PWM:9:200"])
+        assert wait_for(lambda: fakeboard.pins == {"13": 1, "9": 200})
+        assert wait_for(lambda: app.arduino_manager.readers[name].stats["acked"] >= 1)
+    finally:
+        app.arduino_manager.forget(name)
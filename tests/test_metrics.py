@@ -0,0 +1,22 @@
+"""Tests for the Prometheus metrics endpoint and its instrumentation"""
+
+from sqlalchemy import text
+
+import app
+
+
+def test_db_metrics_count_queries_but_not_pragmas(client):
+    with app.engine.connect() as conn:
+        conn.execute(text("PRAGMA table_info(users)"))
+        conn.execute(text("SELECT 1"))
+    body = client.get("/metrics").text
+    assert 'bluelink_db_query_duration_seconds_count{operation="SELECT"}' in body
+    assert 'operation="PRAGMA"' not in body
+
+
+def test_commands_and_http_requests_are_counted(client, board, wait_for):
+    assert client.post("/api/pwm", json={"arduino_id": board["id"], "pin": "9", "value": 10}).status_code == 200
+    assert wait_for(lambda: b"PWM:9:10\n" in b"".join(board["serial"].writes))
+    body = client.get("/metrics").text
+    assert f'bluelink_commands_sent_total{{board="{board["name"]}",kind="PWM"}} 1' in body
+    assert 'bluelink_http_request_duration_seconds_count{method="POST",route="/api/pwm",status="200"}' in body
@@ -0,0 +1,73 @@
+"""Tests for StateMirror deltas"""
+
+import asyncio
+import json
+
+import app
+
+
+def record(mirror):
+    deltas = []
+    mirror.listeners.append(deltas.append)
+    return deltas
+
+
+def test_only_changes_are_published():
+    mirror = app.StateMirror()
+    deltas = record(mirror)
+    mirror._update({"pins": {"a": {"9": 1}, "b": {"13": 0}}})
+    mirror._update({"pins": {"a": {"9": 1}, "b": {"13": 0}}})
+    mirror._update({"pins": {"a": {"9": 2}}})
+    assert deltas == [
+        {"version": 1, "changes": {"pins": {"a": {"9": 1}, "b": {"13": 0}}}},
+        {"version": 2, "changes": {"pins": {"a": {"9": 2}, "b": None}}},
+    ]
+    assert mirror.snapshot() == {"version": 2, "state": {"boards": {}, "pins": {"a": {"9": 2}}, "ports": {}}}
+
+
+def test_sections_change_independently():
+    mirror = app.StateMirror()
+    deltas = record(mirror)
+    mirror._update({"boards": {"a": {"connected": True}}, "pins": {"a": {}}})
+    mirror._update({"boards": {"a": {"connected": False}}, "pins": {"a": {}}})
+    assert deltas[-1]["changes"] == {"boards": {"a": {"connected": False}}}
+
+
+def test_worker_follows_the_owner_deltas():
+    owner, worker = app.StateMirror(), app.StateMirror()
+    owner.listeners.append(worker.apply)
+    owner._update({"ports": {"/dev/ttyUSB0": {"device": "/dev/ttyUSB0"}}})
+    worker.load(owner.snapshot())
+    owner._update({"ports": {"/dev/ttyACM0": {"device": "/dev/ttyACM0"}}})
+    assert worker.snapshot() == owner.snapshot()
+    assert worker.ports() == [{"device": "/dev/ttyACM0"}]
+
+
+def test_slow_dashboard_skips_to_a_snapshot(monkeypatch):
+    monkeypatch.setattr(app, "STATE_MIRROR_QUEUE", 2)
+    mirror = app.StateMirror()
+
+    async def stream():
+        queue = mirror.subscribe(asyncio.get_running_loop())
+        for version in range(3):
+            mirror._update({"pins": {"a": {"9": version}}})
+        await asyncio.sleep(0)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    # The queued deltas are dropped; None makes the stream send a fresh snapshot
+    assert asyncio.run(stream()) == [None]
+
+
+def test_deltas_are_encoded_once_as_events():
+    mirror = app.StateMirror()
+
+    async def stream():
+        queues = [mirror.subscribe(asyncio.get_running_loop()) for _ in range(2)]
+        mirror._update({"pins": {"a": {"9": 1}}})
+        await asyncio.sleep(0)
+        return [queue.get_nowait() for queue in queues]
+
+    first, second = asyncio.run(stream())
+    assert first is second
+    assert first.startswith("event: delta\n")
+    assert json.loads(first.split("data: ")[1]) == {"version": 1, "changes": {"pins": {"a": {"9": 1}}}}
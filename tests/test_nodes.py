@@ -0,0 +1,91 @@
+"""Tests for per-node serial ports and the arduinos table upgrade"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import app
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db():
+    session = app.SessionLocal()
+    yield session
+    session.rollback()
+    session.query(app.Arduino).filter(app.Arduino.name.like("node-%")).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+
+def test_local_boards_cannot_share_a_port(db):
+    db.add(app.Arduino(name="node-a", serial_port="/dev/fake-node"))
+    db.commit()
+    db.add(app.Arduino(name="node-b", serial_port="/dev/fake-node", node=app.node_key(app.NODE_NAME)))
+    with pytest.raises(IntegrityError):
+        db.commit()
+
+
+def test_same_port_on_two_nodes(db):
+    db.add_all([app.Arduino(name="node-a", serial_port="/dev/ttyUSB0"),
+                app.Arduino(name="node-b", serial_port="/dev/ttyUSB0", node="rack2")])
+    db.commit()
+
+
+def test_api_rejects_a_local_port_twice(client, board):
+    response = client.post("/api/arduinos", json={"name": "node-dup", "serial_port": board["serial_port"],
+                                                  "node": app.NODE_NAME})
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def old_database(tmp_path, monkeypatch):
+    """Point app at a database created by a version with UNIQUE(serial_port)"""
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE arduinos (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+                          "serial_port VARCHAR NOT NULL UNIQUE, board_type VARCHAR)"))
+        conn.execute(text("INSERT INTO arduinos (name, serial_port) VALUES ('old-a', '/dev/ttyUSB0')"))
+    monkeypatch.setattr(app, "engine", engine)
+    return engine
+
+
+def test_upgrade_rebuilds_the_old_unique_constraint(old_database):
+    app.setup_database()
+    inspector = inspect(old_database)
+    assert not any(c["column_names"] == ["serial_port"] for c in inspector.get_unique_constraints("arduinos"))
+    with old_database.begin() as conn:
+        assert conn.execute(text("SELECT name, node FROM arduinos")).all() == [("old-a", "")]
+        conn.execute(text("INSERT INTO arduinos (name, serial_port, node) VALUES ('old-b', '/dev/ttyUSB0', 'rack2')"))
+        with pytest.raises(IntegrityError):
+            conn.execute(text("INSERT INTO arduinos (name, serial_port, node) VALUES ('old-c', '/dev/ttyUSB0', '')"))
+
+
+def test_upgrade_fails_on_duplicate_local_ports(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/dup.db")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE arduinos (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+                          "serial_port VARCHAR NOT NULL, board_type VARCHAR, hwid VARCHAR, node VARCHAR)"))
+        conn.execute(text("INSERT INTO arduinos (name, serial_port) VALUES ('a', '/dev/ttyUSB0'), ('b', '/dev/ttyUSB0')"))
+    monkeypatch.setattr(app, "engine", engine)
+    with pytest.raises(RuntimeError, match="/dev/ttyUSB0"):
+        app.setup_database()
+
+
+def test_agent_mode_creates_no_database(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    agent = subprocess.Popen([sys.executable, "-u", os.path.join(REPO, "app.py"), "--agent", "ws://127.0.0.1:9/ws/node"],
+                             cwd=tmp_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        assert any("Starting BlueLink agent" in line for line in agent.stdout)
+        time.sleep(0.2)
+    finally:
+        agent.kill()
+        agent.wait()
+    assert not os.path.exists(tmp_path / "bluelink.db")
@@ -0,0 +1,63 @@
+"""Tests for mapping profiles and hot-swapping them"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def profiles(client):
+    """Restore the active profile and remove the profiles a test created"""
+    active = next(p for p in client.get("/api/profiles").json() if p["active"])
+    created = []
+    yield created
+    client.post(f"/api/profiles/{active['id']}/activate")
+    for profile_id in created:
+        client.delete(f"/api/profiles/{profile_id}")
+
+
+def create_profile(client, profiles, name, **fields):
+    response = client.post("/api/profiles", json={"name": name, **fields})
+    assert response.status_code == 200, response.text
+    profiles.append(response.json()["id"])
+    return response.json()
+
+
+def test_activating_a_profile_swaps_the_routes(client, board, profiles):
+    client.post("/api/mappings", json={"controller_input": "A", "arduino_id": board["id"], "arduino_pin": "13"})
+    copy = create_profile(client, profiles, "Copy", copy_from=app.routing_table.profile_id)
+    assert copy["mappings"] == 1
+    empty = create_profile(client, profiles, "Empty")
+    client.post("/api/mappings", json={"controller_input": "B", "arduino_id": board["id"],
+                                       "arduino_pin": "12", "profile_id": empty["id"]})
+    # Mappings of an inactive profile are not routed
+    assert "B" not in app.routing_table.routes
+
+    response = client.post(f"/api/profiles/{empty['id']}/activate")
+    assert response.status_code == 200
+    assert response.json()["mappings"] == 1
+    assert set(app.routing_table.routes) == {"B"}
+    assert app.routing_table.profile_id == empty["id"]
+
+    client.post(f"/api/profiles/{copy['id']}/activate")
+    assert set(app.routing_table.routes) == {"A"}
+    assert app.routing_table.routes["A"].pin == "13"
+
+
+def test_active_profile_cannot_be_deleted(client, profiles):
+    active = app.routing_table.profile_id
+    assert client.delete(f"/api/profiles/{active}").status_code == 400
+
+
+def test_profile_names_are_unique(client, profiles):
+    create_profile(client, profiles, "Twice")
+    assert client.post("/api/profiles", json={"name": "Twice"}).status_code == 400
+
+
+def test_shaping_state_survives_an_unrelated_rebuild(make_mapping):
+    lx = app.Route(make_mapping(smoothing=0.5), "b1")
+    first = app.InputShaper({"LX": lx})
+    first.sent(*first.process([0], [1.0], 0.0), 0.0)
+    second = app.InputShaper({"LX": lx, "RX": app.Route(make_mapping(arduino_pin="10"), "b1")}, first)
+    assert second.filtered[0] == first.filtered[0]
+    assert second.last_out[0] == first.last_out[0]
@@ -0,0 +1,115 @@
+"""Tests for BoardReader: line parsing, acknowledgement matching and input telemetry"""
+
+import time
+
+import app
+
+
+def telemetry_frame(tick, entries):
+    body = bytes([len(entries), tick >> 8, tick & 0xFF])
+    body += b"".join(bytes((pin, value >> 8, value & 0xFF)) for pin, value in entries)
+    checksum = 0
+    for b in body:
+        checksum ^= b
+    return bytes([app.TELEMETRY_START]) + body + bytes([checksum])
+
+
+def make_reader(fake_serial, inputs=None):
+    reader = app.BoardReader("test", fake_serial, lambda name: None, inputs)
+    reader.running = False
+    reader.thread.join()
+    return reader
+
+
+def test_ack_kind():
+    assert app.ack_kind("SET PIN 13 TO 1") == "SET"
+    assert app.ack_kind("FRAME 3") == "FRAME"
+    assert app.ack_kind("DIGITAL_PINS:2-13") == "INFO"
+    assert app.ack_kind("STEPPER 8 QUEUED POS 10 QUEUE 1") == "STEPPER"
+    assert app.ack_kind("STEPPER 8 STOPPED POS 10 QUEUE 0") == "STEPPER_STOP"
+    assert app.ack_kind("STEPPER 8 DONE POS 10 QUEUE 0") is None
+    assert app.ack_kind("SAMPLING:2 PINS") is None
+
+
+def test_lines_split_across_reads(fake_serial):
+    reader = make_reader(fake_serial)
+    reader.expect(["SET", "PWM"])
+    buffer = bytearray()
+    for piece in (b"STATUS:SET PIN", b" 3 TO 1\r\nSTATUS:PW", b"M PIN 9 TO 5\r\nDebug output\r\nSTATUS:"):
+        buffer += piece
+        reader._parse(buffer)
+    assert buffer == b"STATUS:"
+    assert reader.stats["lines"] == 3
+    assert reader.stats["acked"] == 2
+    assert not reader.outstanding
+    assert [event["type"] for event in reader.events] == ["ack", "ack", "output"]
+
+
+def test_skipped_command_counts_as_lost(fake_serial):
+    reader = make_reader(fake_serial)
+    reader.expect(["SET", "PWM"])
+    reader._handle("STATUS:PWM PIN 9 TO 5")
+    assert reader.stats["acked"] == 1
+    assert reader.stats["lost"] == 1
+
+
+def test_rejected_command_stops_waiting(fake_serial):
+    reader = make_reader(fake_serial)
+    reader.expect(["TEST"])
+    reader._handle("STATUS:UNKNOWN COMMAND: TEST:99")
+    assert reader.stats["unknown"] == 1
+    assert not reader.outstanding
+
+
+def test_ack_that_arrived_before_expect_is_matched(fake_serial):
+    reader = make_reader(fake_serial)
+    sent = time.perf_counter()
+    reader._handle("STATUS:SET PIN 3 TO 1")
+    reader.expect(["SET"], sent)
+    assert reader.stats["acked"] == 1
+    assert not reader.outstanding
+
+
+def test_info_lines_are_kept_until_the_board_restarts(fake_serial):
+    reader = make_reader(fake_serial)
+    reader._handle("STATUS:FRAME_MAX_PAIRS:24")
+    assert reader.info == {"FRAME_MAX_PAIRS": "24"}
+    reader._handle("STATUS:BlueLink Advanced Initialized")
+    assert reader.info == {}
+
+
+def test_reader_parses_lines_and_telemetry_in_pieces(fake_serial):
+    inputs = app.InputBuffer(8)
+    reader = make_reader(fake_serial, inputs)
+    bad = bytearray(telemetry_frame(6, [(0x80, 5)]))
+    bad[-1] ^= 1
+    stream = (b"STATUS:SAMPLE 2 PINS AT 100 HZ\r\n"
+              + telemetry_frame(65530, [(0x80, 1023), (2, 1)])
+              + b"STATUS:FRAME 3\r\n"
+              + telemetry_frame(4, [(0x80, 10)])
+              + bytes(bad)
+              + b"STATUS:FRAME_MAX_PAIRS:24\r\n")
+    buffer = bytearray()
+    for i in range(0, len(stream), 3):
+        buffer += stream[i:i + 3]
+        reader._parse(buffer)
+
+    assert reader.stats["input_frames"] == 2
+    assert reader.stats["bad_frames"] == 1
+    assert reader.info == {"FRAME_MAX_PAIRS": "24"}
+    result = inputs.query()
+    assert result["values"] == {"2": [1, 1], "A0": [1023, 10]}
+    # The board tick is unwrapped past its 16 bit rollover
+    assert result["board_ms"] == [65530, 65540]
+
+
+def test_input_buffer_keeps_the_newest_rows():
+    inputs = app.InputBuffer(4)
+    for tick in range(6):
+        inputs.append(tick * 10, [(3, tick % 2)], received=float(tick))
+    result = inputs.query(since=2.0, pins=["3", "A1"])
+    assert result["frames"] == 6
+    assert result["time"] == [3.0, 4.0, 5.0]
+    assert result["values"] == {"3": [1, 0, 1], "A1": [-1, -1, -1]}
+    assert result["summary"] == {"3": {"min": 0, "max": 1, "mean": 0.67}}
+    assert inputs.query(limit=1)["board_ms"] == [50]
@@ -0,0 +1,70 @@
+"""Tests for recording sends and replaying them"""
+
+import pytest
+
+import app
+from conftest import FakeSerial
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.command_recorder, "directory", str(tmp_path))
+    yield app.command_recorder
+    app.command_recorder.stop()
+
+
+@pytest.fixture
+def recording(recorder, board, wait_for):
+    """A recording of two sends to a board"""
+    recorder.start("test")
+    app.arduino_manager.send_batch(board["name"], ["SET:13:1", "PWM:9:100"])
+    assert wait_for(lambda: board["serial"].writes)
+    app.arduino_manager.send(board["name"], "SET:12:1")
+    return recorder.stop()
+
+
+@pytest.fixture
+def replay_port(monkeypatch):
+    """A free serial port the replayer may open, and the FakeSerial it gets"""
+    opened = {}
+    def open_port(port, baudrate, timeout):
+        opened[port] = FakeSerial(port)
+        return opened[port]
+    monkeypatch.setattr(app.serial, "Serial", open_port)
+    monkeypatch.setattr(app.arduino_manager, "list_ports",
+                        lambda: [{"device": "/dev/fake-replay", "description": "fake", "hwid": None}])
+    return opened
+
+
+def wait_done(wait_for, job):
+    assert wait_for(lambda: job["status"] != "running", timeout=5)
+    return job
+
+
+def test_recording_replays_to_a_port(client, recording, replay_port, wait_for):
+    assert recording["entries"] == 2
+    response = client.post(f"/api/recordings/{recording['id']}/replay", json={"port": "/dev/fake-replay", "speed": 10})
+    assert response.status_code == 200, response.text
+    job = wait_done(wait_for, app.replayer.get(response.json()["id"]))
+    assert (job["status"], job["sent"], job["failed"]) == ("done", 2, 0)
+    written = b"".join(replay_port["/dev/fake-replay"].writes)
+    assert written.startswith(b"INFO\n")
+    assert b"SET:13:1" in written and b"PWM:9:100" in written and written.endswith(b"SET:12:1\n")
+
+
+def test_replay_port_must_be_a_free_local_device(client, recording, replay_port, board):
+    for port in ("socket://127.0.0.1:9", "loop://", board["serial_port"], "/dev/not-a-port"):
+        response = client.post(f"/api/recordings/{recording['id']}/replay", json={"port": port})
+        assert response.status_code == 400, port
+    assert not replay_port
+
+
+def test_running_replays_are_never_evicted(recording, monkeypatch, wait_for):
+    monkeypatch.setattr(app, "REPLAY_JOB_HISTORY", 1)
+    replayer = app.Replayer()
+    slow = replayer.start(recording["id"], speed=0.001)
+    quick = [wait_done(wait_for, replayer.start(recording["id"], speed=100)) for _ in range(3)]
+    assert slow["id"] in replayer.jobs and replayer.jobs[slow["id"]]["status"] == "running"
+    assert quick[0]["id"] not in replayer.jobs
+    replayer.stop(slow["id"])
+    assert wait_done(wait_for, slow)["status"] == "stopped"
@@ -0,0 +1,49 @@
+"""Tests for the in-memory routing table behind the control endpoints"""
+
+from sqlalchemy import event
+
+import app
+
+
+def add_mapping(client, board, **fields):
+    mapping = {"controller_input": "LX", "input_type": "analog", "arduino_id": board["id"],
+               "arduino_pin": "9", "pin_mode": "pwm", **fields}
+    response = client.post("/api/mappings", json=mapping)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_mappings_are_compiled_into_routes(client, board):
+    mapping = add_mapping(client, board)
+    route = app.routing_table.routes["LX"]
+    assert (route.board, route.pin, route.pin_mode) == (board["name"], "9", "pwm")
+    assert "LX" in app.routing_table.shaper.slots
+
+    client.delete(f"/api/mappings/{mapping['id']}")
+    assert "LX" not in app.routing_table.routes
+    assert "LX" not in app.routing_table.shaper.slots
+
+
+def test_deleting_a_board_drops_its_routes(client, board):
+    add_mapping(client, board)
+    client.delete(f"/api/arduinos/{board['id']}")
+    assert "LX" not in app.routing_table.routes
+    assert app.routing_table.board_name(board["id"]) is None
+
+
+def test_streamed_input_makes_no_database_queries(client, board, wait_for):
+    add_mapping(client, board)
+    token = client.headers["Authorization"].split()[1]
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with client.websocket_connect(f"/ws/input?token={token}") as ws:
+        event.listen(app.engine, "before_cursor_execute", count)
+        try:
+            ws.send_json({"events": [{"input": "LX", "value": 1.0}, {"input": "unmapped", "value": 1.0}]})
+            assert wait_for(lambda: any(b"PWM:9:255" in data for data in board["serial"].writes))
+        finally:
+            event.remove(app.engine, "before_cursor_execute", count)
+    assert statements == []
@@ -0,0 +1,111 @@
+"""Tests for input shaping: curves, smoothing, thresholds and rate limits"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def shaper_for(make_mapping):
+    def build(**fields):
+        return app.InputShaper({"LX": app.Route(make_mapping(**fields), "b1")})
+    return build
+
+
+@pytest.fixture
+def writer(monkeypatch, fake_serial):
+    writer = app.BoardWriter("b1", fake_serial, lambda name: None)
+    monkeypatch.setitem(app.arduino_manager.writers, "b1", writer)
+    yield writer
+    writer.close()
+
+
+def test_parse_curve():
+    assert app.parse_curve(None) == (0.0, None)
+    assert app.parse_curve("expo:0.5") == (0.5, None)
+    expo, (xs, ys) = app.parse_curve("points:0,0 0.5,0.2 1,1")
+    assert expo == 0.0 and list(xs) == [0, 0.5, 1] and list(ys) == [0, 0.2, 1]
+    for bad in ("expo:2", "points:0,0", "points:0.5,0 0.2,1", "sine"):
+        with pytest.raises(ValueError):
+            app.parse_curve(bad)
+
+
+def test_deadzone_and_scaling(shaper_for):
+    shaper = shaper_for(deadzone=0.2)
+    slots, outputs = shaper.process([0], [0.1], 0.0)
+    assert outputs.tolist() == [128]
+    shaper.sent(slots, outputs, 0.0)
+    slots, outputs = shaper.process([0], [1.0], 0.0)
+    assert outputs.tolist() == [255]
+
+
+def test_smoothing_converges_to_goal(shaper_for):
+    shaper = shaper_for(smoothing=0.9)
+    shaper.sent(*shaper.process([0], [-1.0], 0.0), 0.0)
+    for step in range(1000):
+        slots, outputs = shaper.process([0], [1.0], float(step))
+        if len(slots):
+            shaper.sent(slots, outputs, float(step))
+        if not shaper.settling([0])[0]:
+            break
+    assert shaper.last_out[0] == shaper.goal[0] == 255
+
+
+def test_rate_limit_holds_value_until_due(shaper_for):
+    shaper = shaper_for(max_rate_hz=10)
+    shaper.sent(*shaper.process([0], [0.0], 0.0), 0.0)
+    slots, _ = shaper.process([0], [1.0], 0.05)
+    assert len(slots) == 0 and shaper.settling([0])[0]
+    slots, outputs = shaper.process([0], [1.0], 0.1)
+    assert outputs.tolist() == [255]
+    shaper.sent(slots, outputs, 0.1)
+    assert not shaper.settling([0])[0]
+
+
+def test_rate_limit_is_shared_by_routes_on_the_same_pin(make_mapping):
+    shaper = app.InputShaper({
+        "LX": app.Route(make_mapping(max_rate_hz=10), "b1"),
+        "RX": app.Route(make_mapping(), "b1"),
+        "LY": app.Route(make_mapping(arduino_pin="10"), "b1"),
+    })
+    shaper.sent(*shaper.process([0], [0.5], 0.0), 0.0)
+    # Pin 9 was just written, so RX waits too; pin 10 is independent
+    slots, _ = shaper.process([1, 2], [1.0, 1.0], 0.05)
+    assert slots.tolist() == [2]
+    slots, _ = shaper.process([1], [1.0], 0.1)
+    assert slots.tolist() == [1]
+
+
+def test_axis_on_a_digital_pin_is_low_at_rest(shaper_for):
+    shaper = shaper_for(pin_mode="digital")
+    assert shaper.process([0], [0.0], 0.0)[1].tolist() == [0]
+    assert shaper.process([0], [0.4], 0.0)[1].tolist() == [0]
+    assert shaper.process([0], [0.6], 0.0)[1].tolist() == [1]
+    assert shaper.process([0], [-1.0], 0.0)[1].tolist() == [0]
+
+
+def test_inverted_axis_on_a_digital_pin_presses_the_other_way(shaper_for):
+    shaper = shaper_for(pin_mode="digital", invert=True)
+    assert shaper.process([0], [0.0], 0.0)[1].tolist() == [0]
+    assert shaper.process([0], [1.0], 0.0)[1].tolist() == [0]
+    assert shaper.process([0], [-0.6], 0.0)[1].tolist() == [1]
+
+
+def test_inverted_button_flips_the_level(shaper_for):
+    shaper = shaper_for(pin_mode="digital", input_type="digital", invert=True)
+    assert shaper.process([0], [0.0], 0.0)[1].tolist() == [1]
+    assert shaper.process([0], [1.0], 0.0)[1].tolist() == [0]
+
+
+def test_held_back_output_is_flushed_without_the_control_loop(monkeypatch, make_mapping, writer, wait_for):
+    route = app.Route(make_mapping(max_rate_hz=20), "b1")
+    monkeypatch.setattr(app.routing_table, "shaper", app.InputShaper({"LX": route}))
+    monkeypatch.setattr(app, "SHAPING_FLUSH_HZ", 200)
+    loop = app.ControlLoop(0)
+    loop.start()
+    assert not loop.running
+    loop.feed({"LX": 0.0})
+    loop.feed({"LX": 1.0})  # inside the rate limit, held back
+    assert writer.pins.get("9") != 255
+    assert wait_for(lambda: writer.pins.get("9") == 255)
+    assert wait_for(lambda: loop.flusher is None)
@@ -0,0 +1,73 @@
+"""Tests for stepper tracking of moves sent by the API and by mappings"""
+
+import time
+
+import app
+
+
+def press_and_release(count):
+    for i in range(count):
+        app.route_inputs({"A": 1.0}, float(2 * i))
+        app.route_inputs({"A": 0.0}, float(2 * i + 1))
+
+
+def test_mapped_stepper_presses_are_tracked_and_stop_at_a_full_queue(monkeypatch, fake_serial, make_mapping,
+                                                                    wait_for):
+    route = app.Route(make_mapping(input_type="digital", arduino_pin="8", pin_mode="stepper",
+                                   stepper_pin2="9", stepper_pin3="10", stepper_pin4="11",
+                                   stepper_steps=200, stepper_speed=1), "b1")
+    monkeypatch.setattr(app.routing_table, "shaper", app.InputShaper({"A": route}))
+    writer = app.BoardWriter("b1", fake_serial, lambda name: None)
+    monkeypatch.setitem(app.arduino_manager.writers, "b1", writer)
+    try:
+        # One move running plus a full queue; the press after that is dropped
+        press_and_release(app.STEPPER_QUEUE_SIZE + 2)
+        state = app.stepper_tracker.state("b1")["8"]
+        assert state["queue_depth"] == app.STEPPER_QUEUE_SIZE
+        assert state["target"] == 200 * (app.STEPPER_QUEUE_SIZE + 1)
+        move = b"STEPPER:8,9,10,11:200:1\n"
+        assert wait_for(lambda: b"".join(fake_serial.writes).count(move) == app.STEPPER_QUEUE_SIZE + 1)
+    finally:
+        writer.close()
+        app.stepper_tracker.forget("b1")
+
+
+def test_connect_asks_for_stepper_positions(monkeypatch, wait_for):
+    opened = []
+
+    def open_port(port, baudrate, timeout):
+        opened.append(FakePort(port))
+        return opened[-1]
+
+    class FakePort:
+        in_waiting = 0
+
+        def __init__(self, port):
+            self.port = port
+            self.data = b""
+
+        def write(self, data):
+            self.data += data
+            return len(data)
+
+        def read(self, size):
+            time.sleep(0.01)
+            return b""
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(app.serial, "Serial", open_port)
+    try:
+        assert app.arduino_manager.connect("stepper-board", "/dev/fake-stepper", hwid="")
+        assert wait_for(lambda: opened[0].data == b"INFO\nSTEPPERS\n")
+    finally:
+        app.arduino_manager.forget("stepper-board")
+
+
+def test_reported_idle_position_resyncs_the_tracker():
+    app.stepper_tracker.enqueue("b2", "8", 500, 1)
+    app.stepper_tracker.observe("b2", "8", 120, 0)
+    assert app.stepper_tracker.state("b2")["8"] == {"position": 120, "target": 120,
+                                                    "moving": False, "queue_depth": 0}
+    app.stepper_tracker.forget("b2")
@@ -0,0 +1,46 @@
+"""Tests for the ArduinoManager supervisor that reconnects boards"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def manager(monkeypatch, fake_serial):
+    monkeypatch.setattr(app, "RECONNECT_INTERVAL", 0.01)
+    monkeypatch.setattr(app.serial, "Serial", lambda port, baudrate, timeout: fake_serial)
+    manager = app.ArduinoManager()
+    yield manager
+    for name in list(manager.registry):
+        manager.forget(name)
+
+
+def register(manager, name, port):
+    manager.registry[name] = {"port": port, "hwid": None, "node": None, "failures": 0, "next_retry": 0.0}
+
+
+def test_board_reconnects_after_connect_raised(manager, monkeypatch, wait_for):
+    connect = manager.connect
+    calls = []
+
+    def flaky_connect(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return connect(*args)
+
+    monkeypatch.setattr(manager, "connect", flaky_connect)
+    register(manager, "b1", "/dev/fake0")
+    manager.start_supervisor()
+    assert wait_for(lambda: "b1" in manager.connections, timeout=3)
+    assert len(calls) == 2
+    assert manager.supervisor.is_alive()
+
+
+def test_lost_board_is_reconnected(manager, wait_for):
+    assert manager.connect("b1", "/dev/fake0", hwid="")
+    manager.start_supervisor()
+    first = manager.writers["b1"]
+    manager._connection_lost("b1")
+    assert wait_for(lambda: manager.writers.get("b1") not in (None, first), timeout=3)
+    assert manager.registry["b1"]["failures"] == 0
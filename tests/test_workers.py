@@ -0,0 +1,61 @@
+"""Tests for the owner/worker socket used by --workers"""
+
+import os
+import socket
+import tempfile
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def owner():
+    server = app.OwnerServer(os.path.join(tempfile.mkdtemp(prefix="bluelink-test-"), "owner.sock"))
+    server.start()
+    yield server
+    app.state_mirror.listeners.pop()
+    os.unlink(server.path)
+
+
+@pytest.fixture
+def worker(owner):
+    return app.OwnerClient(owner.path)
+
+
+def test_messages_are_plain_json():
+    left, right = socket.socketpair()
+    app.ipc_send(left, ["call", {"pins"}, (1, 2), b"\x00\xffhex"])
+    assert app.ipc_recv(right) == ["call", ["pins"], [1, 2], b"\x00\xffhex"]
+    with pytest.raises(TypeError):
+        app.ipc_send(left, [object()])
+
+
+def test_calls_run_in_the_owner(worker):
+    assert worker.request("call", "login_limiter", "retry_after", ("ipc-user", "10.0.0.1"), {}) == 0
+    assert worker.request("state")["version"] == app.state_mirror.version
+
+
+def test_errors_keep_their_type(worker):
+    with pytest.raises(FileNotFoundError):
+        worker.request("call", "replayer", "start", ["nosuchrecording"], {})
+    with pytest.raises(AttributeError, match="not available"):
+        worker.request("call", "arduino_manager", "disconnect_all", [], {})
+
+
+def test_non_json_request_closes_the_connection(owner, wait_for):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(owner.path)
+    payload = b"\x80\x05not json"
+    sock.sendall(app.IPC_HEADER.pack(len(payload)) + payload)
+    sock.settimeout(1)
+    assert sock.recv(1) == b""
+
+
+def test_worker_metrics_are_dropped_with_the_connection(owner, worker, wait_for):
+    app.metric_commands.inc(board="ipc-board", kind="SET")
+    text = worker.request("metrics", 4242, app.metrics.snapshot(), True)
+    assert 'board="ipc-board"' in text
+    assert 4242 in owner.worker_metrics
+    worker.local.sock.close()
+    assert wait_for(lambda: 4242 not in owner.worker_metrics)
@@ -0,0 +1,80 @@
+"""Tests for BoardWriter: coalescing, write order and binary frames"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def writer(fake_serial):
+    writes = []
+    w = app.BoardWriter("test", fake_serial, lambda name: None,
+                        on_write=lambda kinds, started: writes.append(kinds))
+    w.kinds = writes
+    yield w
+    w.close()
+
+
+def write_once(writer, commands):
+    writer.ser.written.clear()
+    writer.submit_many(commands)
+    assert writer.ser.written.wait(1)
+    return writer.ser.writes[-1]
+
+
+def test_latest_value_per_pin_wins(writer):
+    assert write_once(writer, ["PWM:9:1", "PWM:9:2", "SET:8:1", "PWM:9:3"]) == b"SET:8:1\nPWM:9:3\n"
+    assert writer.stats["coalesced"] == 2
+    assert writer.pins == {"8": 1, "9": 3}
+
+
+def test_pin_changing_kind_keeps_the_latest_command(writer):
+    # PWM 50 must not go out before the SET it replaced
+    assert write_once(writer, ["PWM:9:100", "SET:9:1", "PWM:9:50"]) == b"PWM:9:50\n"
+    assert writer.pins == {"9": 50}
+
+
+def test_replaced_value_goes_out_after_commands_queued_before_it(writer):
+    assert write_once(writer, ["SET:9:1", "TEST:3", "SET:9:0"]) == b"TEST:3\nSET:9:0\n"
+
+
+def test_other_commands_are_never_coalesced(writer):
+    assert write_once(writer, ["TEST:3", "TEST:3"]) == b"TEST:3\nTEST:3\n"
+    assert writer.stats["coalesced"] == 0
+
+
+def test_encode_frames_checksum_and_split():
+    data = app.encode_frames([(9 | app.FRAME_PWM_FLAG, 128), (13, 1), (2, 0)], max_pairs=2)
+    assert data[:7] == bytes([app.FRAME_START, 2, 0x89, 128, 13, 1, 2 ^ 0x89 ^ 128 ^ 13 ^ 1])
+    assert data[7:] == bytes([app.FRAME_START, 1, 2, 0, 1 ^ 2 ^ 0])
+
+
+def test_frame_pair():
+    assert app.frame_pair("PWM", "9", "300") == (9 | app.FRAME_PWM_FLAG, 255)
+    assert app.frame_pair("SET", "13", "5") == (13, 1)
+    assert app.frame_pair("SET", "A0", "1") is None
+    assert app.frame_pair("PWM", "9", "fast") is None
+
+
+def test_writer_sends_text_until_board_reports_frames(writer):
+    assert write_once(writer, ["SET:8:1", "PWM:9:5"]) == b"SET:8:1\nPWM:9:5\n"
+    writer.board_info("FRAME_MAX_PAIRS", "24")
+    assert write_once(writer, ["SET:8:0", "PWM:9:6"]) == app.encode_frames([(8, 0), (9 | app.FRAME_PWM_FLAG, 6)])
+    writer.board_reset()
+    assert write_once(writer, ["SET:8:1"]) == b"INFO\nSET:8:1\n"
+
+
+def test_writer_keeps_queue_order_around_text_lines(writer):
+    writer.board_info("FRAME_MAX_PAIRS", "1")
+    data = write_once(writer, ["SET:8:1", "SET:7:1", "TEST:3", "PWM:9:5"])
+    assert data == (app.encode_frames([(8, 1)]) + app.encode_frames([(7, 1)]) + b"TEST:3\n"
+                    + app.encode_frames([(9 | app.FRAME_PWM_FLAG, 5)]))
+    assert writer.kinds[-1] == ["FRAME", "FRAME", "TEST", "FRAME"]
+    assert writer.pins == {"8": 1, "7": 1, "9": 5}
+
+
+def test_frame_holds_the_latest_kind_of_a_pin(writer):
+    writer.board_info("FRAME_MAX_PAIRS", "24")
+    data = write_once(writer, ["PWM:9:100", "SET:8:1", "SET:9:1", "PWM:9:50"])
+    assert data == app.encode_frames([(8, 1), (9 | app.FRAME_PWM_FLAG, 50)])
+    assert writer.pins == {"8": 1, "9": 50}